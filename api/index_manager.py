@@ -0,0 +1,399 @@
+"""
+Hot-swappable index holders for the API
+Loads and warms up indexes on a background thread, swaps them in
+atomically and releases the previous index once the searches still
+using it have finished; a registry serves several named indexes
+under a memory budget
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class LoadedIndex:
+    """
+    One loaded index generation and the searches currently using it
+
+    Attributes:
+        index: FAISSIndex or ShardedFAISSIndex (None once released)
+        scene_index: Optional SceneIndex saved next to it
+        directory: Directory it was loaded from
+        generation: Increasing load counter, set on swap
+        memory_bytes: Approximate in-memory size, estimated on load
+        mapped_bytes: Approximate size of memory-mapped index files (page
+                      cache shared between processes, not in memory_bytes)
+        refs: In-flight searches holding this generation
+        retired: Replaced by a newer generation
+        released: Set once retired and no longer in use
+    """
+
+    def __init__(self, index, scene_index=None):
+        self.index = index
+        self.scene_index = scene_index
+        self.directory: Optional[str] = None
+        self.generation = 0
+        self.memory_bytes = 0
+        self.mapped_bytes = 0
+        self.refs = 0
+        self.retired = False
+        self.released = threading.Event()
+
+    def close(self):
+        """Drop the index so its memory (or mapped files) can be freed"""
+        self.index = None
+        self.scene_index = None
+        self.released.set()
+
+
+class IndexManager:
+    """
+    Serves the current index to searches and replaces it without blocking them
+
+    Loads run one at a time on a dedicated worker thread. A new index is
+    warmed up with a few random queries before it becomes visible, and
+    the swap is a single reference assignment under a lock, so every
+    search sees either the old or the new index for its whole duration.
+    """
+
+    def __init__(
+        self,
+        load_fn: Callable[[str], LoadedIndex],
+        warmup_queries: int = 8,
+        warmup_k: int = 10
+    ):
+        """
+        Args:
+            load_fn: Loads (and validates) the index in a directory;
+                     runs on the loader thread
+            warmup_queries: Random queries run before swapping in (0 = none)
+            warmup_k: Neighbours per warm-up query
+        """
+        self.load_fn = load_fn
+        self.warmup_queries = warmup_queries
+        self.warmup_k = warmup_k
+
+        self._lock = threading.Lock()
+        self._current: Optional[LoadedIndex] = None
+        self._retiring: set = set()  # Retired generations still in use
+        self._generation = 0
+        self._pending = 0  # Loads submitted but not finished
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='index-loader')
+
+    @property
+    def current(self) -> Optional[LoadedIndex]:
+        """Generation new searches will use"""
+        return self._current
+
+    def load(self, directory: str) -> Future:
+        """
+        Load an index in the background and swap it in when ready
+
+        If loading or warm-up fails, the current index stays in place and
+        the future raises the error.
+
+        Args:
+            directory: Index directory passed to load_fn
+
+        Returns:
+            Future resolving to the new LoadedIndex once it is being served
+        """
+        with self._lock:
+            self._pending += 1
+        return self._executor.submit(self._load, directory)
+
+    def _load(self, directory: str) -> LoadedIndex:
+        try:
+            start = time.perf_counter()
+            loaded = self.load_fn(directory)
+            loaded.directory = directory
+            self._warm_up(loaded)
+            self._measure(loaded)
+            logger.info(f"Loaded index from {directory} in {time.perf_counter() - start:.2f}s")
+            self._swap(loaded)
+            return loaded
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _warm_up(self, loaded: LoadedIndex):
+        """Run random queries so first real searches do not pay page faults and lazy init"""
+        index = loaded.index
+        if not self.warmup_queries or not index.ntotal:
+            return
+
+        rng = np.random.default_rng(0)
+        queries = rng.standard_normal((self.warmup_queries, index.embedding_dim)).astype(np.float32)
+        index.search(queries, min(self.warmup_k, index.ntotal))
+
+    @staticmethod
+    def _measure(loaded: LoadedIndex):
+        """Estimate memory use from index structure (no copy, no page faults on mapped files)"""
+        resident = loaded.index.memory_usage()
+        loaded.mapped_bytes = int(loaded.index.memory_usage(include_mapped=True) - resident)
+        if loaded.scene_index is not None:
+            resident += loaded.scene_index.prototypes.nbytes
+        loaded.memory_bytes = int(resident)
+
+    def _swap(self, loaded: Optional[LoadedIndex]):
+        """Make loaded the current generation and retire the previous one"""
+        with self._lock:
+            if loaded is not None:
+                self._generation += 1
+                loaded.generation = self._generation
+            previous, self._current = self._current, loaded
+
+            release = False
+            if previous is not None:
+                previous.retired = True
+                release = previous.refs == 0
+                if not release:
+                    self._retiring.add(previous)
+
+        if release:
+            self._release(previous)
+
+    @contextmanager
+    def acquire(self) -> Iterator[LoadedIndex]:
+        """
+        Hold the current generation for the duration of a search
+
+        Raises:
+            LookupError: No index has been loaded yet
+        """
+        with self._lock:
+            loaded = self._current
+            if loaded is None:
+                raise LookupError("No index loaded")
+            loaded.refs += 1
+
+        try:
+            yield loaded
+        finally:
+            with self._lock:
+                loaded.refs -= 1
+                release = loaded.retired and loaded.refs == 0
+                if release:
+                    self._retiring.discard(loaded)
+
+            if release:
+                self._release(loaded)
+
+    def unload(self):
+        """Stop serving the current index; it is released once its searches finish"""
+        self._swap(None)
+
+    def _release(self, loaded: LoadedIndex):
+        logger.info(f"Released index generation {loaded.generation} ({loaded.directory})")
+        loaded.close()
+
+    def status(self) -> Dict:
+        """Current generation, in-flight searches and background work"""
+        with self._lock:
+            current = self._current
+            return {
+                'loading': self._pending > 0,
+                'generation': current.generation if current else 0,
+                'directory': current.directory if current else None,
+                'in_flight': current.refs if current else 0,
+                'retiring': len(self._retiring),
+            }
+
+    def shutdown(self):
+        """Stop the loader thread (pending loads are abandoned)"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class IndexRegistry:
+    """
+    Named indexes (e.g. per region or model version), each hot-swappable
+
+    Indexes are kept in least-recently-used order. After a load, the
+    least recently searched other indexes are unloaded until the total
+    measured size fits memory_budget_bytes.
+    """
+
+    def __init__(
+        self,
+        load_fn: Callable[[str], LoadedIndex],
+        memory_budget_bytes: Optional[int] = None,
+        warmup_queries: int = 8,
+        warmup_k: int = 10
+    ):
+        """
+        Args:
+            load_fn: Loads (and validates) the index in a directory
+            memory_budget_bytes: Total size of loaded indexes (None = unlimited)
+            warmup_queries: Random queries run on each new index
+            warmup_k: Neighbours per warm-up query
+        """
+        self.load_fn = load_fn
+        self.memory_budget_bytes = memory_budget_bytes
+        self.warmup_queries = warmup_queries
+        self.warmup_k = warmup_k
+
+        self._lock = threading.Lock()
+        self._managers: 'OrderedDict[str, IndexManager]' = OrderedDict()  # LRU first
+        self._last_used: Dict[str, float] = {}
+
+    def names(self) -> List[str]:
+        """Names of indexes currently served"""
+        with self._lock:
+            return [name for name, manager in self._managers.items() if manager.current is not None]
+
+    def load(self, name: str, directory: str) -> Future:
+        """
+        Load (or reload) a named index in the background
+
+        Returns:
+            Future resolving to the LoadedIndex once served and the
+            memory budget has been enforced
+        """
+        with self._lock:
+            manager = self._managers.get(name)
+            if manager is None:
+                manager = IndexManager(self.load_fn, self.warmup_queries, self.warmup_k)
+                self._managers[name] = manager
+            self._touch(name)
+
+        result = Future()
+
+        def loaded(future: Future):
+            if future.cancelled():
+                result.cancel()
+                return
+            error = future.exception()
+            if error is not None:
+                result.set_exception(error)
+                return
+            try:
+                self._evict(keep=name)
+            except Exception as e:
+                # Raised in a done-callback: resolve the future or wait=true hangs
+                logger.error(f"Eviction after loading index {name} failed: {e}")
+                result.set_exception(e)
+                return
+            result.set_result(future.result())
+
+        manager.load(directory).add_done_callback(loaded)
+        return result
+
+    def unload(self, name: str):
+        """
+        Stop serving a named index
+
+        Raises:
+            KeyError: Unknown index name
+        """
+        if not self._drop(name):
+            raise KeyError(name)
+
+    def _drop(self, name: str) -> bool:
+        """Unload a named index; False if it is already gone (e.g. unloaded concurrently)"""
+        with self._lock:
+            manager = self._managers.pop(name, None)
+            self._last_used.pop(name, None)
+        if manager is None:
+            return False
+
+        manager.unload()
+        manager.shutdown()
+        logger.info(f"Unloaded index {name}")
+        return True
+
+    def _touch(self, name: str):
+        """Mark an index most recently used (lock held)"""
+        self._managers.move_to_end(name)
+        self._last_used[name] = time.time()
+
+    def memory_usage(self) -> int:
+        """Total estimated in-memory size of served indexes in bytes (memory-mapped files excluded)"""
+        with self._lock:
+            managers = list(self._managers.values())
+        return sum(manager.current.memory_bytes for manager in managers if manager.current is not None)
+
+    def _evict(self, keep: str):
+        """Unload least recently used indexes (other than keep) until under budget"""
+        if self.memory_budget_bytes is None:
+            return
+
+        while self.memory_usage() > self.memory_budget_bytes:
+            with self._lock:
+                victims = [name for name, manager in self._managers.items()
+                           if name != keep and manager.current is not None]
+            if not victims:
+                logger.warning(f"Index {keep} alone exceeds the memory budget")
+                return
+
+            logger.info(f"Evicting index {victims[0]} (memory budget {self.memory_budget_bytes} bytes)")
+            self._drop(victims[0])
+
+    @contextmanager
+    def acquire(self, names: Optional[List[str]] = None) -> Iterator[Dict[str, LoadedIndex]]:
+        """
+        Hold the current generation of several indexes for one search
+
+        Args:
+            names: Index names (None = all served indexes)
+
+        Yields:
+            Dict of name -> LoadedIndex
+
+        Raises:
+            KeyError: Unknown or not yet loaded index name
+            LookupError: No index loaded at all
+        """
+        with self._lock:
+            if names is None:
+                names = [name for name, manager in self._managers.items() if manager.current is not None]
+                if not names:
+                    raise LookupError("No index loaded")
+            missing = [name for name in names if name not in self._managers]
+            if missing:
+                raise KeyError(f"Unknown index: {', '.join(missing)}")
+            managers = {name: self._managers[name] for name in names}
+            for name in names:
+                self._touch(name)
+
+        with ExitStack() as stack:
+            held = {}
+            for name, manager in managers.items():
+                try:
+                    held[name] = stack.enter_context(manager.acquire())
+                except LookupError:
+                    raise KeyError(f"Index not loaded yet: {name}") from None
+            yield held
+
+    def describe(self) -> List[Dict]:
+        """Per-index status, least recently used first"""
+        with self._lock:
+            items = list(self._managers.items())
+            last_used = dict(self._last_used)
+
+        report = []
+        for name, manager in items:
+            current = manager.current
+            report.append(dict(
+                manager.status(),
+                name=name,
+                total_vectors=current.index.ntotal if current else 0,
+                memory_bytes=current.memory_bytes if current else 0,
+                mapped_bytes=current.mapped_bytes if current else 0,
+                last_used=last_used.get(name),
+            ))
+        return report
+
+    def shutdown(self):
+        """Stop all loader threads"""
+        with self._lock:
+            managers = list(self._managers.values())
+        for manager in managers:
+            manager.shutdown()
@@ -7,7 +7,8 @@ from fastapi import FastAPI, UploadFile, File, Form, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, FileResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Optional
+import asyncio
 import yaml
 import torch
 import numpy as np
@@ -22,9 +23,15 @@ sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from engine import (
     read_tiff, write_tiff, normalize_bands, get_rgb_preview,
-    get_embedder, FAISSIndex, CandidateRetriever,
+    get_embedder, load_any_index, CandidateRetriever, SceneIndex,
+    build_provenance, IndexCompatibilityError,
     soft_nms, write_submission_file
 )
+from engine.embedder import extract_embeddings
+from engine.index_format import compatibility_issues
+from engine.tiler import route_scales
+from engine.batcher import MicroBatcher
+from api.index_manager import IndexRegistry, LoadedIndex
 
 # Initialize FastAPI app
 app = FastAPI(title="PS-03 Visual Search API", version="1.0.0")
@@ -41,7 +48,10 @@ app.add_middleware(
 # Global state
 CONFIG = None
 EMBEDDER = None
-FAISS_INDEX = None
+EMBEDDER_PROVENANCE = None  # What loaded indexes must have been built with (one model version per process)
+EMBED_BATCHER = None
+INDEX_REGISTRY = None  # Named indexes; loads swap them in the background
+DEFAULT_INDEX = "default"
 TEMP_DIR = Path(tempfile.gettempdir()) / "ps03_api"
 TEMP_DIR.mkdir(exist_ok=True)
 
@@ -53,6 +63,13 @@ class SearchRequest(BaseModel):
     top_k: Optional[int] = 100
     similarity_threshold: Optional[float] = 0.7
     nms_threshold: Optional[float] = 0.5
+    ef_search: Optional[int] = None  # HNSW search list size override
+    nprobe: Optional[int] = None  # IVF clusters searched override
+    image_ids: Optional[List[str]] = None  # Restrict search to these target scenes
+    search_mode: Optional[str] = None  # 'knn' or 'range', overrides config
+    index_names: Optional[List[str]] = None  # Indexes to search and merge (None = all loaded)
+    scene_budget: Optional[int] = None  # Search only the top-ranked scenes, overrides config
+    fusion: Optional[str] = None  # 'mean', 'max', 'rrf', 'prototype' or 'none', overrides config
 
 
 class DetectionResponse(BaseModel):
@@ -74,7 +91,7 @@ class SearchResponse(BaseModel):
 @app.on_event("startup")
 async def startup_event():
     """Load configuration and models on startup"""
-    global CONFIG, EMBEDDER, FAISS_INDEX
+    global CONFIG, EMBEDDER, EMBEDDER_PROVENANCE, EMBED_BATCHER, INDEX_REGISTRY
     
     # Load config
     config_path = Path("configs/default.yaml")
@@ -112,12 +129,88 @@ async def startup_event():
             device=device
         )
         print(f"✓ Embedder loaded on {device}")
+        EMBEDDER_PROVENANCE = build_provenance(CONFIG, CONFIG['embedder'].get('checkpoint'))
     except Exception as e:
         print(f"Warning: Could not load embedder: {e}")
     
+    # Coalesce concurrent /search embedding requests into batched forward passes
+    if EMBEDDER is not None:
+        batching = CONFIG.get('api', {}).get('batching', {})
+        precision = CONFIG['embedder'].get('precision', 'fp32')
+        EMBED_BATCHER = MicroBatcher(
+            lambda batch: extract_embeddings(
+                EMBEDDER, batch, batch_size=len(batch), device=device, precision=precision
+            ),
+            max_batch_size=batching.get('max_batch_size', 16),
+            max_latency_ms=batching.get('max_latency_ms', 5.0)
+        )
+        EMBED_BATCHER.start()
+    
+    # Index loads run on a background thread and are warmed up before serving
+    reload = CONFIG.get('api', {}).get('reload', {})
+    budget_mb = CONFIG.get('api', {}).get('registry', {}).get('memory_budget_mb')
+    INDEX_REGISTRY = IndexRegistry(
+        load_index_files,
+        memory_budget_bytes=int(budget_mb * 2 ** 20) if budget_mb else None,
+        warmup_queries=reload.get('warmup_queries', 8),
+        warmup_k=reload.get('warmup_k', 10)
+    )
+    
     print("✓ API ready")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background workers"""
+    if EMBED_BATCHER is not None:
+        EMBED_BATCHER.stop()
+    if INDEX_REGISTRY is not None:
+        INDEX_REGISTRY.shutdown()
+
+
+def load_index_files(index_dir: str) -> LoadedIndex:
+    """Load and validate an index and its scene index (runs on the loader thread)"""
+    index = load_any_index(
+        index_dir, 'faiss_index',
+        mmap=CONFIG.get('faiss', {}).get('mmap', False),
+        verify=CONFIG.get('faiss', {}).get('verify', 'size')
+    )
+    
+    # Refuse indexes whose embeddings the running embedder cannot match
+    if EMBEDDER_PROVENANCE is not None:
+        index.check_compatibility(EMBEDDER_PROVENANCE)
+    
+    scene_index = SceneIndex.load(index_dir) if SceneIndex.exists(index_dir) else None
+    return LoadedIndex(index, scene_index)
+
+
+def check_same_model_version(indexes: Dict[str, LoadedIndex]):
+    """
+    Refuse to search indexes built by different model versions together
+    
+    Chips are embedded once per request, so every searched index must
+    match the same embedder. Indexes missing provenance fields are not
+    caught by the load-time check against EMBEDDER_PROVENANCE, so their
+    recorded provenance is compared with each other here.
+    
+    Raises:
+        IndexCompatibilityError: Two indexes disagree on the embedder
+    """
+    provenances = []
+    for name, loaded in indexes.items():
+        shards = getattr(loaded.index, 'shards', None)
+        for shard in (shards.values() if shards is not None else [loaded.index]):
+            provenances.append((name, shard.provenance))
+    
+    for name, provenance in provenances[1:]:
+        issues = compatibility_issues(provenance, provenances[0][1])
+        if issues:
+            raise IndexCompatibilityError(
+                f"Indexes {provenances[0][0]} and {name} were built by different model versions "
+                f"and cannot be searched together:\n  " + "\n  ".join(issues)
+            )
+
+
 @app.get("/")
 async def root():
     """Root endpoint"""
@@ -176,38 +269,87 @@ async def get_preview(chip_id: str):
 
 
 @app.post("/load_index")
-async def load_index(index_dir: str = Form(...)):
-    """Load FAISS index from directory"""
-    global FAISS_INDEX
+async def load_index(
+    index_dir: str = Form(...),
+    name: str = Form(DEFAULT_INDEX),
+    wait: bool = Form(True)
+):
+    """
+    Load FAISS index from directory under a name
+    
+    The index is loaded and warmed up on a background thread, then
+    swapped in atomically; searches keep using the previous index of
+    that name until then. With wait=false the request returns
+    immediately (202). Least recently used indexes are unloaded when
+    the memory budget is exceeded.
+    """
+    index_path = Path(index_dir)
+    if not index_path.exists():
+        raise HTTPException(status_code=404, detail="Index directory not found")
+    
+    future = INDEX_REGISTRY.load(name, str(index_path))
+    if not wait:
+        return JSONResponse(
+            status_code=202,
+            content={"message": "Index loading in background", "name": name, "index_dir": str(index_path)}
+        )
     
     try:
-        index_path = Path(index_dir)
-        if not index_path.exists():
-            raise HTTPException(status_code=404, detail="Index directory not found")
-        
-        FAISS_INDEX = FAISSIndex.load(str(index_path), 'faiss_index')
-        
+        loaded = await asyncio.wrap_future(future)
         return {
             "message": "Index loaded successfully",
-            "total_vectors": FAISS_INDEX.ntotal,
-            "unique_images": len(set(m['image_id'] for m in FAISS_INDEX.tile_metadata))
+            "name": name,
+            "total_vectors": loaded.index.ntotal,
+            "unique_images": len(loaded.index.image_ids()),
+            "scene_index": loaded.scene_index is not None,
+            "generation": loaded.generation,
+            "memory_bytes": loaded.memory_bytes,
+            "mapped_bytes": loaded.mapped_bytes
         }
     
+    except IndexCompatibilityError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Failed to load index: {str(e)}")
 
 
+@app.post("/unload_index")
+async def unload_index(name: str = Form(DEFAULT_INDEX)):
+    """Stop serving a named index (freed once in-flight searches finish)"""
+    try:
+        INDEX_REGISTRY.unload(name)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Index not found: {name}")
+    
+    return {"message": "Index unloaded", "name": name}
+
+
+@app.get("/indexes")
+async def list_indexes():
+    """List named indexes with their size and memory use"""
+    return {
+        "indexes": INDEX_REGISTRY.describe(),
+        "memory_bytes": INDEX_REGISTRY.memory_usage(),
+        "memory_budget_bytes": INDEX_REGISTRY.memory_budget_bytes
+    }
+
+
 @app.post("/search", response_model=SearchResponse)
 async def search(request: SearchRequest):
     """
     Run visual search with uploaded chips
+    
+    Chips are embedded once by the API's embedder and searched in every
+    requested index. All served indexes share that one model version;
+    serve indexes of another version from a separate API process.
+    Requests naming indexes built by different versions get a 409.
     """
-    global EMBEDDER, FAISS_INDEX, CONFIG
+    global EMBEDDER, INDEX_REGISTRY, CONFIG
     
-    if EMBEDDER is None:
+    if EMBEDDER is None or EMBED_BATCHER is None:
         raise HTTPException(status_code=503, detail="Embedder not loaded")
     
-    if FAISS_INDEX is None:
+    if INDEX_REGISTRY is None or not INDEX_REGISTRY.names():
         raise HTTPException(status_code=503, detail="Index not loaded. Call /load_index first")
     
     try:
@@ -225,62 +367,97 @@ async def search(request: SearchRequest):
             chips.append(image)
             chip_names.append(chip_id)
         
-        # Extract embeddings
-        device = CONFIG['system']['device']
-        if device == 'cuda' and not torch.cuda.is_available():
-            device = 'cpu'
-        
-        embeddings = []
-        EMBEDDER.eval()
-        with torch.no_grad():
-            for chip in chips:
-                chip_tensor = torch.from_numpy(chip).float().unsqueeze(0).to(device)
-                emb = EMBEDDER(chip_tensor)
-                embeddings.append(emb.cpu().numpy())
-        
+        # Extract embeddings (batched with concurrent requests)
+        embeddings = await asyncio.gather(*(EMBED_BATCHER.embed(chip) for chip in chips))
         embeddings = np.vstack(embeddings)
         
         # Search
-        search_results = FAISS_INDEX.search_with_metadata(embeddings, k=request.top_k)
-        
-        # Retrieve candidates
+        fusion = request.fusion or CONFIG['retrieval'].get('fusion')
+        if fusion == 'none':
+            fusion = None
         retriever = CandidateRetriever(
             top_k_per_chip=request.top_k,
             top_k_per_image=request.top_k,
-            similarity_threshold=request.similarity_threshold
+            similarity_threshold=request.similarity_threshold,
+            search_mode=request.search_mode or CONFIG['retrieval'].get('search_mode', 'knn'),
+            max_results_per_chip=CONFIG['retrieval'].get('max_results_per_chip'),
+            scene_budget=request.scene_budget or CONFIG['retrieval'].get('scene_budget'),
+            fusion=fusion,
+            rrf_k=CONFIG['retrieval'].get('rrf_k', 60)
         )
         
-        detections, grouped = retriever.process(search_results, request.class_name, chip_names)
+        # Per-scale indexes: each chip only searches tile scales matching its size
+        query_scales = [
+            route_scales(
+                max(chip.shape[-2:]),
+                CONFIG['tiler']['tile_size'],
+                CONFIG['tiler']['scales'],
+                min_fill=CONFIG['tiler'].get('route_min_fill', 0.15),
+                max_fill=CONFIG['tiler'].get('route_max_fill', 1.0)
+            )
+            for chip in chips
+        ]
+        
+        def search_indexes():
+            # Holds one generation per index, so a concurrent reload cannot free it mid-search
+            with INDEX_REGISTRY.acquire(request.index_names) as indexes:
+                check_same_model_version(indexes)
+                search_results = {
+                    name: retriever.search(
+                        loaded.index,
+                        embeddings,
+                        scene_index=loaded.scene_index,
+                        query_scales=query_scales,
+                        nprobe=request.nprobe,
+                        ef_search=request.ef_search,
+                        image_ids=request.image_ids
+                    )
+                    for name, loaded in indexes.items()
+                }
+            return retriever.process_batch(retriever.merge(search_results), request.class_name, chip_names)
+        
+        # Search and retrieve candidates off the event loop
+        try:
+            candidates = await asyncio.to_thread(search_indexes)
+        except KeyError as e:
+            raise HTTPException(status_code=404, detail=str(e.args[0]))
+        except IndexCompatibilityError as e:
+            raise HTTPException(status_code=409, detail=str(e))
         
         # Apply NMS
         from engine.nms import apply_nms_per_image
-        grouped = apply_nms_per_image(
-            grouped,
+        kept = apply_nms_per_image(
+            candidates,
             method='soft',
             iou_threshold=request.nms_threshold,
             score_threshold=0.3
         )
         
-        # Flatten detections
-        final_detections = []
-        for dets in grouped.values():
-            for det in dets:
-                final_detections.append(DetectionResponse(
-                    x_min=det.x_min,
-                    y_min=det.y_min,
-                    x_max=det.x_max,
-                    y_max=det.y_max,
-                    score=det.score,
-                    class_name=det.class_name,
-                    target_filename=det.target_filename
-                ))
+        # Build the response from the columns
+        final_detections = [
+            DetectionResponse(
+                x_min=box[0],
+                y_min=box[1],
+                x_max=box[2],
+                y_max=box[3],
+                score=score,
+                class_name=class_name,
+                target_filename=image_id
+            )
+            for box, score, class_name, image_id in zip(
+                kept.boxes.tolist(), kept.scores.tolist(),
+                kept.class_labels.tolist(), kept.image_ids.tolist()
+            )
+        ]
         
         return SearchResponse(
             detections=final_detections,
             total_count=len(final_detections),
-            images_count=len(grouped)
+            images_count=len(np.unique(kept.image_ids))
         )
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
 
@@ -294,28 +471,18 @@ async def export_submission(
     Export detections as PS-03 submission file
     """
     try:
-        from engine.candidate import Detection
+        from engine.candidate import DetectionBatch
         from engine.writer import generate_submission_filename
         
-        # Convert to Detection objects
-        det_objects = []
-        for det in detections:
-            det_objects.append(Detection(
-                x_min=det.x_min,
-                y_min=det.y_min,
-                x_max=det.x_max,
-                y_max=det.y_max,
-                score=det.score,
-                class_name=det.class_name,
-                target_filename=det.target_filename
-            ))
+        # Pack into arrays for the writer
+        batch = DetectionBatch.from_detections(detections, columns=False)
         
         # Generate filename
         filename = generate_submission_filename(team_name)
         output_path = TEMP_DIR / filename
         
         # Write file
-        write_submission_file(det_objects, str(output_path))
+        write_submission_file(batch, str(output_path))
         
         return FileResponse(
             output_path,
@@ -379,8 +546,9 @@ async def get_status():
     """Get API status"""
     return {
         "embedder_loaded": EMBEDDER is not None,
-        "index_loaded": FAISS_INDEX is not None,
-        "index_size": FAISS_INDEX.ntotal if FAISS_INDEX else 0,
+        "index_loaded": bool(INDEX_REGISTRY and INDEX_REGISTRY.names()),
+        "index_size": sum(entry['total_vectors'] for entry in INDEX_REGISTRY.describe()) if INDEX_REGISTRY else 0,
+        "indexes": INDEX_REGISTRY.describe() if INDEX_REGISTRY else [],
         "device": CONFIG['system']['device'] if CONFIG else "unknown"
     }
 
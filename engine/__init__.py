@@ -1,32 +1,58 @@
 """
 PS-03 Visual Search Engine
 Core modules for satellite imagery retrieval and detection
+
+Public names are imported lazily on first access, so `import engine`
+does not pull in torch, faiss, rasterio or cv2 until they are needed.
 """
 
+import importlib
+
 __version__ = "1.0.0"
 
-from .io_tiff import read_tiff, write_tiff, normalize_bands
-from .tiler import TileGenerator, tile_image
-from .embedder import Embedder, get_embedder
-from .index_faiss import FAISSIndex
-from .candidate import CandidateRetriever
-from .verify_ncc import ZNCC
-from .nms import soft_nms, hard_nms, merge_detections
-from .writer import write_submission_file
-
-__all__ = [
-    'read_tiff',
-    'write_tiff',
-    'normalize_bands',
-    'TileGenerator',
-    'tile_image',
-    'Embedder',
-    'get_embedder',
-    'FAISSIndex',
-    'CandidateRetriever',
-    'ZNCC',
-    'soft_nms',
-    'hard_nms',
-    'merge_detections',
-    'write_submission_file',
-]
+# Public name -> submodule that defines it
+_LAZY_ATTRS = {
+    'read_tiff': '.io_tiff',
+    'write_tiff': '.io_tiff',
+    'normalize_bands': '.io_tiff',
+    'get_rgb_preview': '.io_tiff',
+    'TileGenerator': '.tiler',
+    'tile_image': '.tiler',
+    'Embedder': '.embedder',
+    'get_embedder': '.embedder',
+    'FAISSIndex': '.index_faiss',
+    'ShardedFAISSIndex': '.index_sharded',
+    'load_any_index': '.index_sharded',
+    'SceneIndex': '.scene_index',
+    'IndexFormatError': '.index_format',
+    'IndexCompatibilityError': '.index_format',
+    'build_provenance': '.index_format',
+    'TileMetadata': '.metadata',
+    'SearchResult': '.search_result',
+    'CandidateRetriever': '.candidate',
+    'DetectionBatch': '.candidate',
+    'compute_iou': '.candidate',
+    'BoxGrid': '.spatial',
+    'ZNCC': '.verify_ncc',
+    'soft_nms': '.nms',
+    'hard_nms': '.nms',
+    'merge_detections': '.nms',
+    'write_submission_file': '.writer',
+    'read_submission_file': '.writer',
+}
+
+__all__ = list(_LAZY_ATTRS)
+
+
+def __getattr__(name):
+    module_name = _LAZY_ATTRS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value  # Cache so later lookups bypass __getattr__
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,160 @@
+"""
+Dynamic micro-batching for embedder inference
+Coalesces concurrent single-chip requests into batched forward passes
+"""
+
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List, Tuple
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    In-process inference scheduler
+
+    Requests are queued from any thread (or the event loop); a dedicated
+    worker thread collects them for up to max_latency_ms or until
+    max_batch_size is reached, runs one batched call per input shape and
+    resolves each request's future with its own row of the output.
+    """
+
+    def __init__(
+        self,
+        embed_fn: Callable[[np.ndarray], np.ndarray],
+        max_batch_size: int = 16,
+        max_latency_ms: float = 5.0
+    ):
+        """
+        Args:
+            embed_fn: Maps a batch (B, C, H, W) to embeddings (B, D)
+            max_batch_size: Maximum requests per batched call
+            max_latency_ms: Maximum time to wait for more requests after
+                            the first one arrives
+        """
+        self.embed_fn = embed_fn
+        self.max_batch_size = max_batch_size
+        self.max_latency_ms = max_latency_ms
+
+        self._queue: queue.Queue = queue.Queue()
+        self._lock = threading.Lock()  # Guards _thread against concurrent start/exit
+        self._thread = None
+        self.batches_run = 0
+
+    def start(self):
+        """Start the worker thread"""
+        with self._lock:
+            self._start()
+
+    def _start(self):
+        # Lock held; the worker clears _thread itself on exit
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """
+        Stop the worker thread after draining queued requests
+
+        If the worker is still busy after timeout, it keeps running until
+        the queue is drained and then exits on its own.
+        """
+        with self._lock:
+            thread = self._thread
+            if thread is None:
+                return
+            self._queue.put(None)
+        thread.join(timeout)
+
+    def submit(self, item: np.ndarray) -> Future:
+        """
+        Queue a single input (C, H, W) for embedding
+
+        Returns:
+            Future resolving to the embedding of shape (D,)
+        """
+        future = Future()
+        with self._lock:
+            self._start()
+            self._queue.put((item, future))
+        return future
+
+    async def embed(self, item: np.ndarray) -> np.ndarray:
+        """Awaitable version of submit() for use on the event loop"""
+        return await asyncio.wrap_future(self.submit(item))
+
+    def _run(self):
+        """Worker loop: collect a batch within the latency budget and run it"""
+        stopping = False
+
+        while not stopping:
+            first = self._queue.get()
+            if first is None:
+                break
+
+            batch = [first]
+            deadline = time.monotonic() + self.max_latency_ms / 1000.0
+
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if request is None:
+                    stopping = True
+                    break
+                batch.append(request)
+
+            self._process(batch)
+
+        self._drain()
+
+    def _drain(self):
+        """Serve requests queued behind the stop sentinel, then detach the worker"""
+        with self._lock:
+            pending = []
+            while True:
+                try:
+                    request = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if request is not None:
+                    pending.append(request)
+            # Later submits start a fresh worker
+            self._thread = None
+
+        for start in range(0, len(pending), self.max_batch_size):
+            self._process(pending[start:start + self.max_batch_size])
+
+    def _process(self, batch: List[Tuple[np.ndarray, Future]]):
+        """Run one embed_fn call per distinct input shape in the batch"""
+        # Drop requests whose caller already gave up
+        batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+
+        groups = {}
+        for item, future in batch:
+            groups.setdefault(item.shape, []).append((item, future))
+
+        for shape, requests in groups.items():
+            try:
+                inputs = np.stack([item for item, _ in requests])
+                outputs = self.embed_fn(inputs)
+            except Exception as e:
+                logger.exception(f"Batched inference failed for shape {shape}")
+                for _, future in requests:
+                    future.set_exception(e)
+                continue
+
+            self.batches_run += 1
+            for (_, future), output in zip(requests, outputs):
+                future.set_result(output)
@@ -4,10 +4,13 @@ Retrieves top-K tiles per chip and aggregates by target image
 """
 
 import numpy as np
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Union
 from collections import defaultdict
 from dataclasses import dataclass
 
+from .search_result import SearchResult
+from .spatial import BoxGrid
+
 
 @dataclass
 class Detection:
@@ -22,6 +25,206 @@ class Detection:
     metadata: Dict = None
 
 
+class DetectionBatch:
+    """
+    Detections as parallel arrays, one row per detection
+    
+    Shared by candidate retrieval, NMS and the submission writer so that
+    no stage has to build a Detection object per candidate.
+    
+    Attributes:
+        boxes: (N, 4) int32 [x_min, y_min, x_max, y_max]
+        scores: (N,) scores
+        class_ids: (N,) int32 index into class_names
+        class_names: Class name table
+        image_ids: (N,) target image of each detection
+        chip_ids: (N,) query chip of each detection ('' if unknown)
+        columns: Extra metadata field -> (N,) values
+    """
+    
+    def __init__(
+        self,
+        boxes: np.ndarray,
+        scores: np.ndarray,
+        image_ids: np.ndarray,
+        class_ids: np.ndarray,
+        class_names: List[str],
+        chip_ids: np.ndarray = None,
+        columns: Dict[str, np.ndarray] = None
+    ):
+        self.boxes = np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+        self.scores = np.asarray(scores, dtype=np.float64)
+        self.image_ids = np.asarray(image_ids, dtype=str)
+        self.class_ids = np.asarray(class_ids, dtype=np.int32)
+        self.class_names = list(class_names)
+        self.chip_ids = np.full(len(self.scores), '') if chip_ids is None else np.asarray(chip_ids, dtype=str)
+        self.columns = columns or {}
+    
+    @classmethod
+    def empty(cls, class_names: List[str] = ()) -> 'DetectionBatch':
+        """Batch without detections"""
+        return cls(np.empty((0, 4)), np.empty(0), np.empty(0, dtype=str), np.empty(0), class_names)
+    
+    @classmethod
+    def from_detections(
+        cls,
+        detections: List[Detection],
+        class_names: List[str] = None,
+        columns: bool = True
+    ) -> 'DetectionBatch':
+        """
+        Pack Detection objects into arrays
+        
+        Metadata fields present on every detection become columns (object
+        arrays for non-scalar values); 'chip_id' fills chip_ids. A missing
+        score becomes NaN.
+        
+        Args:
+            detections: Detection objects (or objects with the same attributes)
+            class_names: Class name table (default: names in order of appearance)
+            columns: Pack shared metadata fields (False for consumers that
+                     only need boxes, scores, classes and images)
+            
+        Returns:
+            DetectionBatch in the same order
+        """
+        if class_names is None:
+            class_names = list(dict.fromkeys(d.class_name for d in detections))
+        class_index = {name: i for i, name in enumerate(class_names)}
+        
+        metadata = [getattr(d, 'metadata', None) or {} for d in detections]
+        names = [name for name in (metadata[0] if metadata else {}) if all(name in m for m in metadata)] if columns else []
+        
+        return cls(
+            np.array([(d.x_min, d.y_min, d.x_max, d.y_max) for d in detections]).reshape(-1, 4),
+            np.array([np.nan if d.score is None else d.score for d in detections], dtype=np.float64),
+            np.array([d.target_filename for d in detections], dtype=str),
+            np.array([class_index[d.class_name] for d in detections], dtype=np.int32),
+            class_names,
+            np.array([str(m.get('chip_id', '')) for m in metadata], dtype=str),
+            {name: _metadata_column([m[name] for m in metadata]) for name in names if name != 'chip_id'}
+        )
+    
+    def __len__(self) -> int:
+        return len(self.scores)
+    
+    @property
+    def class_labels(self) -> np.ndarray:
+        """Class name of each detection"""
+        return np.asarray(self.class_names, dtype=str)[self.class_ids]
+    
+    def take(self, rows: np.ndarray) -> 'DetectionBatch':
+        """Subset (or reorder) detections by row index or mask"""
+        return DetectionBatch(
+            self.boxes[rows],
+            self.scores[rows],
+            self.image_ids[rows],
+            self.class_ids[rows],
+            self.class_names,
+            self.chip_ids[rows],
+            {name: values[rows] for name, values in self.columns.items()}
+        )
+    
+    @classmethod
+    def concatenate(cls, batches: List['DetectionBatch']) -> 'DetectionBatch':
+        """Stack batches, merging their class tables; keeps columns common to all"""
+        if not batches:
+            return cls.empty()
+        
+        class_names = list(dict.fromkeys(name for batch in batches for name in batch.class_names))
+        class_index = {name: i for i, name in enumerate(class_names)}
+        names = [name for name in batches[0].columns if all(name in b.columns for b in batches)]
+        
+        return cls(
+            np.concatenate([b.boxes for b in batches]),
+            np.concatenate([b.scores for b in batches]),
+            np.concatenate([b.image_ids for b in batches]),
+            np.concatenate([
+                np.array([class_index[name] for name in b.class_names], dtype=np.int32)[b.class_ids]
+                for b in batches
+            ]),
+            class_names,
+            np.concatenate([b.chip_ids for b in batches]),
+            {name: np.concatenate([b.columns[name] for b in batches]) for name in names}
+        )
+    
+    def groups(self, by_class: bool = False) -> List[np.ndarray]:
+        """
+        Row indices of each image (or image and class)
+        
+        Groups follow the order of their first detection; rows keep
+        their order within a group.
+        """
+        if len(self) == 0:
+            return []
+        
+        _, first, inverse = np.unique(self.image_ids, return_index=True, return_inverse=True)
+        if by_class:
+            keys = inverse.astype(np.int64) * max(len(self.class_names), 1) + self.class_ids
+            _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        
+        order = np.argsort(inverse, kind='stable')
+        bounds = np.cumsum(np.bincount(inverse))
+        groups = np.split(order, bounds[:-1])
+        return [groups[g] for g in np.argsort(first)]
+    
+    def top_k_per_image(self, k: int) -> 'DetectionBatch':
+        """
+        Keep the k best detections of each image
+        
+        Images keep the order of their first detection and detections are
+        sorted by descending score within an image, as with the list-based
+        aggregate_by_image() and filter_top_k_per_image().
+        """
+        if len(self) == 0:
+            return self
+        
+        _, first, inverse = np.unique(self.image_ids, return_index=True, return_inverse=True)
+        image_order = np.argsort(np.argsort(first))  # Image rank by first appearance
+        
+        # One stable sort groups rows by image, best score first within each
+        order = np.lexsort((-self.scores, image_order[inverse]))
+        groups = image_order[inverse][order]
+        starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+        rank = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+        
+        return self.take(order[rank < k])
+    
+    def to_detections(self) -> List[Detection]:
+        """Detection objects, metadata holding chip_id and the extra columns"""
+        names = list(self.columns)
+        field_rows = list(zip(*(values.tolist() for values in self.columns.values()))) if names else [()] * len(self)
+        class_names = self.class_labels.tolist()
+        
+        return [
+            Detection(
+                x_min=box[0],
+                y_min=box[1],
+                x_max=box[2],
+                y_max=box[3],
+                score=score,
+                class_name=class_name,
+                target_filename=image_id,
+                metadata={'chip_id': chip_id, **dict(zip(names, row))}
+            )
+            for box, score, class_name, image_id, chip_id, row in zip(
+                self.boxes.tolist(), self.scores.tolist(), class_names,
+                self.image_ids.tolist(), self.chip_ids.tolist(), field_rows
+            )
+        ]
+
+
+def _metadata_column(values: List) -> np.ndarray:
+    """(N,) column of metadata values; object array unless every value is a scalar"""
+    if all(np.isscalar(value) for value in values):
+        return np.array(values)
+    
+    column = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        column[i] = value
+    return column
+
+
 class CandidateRetriever:
     """
     Retrieves and aggregates candidates from FAISS search results
@@ -31,21 +234,137 @@ class CandidateRetriever:
         self,
         top_k_per_chip: int = 500,
         top_k_per_image: int = 100,
-        similarity_threshold: float = 0.7
+        similarity_threshold: float = 0.7,
+        search_mode: str = 'knn',
+        max_results_per_chip: int = None,
+        scene_budget: int = None,
+        fusion: str = None,
+        rrf_k: int = 60
     ):
         """
         Args:
             top_k_per_chip: Maximum candidates per query chip
             top_k_per_image: Maximum candidates per target image
             similarity_threshold: Minimum similarity score
+            search_mode: 'knn' (fixed top_k_per_chip, then threshold) or
+                         'range' (all tiles above the threshold)
+            max_results_per_chip: Upper bound on range search hits per
+                                  chip (defaults to top_k_per_chip)
+            scene_budget: With a scene index, search tiles only in this
+                          many best-ranked scenes (None = all scenes)
+            fusion: Combine the chips of a class into one ranked list:
+                    'mean', 'max' or 'rrf' fuse per-chip hits by tile,
+                    'prototype' searches once with the mean chip embedding
+                    (None = one hit list per chip)
+            rrf_k: Rank offset for reciprocal rank fusion
         """
+        if search_mode not in ('knn', 'range'):
+            raise ValueError(f"Unknown search mode: {search_mode}")
+        if fusion not in (None, 'mean', 'max', 'rrf', 'prototype'):
+            raise ValueError(f"Unknown fusion method: {fusion}")
+        
         self.top_k_per_chip = top_k_per_chip
         self.top_k_per_image = top_k_per_image
         self.similarity_threshold = similarity_threshold
+        self.search_mode = search_mode
+        self.max_results_per_chip = max_results_per_chip or top_k_per_chip
+        self.scene_budget = scene_budget
+        self.fusion = fusion
+        self.rrf_k = rrf_k
+    
+    @property
+    def chip_limit(self) -> int:
+        """Maximum candidates kept per chip in the current search mode"""
+        return self.max_results_per_chip if self.search_mode == 'range' else self.top_k_per_chip
+    
+    def search(
+        self,
+        index,
+        embeddings: np.ndarray,
+        scene_index=None,
+        query_scales: List[List[float]] = None,
+        **search_kwargs
+    ) -> SearchResult:
+        """
+        Search an index for chip embeddings in the configured mode
+        
+        Args:
+            index: FAISSIndex or ShardedFAISSIndex
+            embeddings: Chip embeddings of shape (N, D)
+            scene_index: Optional SceneIndex; with a scene_budget, scenes
+                         are ranked first and only the best are searched
+            query_scales: Per-chip tile scales (tiler.route_scales); used
+                          when the index has per-scale shards
+            **search_kwargs: Passed to the index (nprobe, ef_search, image_ids)
+            
+        Returns:
+            SearchResult to pass to process(); with fusion, a single row
+            of at most chip_limit tiles for all chips together
+        """
+        if self.fusion == 'prototype':
+            embeddings = self.prototype(embeddings, index.metric)
+            if query_scales is not None:
+                query_scales = [sorted(set().union(*query_scales))]
+        
+        if query_scales is not None and getattr(index, 'shard_scales', None):
+            search_kwargs['query_scales'] = query_scales
+        
+        if scene_index is not None and self.scene_budget:
+            search_kwargs['image_ids'] = scene_index.select_scenes(
+                embeddings, self.scene_budget, search_kwargs.get('image_ids')
+            )
+        
+        if self.search_mode == 'range':
+            result = index.range_search(
+                embeddings, self.similarity_threshold, self.max_results_per_chip, **search_kwargs
+            )
+        else:
+            result = index.search_with_metadata(embeddings, k=self.top_k_per_chip, **search_kwargs)
+        
+        if self.fusion in ('mean', 'max', 'rrf'):
+            result = result.fuse(self.fusion, self.chip_limit, self.rrf_k)
+        return result
+    
+    @staticmethod
+    def prototype(embeddings: np.ndarray, metric: str = 'cosine') -> np.ndarray:
+        """
+        Class prototype: mean of the chip embeddings, renormalised for cosine
+        
+        Args:
+            embeddings: Chip embeddings of shape (N, D)
+            metric: Index metric
+            
+        Returns:
+            Prototype of shape (1, D)
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if metric == 'cosine':
+            embeddings = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        prototype = embeddings.mean(axis=0, keepdims=True)
+        if metric == 'cosine':
+            prototype /= max(np.linalg.norm(prototype), 1e-12)
+        return prototype
+    
+    def merge(self, results: Dict[str, SearchResult]) -> SearchResult:
+        """
+        Merge results of several indexes for the same chips, best first
+        
+        Args:
+            results: Index name -> SearchResult from search()
+            
+        Returns:
+            SearchResult with an 'index_name' column recording each hit's index
+        """
+        for name, result in results.items():
+            result.columns['index_name'] = np.full(result.indices.shape, name)
+        
+        results = list(results.values())
+        width = sum(result.scores.shape[1] for result in results)
+        return SearchResult.concatenate(results, min(width, self.chip_limit))
     
     def retrieve_candidates(
         self,
-        search_results: List[List[Dict]],
+        search_results: Union[SearchResult, List[List[Dict]]],
         class_name: str,
         chip_names: List[str] = None
     ) -> List[Detection]:
@@ -54,13 +373,16 @@ class CandidateRetriever:
         
         Args:
             search_results: Results from FAISSIndex.search_with_metadata()
-                           List of lists, one per query chip
+                           (SearchResult, or list of lists of dicts, one per query chip)
             class_name: Class name for detections
             chip_names: Optional list of chip identifiers
             
         Returns:
             List of Detection objects
         """
+        if isinstance(search_results, SearchResult):
+            return self.retrieve_batch(search_results, class_name, chip_names).to_detections()
+        
         all_candidates = []
         
         # Process each chip's results
@@ -68,7 +390,7 @@ class CandidateRetriever:
             chip_id = chip_names[chip_idx] if chip_names else f"chip_{chip_idx}"
             
             # Take top-K per chip
-            chip_results = chip_results[:self.top_k_per_chip]
+            chip_results = chip_results[:self.chip_limit]
             
             for result in chip_results:
                 score = result['score']
@@ -104,6 +426,55 @@ class CandidateRetriever:
         
         return all_candidates
     
+    def retrieve_batch(
+        self,
+        result: SearchResult,
+        class_name: str,
+        chip_names: List[str] = None
+    ) -> DetectionBatch:
+        """
+        Threshold a columnar SearchResult with array ops
+        
+        Only hits above the similarity threshold become detections.
+        Fused results are thresholded on each tile's best chip similarity
+        and attributed to that chip.
+        
+        Args:
+            result: Results from search()
+            class_name: Class name for detections
+            chip_names: Optional list of chip identifiers
+            
+        Returns:
+            DetectionBatch in chip order, then rank order within a chip
+        """
+        result = result.top(self.chip_limit)
+        
+        # Row-major nonzero keeps chip order, then rank order within a chip
+        similarity = result.columns.get('similarity', result.scores)
+        rows, ranks = np.nonzero(similarity >= self.similarity_threshold)
+        if len(rows) == 0:
+            return DetectionBatch.empty([class_name])
+        
+        # Fused hits come from a single row; name them after their best chip
+        if self.fusion == 'prototype':
+            chip_idx, n_chips, chip_names = np.zeros_like(rows), 1, ['prototype']
+        elif 'chip_index' in result.columns:
+            chip_idx = result.columns['chip_index'][rows, ranks]
+            n_chips = chip_idx.max() + 1
+        else:
+            chip_idx, n_chips = rows, len(result)
+        chip_ids = np.array([chip_names[i] if chip_names else f"chip_{i}" for i in range(n_chips)])
+        
+        return DetectionBatch(
+            result.boxes[rows, ranks],
+            result.scores[rows, ranks],
+            result.image_ids[rows, ranks] if 'image_id' in result.columns else np.full(len(rows), 'unknown'),
+            np.zeros(len(rows), dtype=np.int32),
+            [class_name],
+            chip_ids[chip_idx],
+            {name: values[rows, ranks] for name, values in result.columns.items()}
+        )
+    
     def aggregate_by_image(
         self,
         detections: List[Detection]
@@ -149,7 +520,7 @@ class CandidateRetriever:
     
     def process(
         self,
-        search_results: List[List[Dict]],
+        search_results: Union[SearchResult, List[List[Dict]]],
         class_name: str,
         chip_names: List[str] = None
     ) -> Tuple[List[Detection], Dict[str, List[Detection]]]:
@@ -164,6 +535,11 @@ class CandidateRetriever:
         Returns:
             Tuple of (all_detections, grouped_detections)
         """
+        # Columnar results: threshold and top-K per image with array ops
+        if isinstance(search_results, SearchResult):
+            detections = self.process_batch(search_results, class_name, chip_names).to_detections()
+            return detections, self.aggregate_by_image(detections)
+        
         # Retrieve candidates
         detections = self.retrieve_candidates(search_results, class_name, chip_names)
         
@@ -179,6 +555,25 @@ class CandidateRetriever:
             all_detections.extend(dets)
         
         return all_detections, grouped_filtered
+    
+    def process_batch(
+        self,
+        result: SearchResult,
+        class_name: str,
+        chip_names: List[str] = None
+    ) -> DetectionBatch:
+        """
+        Array version of process(): threshold, then top-K per image
+        
+        Args:
+            result: Results from search()
+            class_name: Class name
+            chip_names: Optional chip identifiers
+            
+        Returns:
+            DetectionBatch grouped by image, best first within an image
+        """
+        return self.retrieve_batch(result, class_name, chip_names).top_k_per_image(self.top_k_per_image)
 
 
 def compute_iou(box1: Tuple[int, int, int, int], box2: Tuple[int, int, int, int]) -> float:
@@ -217,54 +612,114 @@ def compute_iou(box1: Tuple[int, int, int, int], box2: Tuple[int, int, int, int]
     return intersection / union
 
 
-def cluster_detections(
-    detections: List[Detection],
+def cluster_boxes(
+    boxes: np.ndarray,
+    scores: np.ndarray,
     iou_threshold: float = 0.5
-) -> List[List[Detection]]:
+) -> List[np.ndarray]:
     """
-    Cluster overlapping detections
+    Greedy IoU clustering on arrays
+    
+    In descending score order, each box not yet clustered starts a cluster
+    and takes every unclustered box overlapping it with IoU >= threshold.
+    Overlapping pairs come from a BoxGrid, so only boxes sharing a grid
+    cell are compared.
     
     Args:
-        detections: List of Detection objects
+        boxes: (N, 4) [x_min, y_min, x_max, y_max]
+        scores: (N,) scores
         iou_threshold: IoU threshold for clustering
         
     Returns:
-        List of clusters (each cluster is a list of detections)
+        Row indices of each cluster, seed (best box) first
     """
-    if not detections:
+    order = np.argsort(-scores, kind='stable')
+    if len(order) == 0:
         return []
+    if iou_threshold <= 0:
+        return [order]  # Every pair qualifies
     
-    # Sort by score descending
-    sorted_dets = sorted(detections, key=lambda d: d.score, reverse=True)
+    # Overlapping pairs in rank space, grouped by their better-ranked box
+    first, second, _ = BoxGrid(boxes[order]).overlapping_pairs(iou_threshold)
+    pairs = np.lexsort((second, first))
+    first, second = first[pairs], second[pairs]
+    starts = np.searchsorted(first, np.arange(len(order) + 1))
     
+    used = np.zeros(len(order), dtype=bool)
     clusters = []
-    used = set()
     
-    for i, det in enumerate(sorted_dets):
-        if i in used:
+    for i in range(len(order)):
+        if used[i]:
             continue
         
-        # Start new cluster
-        cluster = [det]
-        used.add(i)
-        
-        box1 = (det.x_min, det.y_min, det.x_max, det.y_max)
+        # Later-ranked neighbours not yet in a cluster
+        neighbours = second[starts[i]:starts[i + 1]]
+        neighbours = neighbours[~used[neighbours]]
+        used[neighbours] = True
+        clusters.append(order[np.r_[i, neighbours]])
+    
+    return clusters
+
+
+def merge_boxes(
+    boxes: np.ndarray,
+    scores: np.ndarray,
+    clusters: List[np.ndarray]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Score-weighted average box and max score of each cluster
+    
+    Args:
+        boxes: (N, 4) boxes
+        scores: (N,) scores
+        clusters: Row indices of each cluster (from cluster_boxes)
         
-        # Find overlapping detections
-        for j in range(i + 1, len(sorted_dets)):
-            if j in used:
-                continue
-            
-            other = sorted_dets[j]
-            box2 = (other.x_min, other.y_min, other.x_max, other.y_max)
-            
-            if compute_iou(box1, box2) >= iou_threshold:
-                cluster.append(other)
-                used.add(j)
+    Returns:
+        Tuple of (merged boxes (C, 4) rounded to int, max scores (C,))
+    """
+    if not clusters:
+        return np.empty((0, 4), dtype=np.int64), np.empty(0)
+    
+    sizes = np.array([len(c) for c in clusters])
+    rows = np.concatenate(clusters)
+    labels = np.repeat(np.arange(len(clusters)), sizes)
+    starts = np.cumsum(sizes) - sizes
+    weights = scores[rows].astype(np.float64)
+    
+    total = np.bincount(labels, weights=weights)
+    sums = np.stack([
+        np.bincount(labels, weights=weights * boxes[rows, c]) for c in range(4)
+    ], axis=1)
+    
+    # Zero total weight: keep the seed box
+    merged = np.where(total[:, None] != 0, sums / np.where(total != 0, total, 1)[:, None], boxes[rows[starts]])
+    return np.rint(merged).astype(np.int64), np.maximum.reduceat(weights, starts)
+
+
+def cluster_detections(
+    detections: List[Detection],
+    iou_threshold: float = 0.5
+) -> List[List[Detection]]:
+    """
+    Cluster overlapping detections
+    
+    Args:
+        detections: List of Detection objects
+        iou_threshold: IoU threshold for clustering
         
-        clusters.append(cluster)
+    Returns:
+        List of clusters (each cluster is a list of detections, best first)
+    """
+    if not detections:
+        return []
     
-    return clusters
+    boxes = np.array([(d.x_min, d.y_min, d.x_max, d.y_max) for d in detections])
+    scores = np.array([d.score for d in detections], dtype=np.float64)
+    
+    return [
+        [detections[i] for i in rows.tolist()]
+        for rows in cluster_boxes(boxes, scores, iou_threshold)
+    ]
 
 
 def merge_cluster(cluster: List[Detection]) -> Detection:
@@ -281,24 +736,18 @@ def merge_cluster(cluster: List[Detection]) -> Detection:
     if len(cluster) == 1:
         return cluster[0]
     
-    # Compute weighted average
-    total_score = sum(d.score for d in cluster)
-    
-    x_min = sum(d.x_min * d.score for d in cluster) / total_score
-    y_min = sum(d.y_min * d.score for d in cluster) / total_score
-    x_max = sum(d.x_max * d.score for d in cluster) / total_score
-    y_max = sum(d.y_max * d.score for d in cluster) / total_score
-    
-    # Take max score
-    max_score = max(d.score for d in cluster)
+    boxes = np.array([(d.x_min, d.y_min, d.x_max, d.y_max) for d in cluster])
+    scores = np.array([d.score for d in cluster], dtype=np.float64)
+    merged_boxes, max_scores = merge_boxes(boxes, scores, [np.arange(len(cluster))])
+    x_min, y_min, x_max, y_max = merged_boxes[0].tolist()
     
-    # Use first detection's metadata
+    # Take max score, use first detection's metadata
     merged = Detection(
-        x_min=int(x_min),
-        y_min=int(y_min),
-        x_max=int(x_max),
-        y_max=int(y_max),
-        score=max_score,
+        x_min=x_min,
+        y_min=y_min,
+        x_max=x_max,
+        y_max=y_max,
+        score=float(max_scores[0]),
         class_name=cluster[0].class_name,
         target_filename=cluster[0].target_filename,
         metadata=cluster[0].metadata
@@ -8,8 +8,19 @@ import torch.nn as nn
 import torch.nn.functional as F
 from torchvision.models import resnet18, resnet34
 from typing import Optional, Literal
+from contextlib import nullcontext
+import logging
 import numpy as np
 
+logger = logging.getLogger(__name__)
+
+# Supported inference precisions: name -> autocast dtype (None = no autocast)
+PRECISIONS = {
+    'fp32': None,
+    'bf16': torch.bfloat16,
+    'fp16': torch.float16,
+}
+
 
 class CustomCNN(nn.Module):
     """Lightweight custom CNN for 4-channel input"""
@@ -190,9 +201,10 @@ class Embedder(nn.Module):
         }, path)
     
     def load(self, path: str, device: str = 'cpu'):
-        """Load model checkpoint"""
+        """Load model checkpoint (Embedder.save or Trainer.save_checkpoint format)"""
         checkpoint = torch.load(path, map_location=device)
-        self.load_state_dict(checkpoint['state_dict'])
+        state_dict = checkpoint.get('state_dict', checkpoint.get('model_state_dict'))
+        self.load_state_dict(state_dict)
 
 
 def get_embedder(
@@ -233,40 +245,72 @@ def get_embedder(
     return model
 
 
+def inference_context(device: str = 'cpu', precision: str = 'fp32'):
+    """
+    Autocast context for reduced-precision inference
+    
+    'bf16' uses bfloat16 autocast (CPU or CUDA), 'fp16' uses float16 autocast.
+    Falls back to float32 with a warning if the device does not support
+    the requested autocast dtype.
+    
+    Args:
+        device: Device string ('cpu', 'cuda', 'cuda:0', ...)
+        precision: 'fp32', 'bf16' or 'fp16'
+        
+    Returns:
+        Context manager
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision: {precision}")
+    
+    dtype = PRECISIONS[precision]
+    if dtype is None:
+        return nullcontext()
+    
+    device_type = str(device).split(':')[0]
+    try:
+        return torch.autocast(device_type=device_type, dtype=dtype)
+    except RuntimeError as e:
+        logger.warning(f"{precision} autocast not supported on {device}, using fp32: {e}")
+        return nullcontext()
+
+
 def extract_embeddings(
     embedder: Embedder,
     images: np.ndarray,
     batch_size: int = 32,
-    device: str = 'cpu'
+    device: str = 'cpu',
+    precision: str = 'fp32'
 ) -> np.ndarray:
     """
     Extract embeddings from a batch of images
     
     Args:
         embedder: Embedder model
-        images: Array of shape (N, C, H, W)
+        images: Array of shape (N, C, H, W); float16 input is upcast per batch
         batch_size: Batch size for processing
         device: Device to use
+        precision: Inference precision ('fp32', 'bf16', 'fp16')
         
     Returns:
-        Embeddings array of shape (N, D)
+        Embeddings array of shape (N, D), always float32
     """
     embedder.eval()
     embeddings_list = []
     
-    with torch.no_grad():
+    with torch.no_grad(), inference_context(device, precision):
         for i in range(0, len(images), batch_size):
             batch = images[i:i + batch_size]
             
             # Convert to tensor
             if isinstance(batch, np.ndarray):
-                batch = torch.from_numpy(batch).float()
+                batch = torch.from_numpy(batch)
             
-            batch = batch.to(device)
+            batch = batch.to(device).float()
             
             # Extract embeddings
             emb = embedder(batch)
-            embeddings_list.append(emb.cpu().numpy())
+            embeddings_list.append(emb.float().cpu().numpy())
     
     embeddings = np.vstack(embeddings_list)
     return embeddings
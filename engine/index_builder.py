@@ -0,0 +1,240 @@
+"""
+Two-phase FAISS index building
+Caches per-scene embeddings on disk, reservoir-samples training vectors
+across all scenes, trains once, then streams vectors into the index in
+chunks so the corpus never has to fit in memory
+"""
+
+import json
+import numpy as np
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+import logging
+
+from .index_faiss import FAISSIndex
+from .index_format import IndexCompatibilityError
+
+logger = logging.getLogger(__name__)
+
+PROVENANCE_FILE = 'provenance.json'
+
+
+def choose_nlist(n_vectors: int, min_nlist: int = 16, max_nlist: int = 65536) -> int:
+    """
+    Number of IVF clusters for a corpus size
+
+    Follows the usual 4 * sqrt(N) rule of thumb, rounded to a power of
+    two, and keeps at least ~39 training points per centroid.
+
+    Args:
+        n_vectors: Expected number of indexed vectors
+        min_nlist: Lower bound
+        max_nlist: Upper bound
+
+    Returns:
+        nlist
+    """
+    nlist = 2 ** int(round(np.log2(4 * np.sqrt(max(n_vectors, 1)))))
+    nlist = int(np.clip(nlist, min_nlist, max_nlist))
+    return max(1, min(nlist, n_vectors // 39))
+
+
+class ReservoirSampler:
+    """
+    Uniform fixed-size sample of a stream of vectors (Algorithm R)
+
+    Every vector seen so far has the same probability of being in the
+    sample, regardless of which scene it came from or when.
+    """
+
+    def __init__(self, capacity: int, dim: int, seed: int = 0):
+        """
+        Args:
+            capacity: Sample size
+            dim: Vector dimension
+            seed: Random seed
+        """
+        self.capacity = capacity
+        self.sample = np.empty((capacity, dim), dtype=np.float32)
+        self.seen = 0
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, vectors: np.ndarray):
+        """Offer a batch of vectors to the sample"""
+        n = len(vectors)
+
+        # Fill phase
+        fill = min(max(self.capacity - self.seen, 0), n)
+        if fill:
+            self.sample[self.seen:self.seen + fill] = vectors[:fill]
+
+        # Replace phase: item t (0-based) is kept with probability capacity / (t + 1)
+        if fill < n:
+            positions = self.seen + np.arange(fill, n)
+            slots = self._rng.integers(0, positions + 1)
+            keep = slots < self.capacity
+            # Sequential semantics: later items win duplicate slots, as with fancy assignment
+            self.sample[slots[keep]] = vectors[fill:][keep]
+
+        self.seen += n
+
+    def result(self) -> np.ndarray:
+        """Sampled vectors (fewer than capacity if the stream was shorter)"""
+        return self.sample[:min(self.seen, self.capacity)]
+
+
+class EmbeddingCache:
+    """
+    On-disk cache of per-scene tile embeddings and metadata
+
+    Each scene is stored as <image_id>.npy (embeddings) and
+    <image_id>.json (tile metadata), so scenes can be embedded once and
+    re-read (memory-mapped) during index building. The pipeline that
+    produced them is recorded in provenance.json; cached scenes are only
+    reused by the same checkpoint, precision, tiling and normalization.
+    """
+
+    def __init__(self, directory: str, provenance: Optional[Dict] = None):
+        """
+        Args:
+            directory: Cache directory (created if needed)
+            provenance: Pipeline description (see build_provenance); if
+                        given, recorded on first use and checked against
+                        the recorded one afterwards
+
+        Raises:
+            IndexCompatibilityError: Cached scenes were embedded by a
+                different pipeline, or by an unrecorded one
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        if provenance is not None:
+            self._check_provenance(provenance)
+
+    def __contains__(self, image_id: str) -> bool:
+        return (self.directory / f"{image_id}.json").exists()
+
+    def scenes(self) -> List[str]:
+        """Cached scene ids, sorted"""
+        return sorted(path.stem for path in self.directory.glob('*.json') if path.name != PROVENANCE_FILE)
+
+    def _check_provenance(self, provenance: Dict):
+        """Record the pipeline for a new cache, or refuse a cache from another one"""
+        path = self.directory / PROVENANCE_FILE
+        provenance = json.loads(json.dumps(provenance))  # Lists/None as stored
+
+        if not path.exists():
+            if self.scenes():
+                raise IndexCompatibilityError(
+                    f"Embedding cache {self.directory} has scenes but no {PROVENANCE_FILE}; "
+                    "use a new cache directory"
+                )
+            with open(path, 'w') as f:
+                json.dump(provenance, f, indent=2)
+            return
+
+        with open(path, 'r') as f:
+            stored = json.load(f)
+
+        issues = [
+            f"{section}.{field}: cache has {stored.get(section, {}).get(field)!r}, pipeline has {value!r}"
+            for section, fields in provenance.items()
+            for field, value in fields.items()
+            if stored.get(section, {}).get(field) != value
+        ]
+        if issues:
+            raise IndexCompatibilityError(
+                f"Embedding cache {self.directory} was built by a different pipeline "
+                "(use a new cache directory):\n  " + "\n  ".join(issues)
+            )
+
+    def save_scene(self, image_id: str, embeddings: np.ndarray, metadata: List[Dict]):
+        """Write one scene (metadata last, so a partial write is not listed)"""
+        np.save(self.directory / f"{image_id}.npy", embeddings.astype(np.float32))
+        with open(self.directory / f"{image_id}.json", 'w') as f:
+            json.dump(metadata, f, default=lambda value: value.item())  # NumPy scalars
+
+    def load_embeddings(self, image_id: str, mmap: bool = True) -> np.ndarray:
+        """Read one scene's embeddings (memory-mapped by default)"""
+        return np.load(self.directory / f"{image_id}.npy", mmap_mode='r' if mmap else None)
+
+    def load_scene(self, image_id: str, mmap: bool = True) -> Tuple[np.ndarray, List[Dict]]:
+        """Read one scene's embeddings and metadata"""
+        with open(self.directory / f"{image_id}.json", 'r') as f:
+            metadata = json.load(f)
+        return self.load_embeddings(image_id, mmap), metadata
+
+    def iter_chunks(
+        self,
+        chunk_size: int,
+        with_metadata: bool = True,
+        scenes: Optional[List[str]] = None
+    ) -> Iterator[Tuple[np.ndarray, Optional[List[Dict]]]]:
+        """Yield (embeddings, metadata) chunks of at most chunk_size tiles, scene by scene"""
+        for image_id in self.scenes() if scenes is None else scenes:
+            if with_metadata:
+                embeddings, metadata = self.load_scene(image_id)
+            else:
+                embeddings, metadata = self.load_embeddings(image_id), None
+            for start in range(0, len(embeddings), chunk_size):
+                yield (np.asarray(embeddings[start:start + chunk_size]),
+                       metadata[start:start + chunk_size] if metadata is not None else None)
+
+
+def build_index_streaming(
+    cache: EmbeddingCache,
+    nlist: Optional[int] = None,
+    train_size: Optional[int] = None,
+    chunk_size: int = 65536,
+    seed: int = 0,
+    scenes: Optional[List[str]] = None,
+    **index_kwargs
+) -> FAISSIndex:
+    """
+    Build an index from cached scenes in two passes
+
+    Pass 1 reservoir-samples training vectors uniformly across all
+    scenes and trains the index once on that sample (skipped for index
+    types without training). Pass 2 streams vectors into the trained
+    index in chunks.
+
+    Args:
+        cache: Scene embedding cache
+        nlist: IVF clusters (None = choose_nlist for the corpus size)
+        train_size: Training sample size (default: 64 vectors per IVF
+                    cluster, at least 10000)
+        chunk_size: Vectors added per chunk
+        seed: Reservoir sampling seed
+        scenes: Cached scenes to index, in order (default: all)
+        **index_kwargs: Other FAISSIndex constructor arguments
+
+    Returns:
+        Trained and filled FAISSIndex
+    """
+    scenes = cache.scenes() if scenes is None else scenes
+    if not scenes:
+        raise ValueError(f"No cached scenes in {cache.directory}")
+
+    # Corpus size and dimension (reads .npy headers only, arrays are memory-mapped)
+    shapes = [cache.load_embeddings(image_id).shape for image_id in scenes]
+    n_vectors = sum(shape[0] for shape in shapes)
+    dim = shapes[0][1]
+
+    nlist = nlist or choose_nlist(n_vectors)
+    faiss_index = FAISSIndex(embedding_dim=dim, nlist=nlist, **index_kwargs)
+    logger.info(f"Corpus: {n_vectors} vectors in {len(scenes)} scenes; nlist={nlist}")
+
+    # Pass 1: train once on a uniform sample across all scenes
+    if not faiss_index.index.is_trained:
+        train_size = min(train_size or max(64 * nlist, 10000), n_vectors)
+        sampler = ReservoirSampler(train_size, dim, seed=seed)
+        for embeddings, _ in cache.iter_chunks(chunk_size, with_metadata=False, scenes=scenes):
+            sampler.update(embeddings)
+        faiss_index.train(sampler.result())
+
+    # Pass 2: stream vectors into the trained index
+    for embeddings, metadata in cache.iter_chunks(chunk_size, scenes=scenes):
+        faiss_index.add(embeddings, metadata)
+
+    return faiss_index
@@ -1,17 +1,33 @@
 """
 FAISS index management for fast similarity search
-Supports flat (exact) and IVF (approximate) indexes
+Supports flat (exact), IVF (approximate), compressed IVF-PQ/SQ and
+HNSW graph indexes
 """
 
 import numpy as np
 import faiss
 import pickle
+import time
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Tuple, Optional, List, Dict
+from typing import Tuple, Optional, List, Dict, Union
 import logging
 
+from .metadata import TileMetadata
+from .search_result import SearchResult
+from .index_format import (
+    IndexFormatError, IndexCompatibilityError, manifest_path, write_manifest,
+    read_manifest, compatibility_issues
+)
+
 logger = logging.getLogger(__name__)
 
+# Index types backed by an inverted file (trained, searched with nprobe)
+IVF_INDEX_TYPES = ('IVF', 'IVFPQ', 'OPQ_IVFPQ', 'IVFSQ8')
+
+# Upper bound on candidate vectors gathered at once by the binary prefilter re-rank
+RERANK_CHUNK_BYTES = 64 << 20
+
 
 class FAISSIndex:
     """
@@ -24,67 +40,278 @@ class FAISSIndex:
         index_type: str = 'Flat',
         metric: str = 'cosine',
         nlist: int = 100,
-        nprobe: int = 10
+        nprobe: int = 10,
+        reduce_dim: Optional[int] = None,
+        whiten: bool = False,
+        train_sample_size: Optional[int] = None,
+        code_size: int = 32,
+        rerank: bool = False,
+        rerank_k_factor: int = 4,
+        hnsw_m: int = 32,
+        ef_construction: int = 200,
+        ef_search: int = 64,
+        num_threads: Optional[int] = None,
+        id_map: bool = False,
+        binary_prefilter: bool = False,
+        binary_bits: int = 256,
+        binary_k_factor: int = 16
     ):
         """
         Args:
             embedding_dim: Dimension of embeddings
-            index_type: 'Flat' (exact) or 'IVF' (approximate)
+            index_type: 'Flat' (exact), 'IVF' (approximate), compressed
+                        'IVFPQ', 'OPQ_IVFPQ', 'IVFSQ8', or 'HNSW' (graph)
             metric: 'cosine' or 'l2'
             nlist: Number of clusters for IVF (ignored for Flat)
             nprobe: Number of clusters to search (IVF only)
+            reduce_dim: Output dimension of a learned PCA stage applied
+                        before add/search (None = store full vectors)
+            whiten: Whiten the PCA output (scale components to unit variance)
+            train_sample_size: Max vectors used to fit PCA/IVF (None = all)
+            code_size: Bytes per vector for PQ codes (PQ sub-quantizers at
+                       8 bits); must divide the indexed dimension
+            rerank: Re-rank the top candidates exactly against stored
+                    full-precision vectors
+            rerank_k_factor: Candidates fetched per result before re-ranking
+            hnsw_m: HNSW graph neighbours per node
+            ef_construction: HNSW candidate list size while building
+            ef_search: Default HNSW candidate list size while searching
+            num_threads: OpenMP threads while training and adding; the
+                         process-wide setting is restored afterwards, so
+                         concurrent searches are unaffected (None = FAISS default)
+            id_map: Address vectors by stable ids (their metadata row) so
+                    scenes can be removed or replaced in place
+            binary_prefilter: Also store binary codes (signs of a random
+                              rotation) and search in two stages: Hamming
+                              top-N, then exact re-rank (Flat only)
+            binary_bits: Bits per binary code (multiple of 8)
+            binary_k_factor: Hamming candidates fetched per result
         """
         self.embedding_dim = embedding_dim
         self.index_type = index_type
         self.metric = metric
         self.nlist = nlist
         self.nprobe = nprobe
+        self.reduce_dim = reduce_dim
+        self.whiten = whiten
+        self.train_sample_size = train_sample_size
+        self.code_size = code_size
+        self.rerank = rerank
+        self.rerank_k_factor = rerank_k_factor
+        self.hnsw_m = hnsw_m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.num_threads = num_threads
+        self.id_map = id_map
+        self.binary_prefilter = binary_prefilter
+        self.binary_bits = binary_bits
+        self.binary_k_factor = binary_k_factor
+        
+        if reduce_dim is not None and reduce_dim > embedding_dim:
+            raise ValueError(f"reduce_dim ({reduce_dim}) exceeds embedding_dim ({embedding_dim})")
+        if id_map and rerank:
+            raise ValueError("id_map cannot be combined with rerank")
+        if binary_prefilter and (index_type != 'Flat' or reduce_dim is not None or id_map or rerank):
+            raise ValueError("binary_prefilter re-ranks from stored vectors and needs a plain Flat index")
+        if binary_bits % 8 != 0:
+            raise ValueError(f"binary_bits ({binary_bits}) must be a multiple of 8")
         
         # Create index
         self.index = self._create_index()
+        self.binary_index = faiss.IndexBinaryFlat(binary_bits) if binary_prefilter else None
+        self.binary_projection = self._binary_projection() if binary_prefilter else None
         
         # Metadata storage
-        self.tile_metadata: List[Dict] = []  # Stores tile info for each vector
+        self.tile_metadata = TileMetadata()  # Stores tile info for each vector (columnar)
+        self.tuning: Optional[Dict] = None  # Result of the last tune() call
+        self.provenance: Dict = {}  # How the embeddings were produced (see index_format)
+        self.tombstones = np.array([], dtype=np.int64)  # Removed rows awaiting compact()
+        self.mapped = False  # Loaded with mmap: index data lives in the files
         self.is_trained = False
     
     def _create_index(self) -> faiss.Index:
         """Create FAISS index based on configuration"""
+        dim = self.reduce_dim or self.embedding_dim
         
         if self.metric == 'cosine':
             # For cosine similarity, use inner product with normalized vectors
-            if self.index_type == 'Flat':
-                index = faiss.IndexFlatIP(self.embedding_dim)
-            elif self.index_type == 'IVF':
-                quantizer = faiss.IndexFlatIP(self.embedding_dim)
-                index = faiss.IndexIVFFlat(quantizer, self.embedding_dim, self.nlist)
-            else:
-                raise ValueError(f"Unknown index type: {self.index_type}")
-        
+            faiss_metric = faiss.METRIC_INNER_PRODUCT
         elif self.metric == 'l2':
-            if self.index_type == 'Flat':
-                index = faiss.IndexFlatL2(self.embedding_dim)
-            elif self.index_type == 'IVF':
-                quantizer = faiss.IndexFlatL2(self.embedding_dim)
-                index = faiss.IndexIVFFlat(quantizer, self.embedding_dim, self.nlist)
-            else:
-                raise ValueError(f"Unknown index type: {self.index_type}")
-        
+            faiss_metric = faiss.METRIC_L2
         else:
             raise ValueError(f"Unknown metric: {self.metric}")
         
+        if self.index_type == 'Flat':
+            index = faiss.IndexFlat(dim, faiss_metric)
+        elif self.index_type in IVF_INDEX_TYPES:
+            index = faiss.index_factory(dim, self._factory_string(dim), faiss_metric)
+        elif self.index_type == 'HNSW':
+            index = faiss.IndexHNSWFlat(dim, self.hnsw_m, faiss_metric)
+            index.hnsw.efConstruction = self.ef_construction
+            index.hnsw.efSearch = self.ef_search
+        else:
+            raise ValueError(f"Unknown index type: {self.index_type}")
+        
+        if self.rerank:
+            # Keeps full vectors next to the compressed codes for exact re-ranking
+            index = faiss.IndexRefineFlat(index)
+            index.k_factor = self.rerank_k_factor
+        
+        if self.reduce_dim is not None:
+            index = self._wrap_reduction(index)
+        
+        if self.id_map and self.index_type not in IVF_INDEX_TYPES:
+            # IVF lists store ids natively; other indexes need an explicit map
+            index = faiss.IndexIDMap2(index)
+        
         return index
     
+    def _binary_projection(self, seed: int = 0) -> np.ndarray:
+        """
+        Random rotation whose output signs form the binary codes
+        
+        With binary_bits <= embedding_dim the columns are orthonormal
+        (a rotation followed by truncation); beyond that it is a
+        Gaussian projection. Signs of random projections preserve
+        angles, so Hamming distance tracks cosine distance.
+        
+        Returns:
+            Matrix of shape (embedding_dim, binary_bits)
+        """
+        rng = np.random.default_rng(seed)
+        if self.binary_bits <= self.embedding_dim:
+            rotation, _ = np.linalg.qr(rng.standard_normal((self.embedding_dim, self.embedding_dim)))
+            return rotation[:, :self.binary_bits].astype(np.float32)
+        return rng.standard_normal((self.embedding_dim, self.binary_bits)).astype(np.float32)
+    
+    def _binary_codes(self, vectors: np.ndarray) -> np.ndarray:
+        """Packed sign bits of projected vectors, shape (N, binary_bits / 8)"""
+        return np.packbits(vectors @ self.binary_projection > 0, axis=1)
+    
+    def _factory_string(self, dim: int) -> str:
+        """FAISS index_factory description for IVF-family index types"""
+        if self.index_type in ('IVFPQ', 'OPQ_IVFPQ') and dim % self.code_size != 0:
+            raise ValueError(f"code_size ({self.code_size}) must divide dimension ({dim})")
+        
+        if self.index_type == 'IVF':
+            return f"IVF{self.nlist},Flat"
+        if self.index_type == 'IVFPQ':
+            return f"IVF{self.nlist},PQ{self.code_size}x8"
+        if self.index_type == 'OPQ_IVFPQ':
+            return f"OPQ{self.code_size},IVF{self.nlist},PQ{self.code_size}x8"
+        if self.index_type == 'IVFSQ8':
+            return f"IVF{self.nlist},SQ8"
+        raise ValueError(f"Unknown index type: {self.index_type}")
+    
+    def _search_params(
+        self,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        selector: Optional[faiss.IDSelector] = None
+    ) -> Tuple[Optional[faiss.SearchParameters], list]:
+        """
+        Build per-call FAISS search parameters
+        
+        Parameters are passed to index.search rather than set on the index,
+        so concurrent searches with different overrides do not interfere.
+        The nesting mirrors the wrappers created in _create_index; an id
+        selector goes on the innermost (base index) parameters.
+        
+        Returns:
+            Tuple of (params or None, list of parameter objects to keep
+            alive for the duration of the search)
+        """
+        if self.index_type in IVF_INDEX_TYPES:
+            params = faiss.SearchParametersIVF()
+            params.nprobe = nprobe or self.nprobe
+        elif self.index_type == 'HNSW':
+            params = faiss.SearchParametersHNSW()
+            params.efSearch = ef_search or self.ef_search
+        elif selector is not None:
+            params = faiss.SearchParameters()
+        else:
+            return None, []
+        
+        keep_alive = [params]
+        
+        if selector is not None:
+            params.sel = selector
+            keep_alive.append(selector)
+        
+        if self.index_type == 'OPQ_IVFPQ':
+            params = self._wrap_params(faiss.SearchParametersPreTransform(), params, keep_alive)
+        
+        if self.rerank:
+            refine_params = faiss.IndexRefineSearchParameters()
+            refine_params.k_factor = self.rerank_k_factor
+            refine_params.base_index_params = params
+            params = refine_params
+            keep_alive.append(params)
+        
+        if self.reduce_dim is not None:
+            params = self._wrap_params(faiss.SearchParametersPreTransform(), params, keep_alive)
+        
+        return params, keep_alive
+    
+    @staticmethod
+    def _wrap_params(outer, inner, keep_alive: list):
+        """Nest inner search params inside pre-transform params"""
+        outer.index_params = inner
+        keep_alive.append(outer)
+        return outer
+    
+    def _wrap_reduction(self, index: faiss.Index) -> faiss.Index:
+        """
+        Prepend a learned PCA (optionally whitening) transform to an index
+        
+        The transform is part of the FAISS index, so it is trained with
+        it and persisted in the .index file.
+        """
+        eigen_power = -0.5 if self.whiten else 0.0
+        pca = faiss.PCAMatrix(self.embedding_dim, self.reduce_dim, eigen_power)
+        
+        if self.metric == 'cosine':
+            # Re-normalize after projection so inner product stays cosine
+            norm = faiss.NormalizationTransform(self.reduce_dim, 2.0)
+            wrapped = faiss.IndexPreTransform(norm, index)
+            wrapped.prepend_transform(pca)
+        else:
+            wrapped = faiss.IndexPreTransform(pca, index)
+        
+        return wrapped
+    
+    @contextmanager
+    def _omp_threads(self):
+        """Use num_threads for the enclosed FAISS calls, then restore the process setting"""
+        if not self.num_threads:
+            yield
+            return
+        
+        previous = faiss.omp_get_max_threads()
+        faiss.omp_set_num_threads(self.num_threads)
+        try:
+            yield
+        finally:
+            faiss.omp_set_num_threads(previous)
+    
     def train(self, vectors: np.ndarray):
         """
-        Train index (required for IVF)
+        Train index (required for IVF and PCA reduction)
         
         Args:
-            vectors: Training vectors of shape (N, D)
+            vectors: Training vectors of shape (N, D); subsampled to
+                     train_sample_size if set
         """
-        if self.index_type == 'IVF' and not self.is_trained:
-            logger.info(f"Training IVF index with {len(vectors)} vectors...")
+        if not self.index.is_trained:
+            if self.train_sample_size and len(vectors) > self.train_sample_size:
+                rng = np.random.default_rng(0)
+                sample = rng.choice(len(vectors), self.train_sample_size, replace=False)
+                vectors = vectors[np.sort(sample)]
+            
+            logger.info(f"Training {self.index_type} index with {len(vectors)} vectors...")
             vectors = self._prepare_vectors(vectors)
-            self.index.train(vectors)
+            with self._omp_threads():
+                self.index.train(vectors)
             self.is_trained = True
             logger.info("Index training complete")
     
@@ -103,11 +330,19 @@ class FAISSIndex:
         vectors = self._prepare_vectors(vectors)
         
         # Train if needed
-        if self.index_type == 'IVF' and not self.is_trained:
+        if not self.index.is_trained:
             self.train(vectors)
         
         # Add to index
-        self.index.add(vectors)
+        with self._omp_threads():
+            if self.id_map:
+                start_id = len(self.tile_metadata)
+                self.index.add_with_ids(vectors, np.arange(start_id, start_id + len(vectors), dtype=np.int64))
+            else:
+                self.index.add(vectors)
+        
+        if self.binary_index is not None:
+            self.binary_index.add(self._binary_codes(vectors))
         
         # Store metadata
         if metadata:
@@ -123,7 +358,10 @@ class FAISSIndex:
     def search(
         self,
         query_vectors: np.ndarray,
-        k: int = 100
+        k: int = 100,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        image_ids: Optional[List[str]] = None
     ) -> Tuple[np.ndarray, np.ndarray]:
         """
         Search for nearest neighbors
@@ -131,61 +369,479 @@ class FAISSIndex:
         Args:
             query_vectors: Query embeddings of shape (N, D)
             k: Number of neighbors to retrieve
+            nprobe: Per-call override of IVF clusters searched
+            ef_search: Per-call override of HNSW search list size
+            image_ids: Restrict results to tiles of these scenes
             
         Returns:
             Tuple of (distances, indices) both of shape (N, k)
         """
         query_vectors = self._prepare_vectors(query_vectors)
         
-        # Set nprobe for IVF
-        if self.index_type == 'IVF':
-            self.index.nprobe = self.nprobe
+        if image_ids is not None:
+            return self._search_images(query_vectors, k, nprobe, ef_search, image_ids)
+        
+        if self.binary_index is not None:
+            return self._search_binary(query_vectors, k)
+        
+        params, _keep_alive = self._search_params(nprobe, ef_search)
+        distances, indices = self.index.search(query_vectors, k, params=params)
+        
+        return distances, indices
+    
+    def _search_binary(self, query_vectors: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Two-stage search: Hamming top-N over binary codes, then exact re-rank
+        
+        k * binary_k_factor candidates per query are re-scored against
+        the float vectors of the Flat index, read in place. Queries are
+        re-ranked in chunks so the gathered candidate vectors stay under
+        RERANK_CHUNK_BYTES however large k is.
+        """
+        n_queries = len(query_vectors)
+        ntotal = self.index.ntotal
+        n_candidates = min(k * self.binary_k_factor, ntotal)
+        if n_candidates == 0:
+            return self._empty_results(n_queries, k)
+        
+        _, candidates = self.binary_index.search(self._binary_codes(query_vectors), n_candidates)
+        
+        # Zero-copy view of the stored vectors
+        stored = faiss.rev_swig_ptr(self.index.get_xb(), ntotal * self.embedding_dim)
+        stored = stored.reshape(ntotal, self.embedding_dim)
+        
+        width = min(k, n_candidates)
+        distances = np.empty((n_queries, width), dtype=np.float32)
+        indices = np.empty((n_queries, width), dtype=np.int64)
+        chunk = max(1, RERANK_CHUNK_BYTES // (4 * n_candidates * self.embedding_dim))
+        
+        for start in range(0, n_queries, chunk):
+            rows = slice(start, start + chunk)
+            queries = query_vectors[rows]
+            chunk_candidates = candidates[rows]
+            valid = chunk_candidates >= 0
+            vectors = stored[np.maximum(chunk_candidates, 0)]
+            
+            if self.metric == 'cosine':
+                chunk_distances = np.einsum('qnd,qd->qn', vectors, queries)
+                keys = -chunk_distances
+            else:
+                chunk_distances = ((vectors - queries[:, None, :]) ** 2).sum(axis=-1)
+                keys = chunk_distances.copy()
+            keys[~valid] = np.inf
+            
+            order = np.argsort(keys, axis=1, kind='stable')[:, :width]
+            distances[rows] = np.take_along_axis(chunk_distances, order, axis=1)
+            indices[rows] = np.where(np.take_along_axis(valid, order, axis=1),
+                                     np.take_along_axis(chunk_candidates, order, axis=1), -1)
+        
+        empty_distances, empty_indices = self._empty_results(n_queries, k)
+        distances = np.where(indices >= 0, distances, empty_distances[:, :width])
+        if width < k:
+            distances = np.hstack([distances, empty_distances[:, width:]])
+            indices = np.hstack([indices, empty_indices[:, width:]])
+        
+        return distances, indices
+    
+    def _search_images(
+        self,
+        query_vectors: np.ndarray,
+        k: int,
+        nprobe: Optional[int],
+        ef_search: Optional[int],
+        image_ids: List[str]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Search only the tiles of the given scenes using a FAISS IDSelector
+        
+        Non-selected vectors are skipped inside FAISS (no distance is
+        computed for them), and contiguous id ranges let IVF bisect its
+        id-sorted inverted lists.
+        """
+        scoped = self._scoped_index(image_ids)
+        if scoped is None:
+            return self._empty_results(len(query_vectors), k)
+        
+        index, selector, id_map = scoped
+        params, _keep_alive = self._search_params(nprobe, ef_search, selector)
+        distances, indices = index.search(query_vectors, k, params=params)
         
-        distances, indices = self.index.search(query_vectors, k)
+        if id_map is not None:
+            indices = np.where(indices >= 0, id_map[np.maximum(indices, 0)], -1)
         
         return distances, indices
     
+    def _scoped_index(
+        self,
+        image_ids: List[str]
+    ) -> Optional[Tuple[faiss.Index, faiss.IDSelector, Optional[np.ndarray]]]:
+        """
+        Index to search and id selector restricting it to some scenes
+        
+        Returns:
+            Tuple of (index, selector, id_map) where id_map translates the
+            index's labels back to tile ids (None if they already are), or
+            None if the scenes have no tiles
+        """
+        rows = self.image_rows(image_ids)
+        if len(rows) == 0:
+            return None
+        
+        index = self.index
+        id_map = None
+        if isinstance(index, faiss.IndexIDMap2):
+            # Select by position in the wrapped index, map labels back here
+            id_map = faiss.vector_to_array(index.id_map)
+            rows = np.searchsorted(id_map, rows)
+            index = index.index
+        
+        if rows[-1] - rows[0] + 1 == len(rows):
+            selector = faiss.IDSelectorRange(int(rows[0]), int(rows[-1]) + 1, True)
+        else:
+            selector = faiss.IDSelectorBatch(rows)
+        
+        return index, selector, id_map
+    
+    def _empty_results(self, n_queries: int, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Distances and indices for queries with no neighbours"""
+        empty = np.inf if self.metric == 'l2' else -np.inf
+        return (np.full((n_queries, k), empty, dtype=np.float32),
+                np.full((n_queries, k), -1, dtype=np.int64))
+    
+    def range_search(
+        self,
+        query_vectors: np.ndarray,
+        threshold: float,
+        max_results: int = 1000,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        image_ids: Optional[List[str]] = None
+    ) -> SearchResult:
+        """
+        Return all tiles with similarity >= threshold, best first
+        
+        Unlike search(), the number of hits per query adapts to the data:
+        sparse scenes return few tiles and dense scenes are not cut off at
+        a fixed K, up to max_results per query. Similarity is the same
+        score as in search_with_metadata (inner product for cosine,
+        1 / (1 + distance) for l2).
+        
+        With rerank or the binary prefilter this is a thresholded k-NN
+        (k = max_results) through the same two stages as search(), so
+        tiles outside the re-ranked candidates are missed.
+        
+        Args:
+            query_vectors: Query embeddings of shape (N, D)
+            threshold: Minimum similarity score
+            max_results: Upper bound on hits kept per query
+            nprobe: Per-call override of IVF clusters searched
+            ef_search: Per-call override of HNSW search list size
+            image_ids: Restrict results to tiles of these scenes
+            
+        Returns:
+            SearchResult padded to the largest hit count (at most max_results)
+        """
+        query_vectors = self._prepare_vectors(query_vectors)
+        n_queries = len(query_vectors)
+        
+        if self.rerank or (self.binary_index is not None and image_ids is None):
+            # IndexRefine has no range search, and a Flat range search would
+            # scan every vector past the binary prefilter: two-stage (or
+            # re-ranked) k-NN then threshold, so hits outside the top
+            # max_results candidates are not returned
+            return self._threshold_knn(query_vectors, threshold, max_results, nprobe, ef_search, image_ids)
+        
+        index, selector, id_map = self.index, None, None
+        if image_ids is not None:
+            scoped = self._scoped_index(image_ids)
+            if scoped is None:
+                distances, indices = self._empty_results(n_queries, 0)
+                return SearchResult.from_search(distances, indices, self.tile_metadata, self.metric)
+            index, selector, id_map = scoped
+        
+        # FAISS keeps IP > radius, L2 (squared distance) < radius
+        if self.metric == 'cosine':
+            radius = threshold
+        else:
+            radius = 1.0 / max(threshold, 1e-12) - 1.0
+        
+        params, _keep_alive = self._search_params(nprobe, ef_search, selector)
+        try:
+            lims, distances, labels = index.range_search(query_vectors, radius, params=params)
+        except RuntimeError:
+            # Index type without range search support in this FAISS build
+            return self._threshold_knn(query_vectors, threshold, max_results, nprobe, ef_search, image_ids)
+        
+        if id_map is not None:
+            labels = id_map[labels]
+        
+        # Pad the ragged per-query hit lists into (N, width) arrays, best first
+        lims = lims.astype(np.int64)
+        counts = np.diff(lims)
+        query = np.repeat(np.arange(n_queries), counts)
+        order = np.lexsort((distances if self.metric == 'l2' else -distances, query))
+        rank = np.arange(len(order)) - lims[query]
+        keep = rank < max_results
+        
+        width = int(min(counts.max(initial=0), max_results))
+        padded_distances, padded_indices = self._empty_results(n_queries, width)
+        padded_distances[query[keep], rank[keep]] = distances[order][keep]
+        padded_indices[query[keep], rank[keep]] = labels[order][keep]
+        
+        return SearchResult.from_search(padded_distances, padded_indices, self.tile_metadata, self.metric)
+    
+    def _threshold_knn(
+        self,
+        query_vectors: np.ndarray,
+        threshold: float,
+        max_results: int,
+        nprobe: Optional[int],
+        ef_search: Optional[int],
+        image_ids: Optional[List[str]]
+    ) -> SearchResult:
+        """Range search emulated with k-NN (k = max_results) and a score cut"""
+        result = self.search_with_metadata(
+            query_vectors, max_results, nprobe=nprobe, ef_search=ef_search, image_ids=image_ids
+        )
+        below = result.scores < threshold
+        result.scores[below] = -np.inf
+        result.indices[below] = -1
+        
+        # Hits are best first: trim to the largest hit count, as range_search pads
+        return result.top(int(result.valid.sum(axis=1).max(initial=0)))
+    
     def search_with_metadata(
         self,
         query_vectors: np.ndarray,
-        k: int = 100
-    ) -> List[List[Dict]]:
+        k: int = 100,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        image_ids: Optional[List[str]] = None
+    ) -> SearchResult:
         """
         Search and return results with metadata
         
         Args:
             query_vectors: Query embeddings of shape (N, D)
             k: Number of neighbors
+            nprobe: Per-call override of IVF clusters searched
+            ef_search: Per-call override of HNSW search list size
+            image_ids: Restrict results to tiles of these scenes
+            
+        Returns:
+            Columnar SearchResult; result[i] gives the list of
+            {'score', 'distance', 'metadata'} dicts for query i
+        """
+        distances, indices = self.search(
+            query_vectors, k, nprobe=nprobe, ef_search=ef_search, image_ids=image_ids
+        )
+        
+        return SearchResult.from_search(distances, indices, self.tile_metadata, self.metric)
+    
+    def add_scene(
+        self,
+        image_id: str,
+        vectors: np.ndarray,
+        metadata: List[Dict]
+    ):
+        """
+        Add all tiles of one scene
+        
+        Args:
+            image_id: Scene identifier
+            vectors: Tile embeddings of shape (N, D)
+            metadata: Tile metadata dicts (image_id is set to the scene)
+        """
+        if len(self.scene_rows(image_id)):
+            raise ValueError(f"Scene {image_id} already indexed; use replace_scene")
+        
+        self.add(vectors, [dict(m, image_id=image_id) for m in metadata])
+    
+    def remove_scene(self, image_id: str) -> int:
+        """
+        Remove all tiles of one scene
+        
+        Vectors are deleted from the FAISS index; their metadata rows stay
+        in place as tombstones (so ids of other tiles do not change) until
+        compact() is called.
+        
+        Args:
+            image_id: Scene identifier
             
         Returns:
-            List of lists of dicts, each containing {'score', 'metadata'}
-        """
-        distances, indices = self.search(query_vectors, k)
-        
-        results = []
-        for i in range(len(query_vectors)):
-            query_results = []
-            for j in range(k):
-                idx = indices[i, j]
-                if idx < 0 or idx >= len(self.tile_metadata):
-                    continue
-                
-                score = float(distances[i, j])
-                # Convert distance to similarity if using cosine
-                if self.metric == 'cosine':
-                    similarity = score  # Already inner product (cosine for normalized)
-                else:
-                    # L2 distance to similarity
-                    similarity = 1.0 / (1.0 + score)
-                
-                query_results.append({
-                    'score': similarity,
-                    'distance': score,
-                    'metadata': self.tile_metadata[idx]
-                })
-            results.append(query_results)
-        
-        return results
+            Number of tiles removed
+        """
+        if not self.id_map:
+            raise ValueError("Removing scenes requires an index built with id_map=True")
+        if self.index_type == 'HNSW':
+            raise ValueError("HNSW indexes do not support removal; rebuild instead")
+        
+        rows = self.scene_rows(image_id)
+        if len(rows) == 0:
+            return 0
+        
+        self.index.remove_ids(faiss.IDSelectorBatch(rows))
+        self.tombstones = np.union1d(self.tombstones, rows)
+        
+        logger.info(f"Removed scene {image_id} ({len(rows)} tiles). Total: {self.index.ntotal}")
+        return len(rows)
+    
+    def replace_scene(
+        self,
+        image_id: str,
+        vectors: np.ndarray,
+        metadata: List[Dict]
+    ) -> int:
+        """
+        Replace all tiles of one scene (e.g. after reprocessing it)
+        
+        Returns:
+            Number of old tiles removed
+        """
+        removed = self.remove_scene(image_id)
+        self.add_scene(image_id, vectors, metadata)
+        return removed
+    
+    def scene_rows(self, image_id: str) -> np.ndarray:
+        """Ids of the live tiles of a scene"""
+        return self.image_rows([image_id])
+    
+    def image_rows(self, image_ids: List[str]) -> np.ndarray:
+        """Sorted ids of the live tiles of several scenes"""
+        if 'image_id' not in self.tile_metadata.fields:
+            return np.array([], dtype=np.int64)
+        
+        # Compare int32 codes rather than decoding the string column
+        wanted = np.flatnonzero(np.isin(self.tile_metadata.categories('image_id'), list(image_ids)))
+        rows = np.flatnonzero(np.isin(self.tile_metadata.codes('image_id'), wanted))
+        return np.setdiff1d(rows, self.tombstones, assume_unique=True)
+    
+    def compact(self) -> int:
+        """
+        Drop tombstoned metadata rows and renumber ids to be contiguous
+        
+        Stored codes are not touched; only the id mapping is rewritten.
+        
+        Returns:
+            Number of rows dropped
+        """
+        if len(self.tombstones) == 0:
+            return 0
+        
+        live = self._live_mask()
+        mapping = np.full(len(live), -1, dtype=np.int64)
+        mapping[live] = np.arange(live.sum())
+        self._renumber_ids(mapping)
+        
+        self.tile_metadata = self.tile_metadata.take(np.flatnonzero(live))
+        dropped = len(self.tombstones)
+        self.tombstones = np.array([], dtype=np.int64)
+        
+        logger.info(f"Compacted index: dropped {dropped} tombstoned rows")
+        return dropped
+    
+    def _live_mask(self) -> np.ndarray:
+        """Boolean mask of metadata rows that are not tombstoned"""
+        live = np.ones(len(self.tile_metadata), dtype=bool)
+        live[self.tombstones] = False
+        return live
+    
+    def _renumber_ids(self, mapping: np.ndarray):
+        """Rewrite stored ids through an old id -> new id lookup table"""
+        if isinstance(self.index, faiss.IndexIDMap2):
+            ids = faiss.vector_to_array(self.index.id_map)
+            faiss.copy_array_to_vector(mapping[ids], self.index.id_map)
+            self.index.construct_rev_map()
+            return
+        
+        ivf = faiss.extract_index_ivf(self.index)
+        invlists = ivf.invlists
+        for list_no in range(ivf.nlist):
+            size = invlists.list_size(list_no)
+            if size == 0:
+                continue
+            ids = faiss.rev_swig_ptr(invlists.get_ids(list_no), size)
+            codes = faiss.rev_swig_ptr(invlists.get_codes(list_no), size * invlists.code_size).copy()
+            new_ids = np.ascontiguousarray(mapping[ids])
+            invlists.update_entries(list_no, 0, size, faiss.swig_ptr(new_ids), faiss.swig_ptr(codes))
+    
+    def tune(
+        self,
+        queries: np.ndarray,
+        ground_truth: np.ndarray,
+        target_recall: float = 0.95,
+        values: Optional[List[int]] = None,
+        exclude_ids: Optional[np.ndarray] = None
+    ) -> Dict:
+        """
+        Pick the cheapest nprobe (IVF) or efSearch (HNSW) meeting a recall target
+        
+        Sweeps the search-time parameter in increasing order, measures
+        recall@K against exact neighbours, and stores the smallest value
+        reaching target_recall (or the best-recall value if none does)
+        as the index default. The choice is kept in self.tuning and
+        persisted by save().
+        
+        Args:
+            queries: Query vectors of shape (Q, D)
+            ground_truth: Exact top-K tile ids for the queries (Q, K)
+            target_recall: Required recall@K
+            values: Parameter values to try (default: powers of two)
+            exclude_ids: Indexed id of each query when queries are drawn
+                         from the index itself; dropped from the results
+                         so the trivial self-match does not inflate recall
+                         (ground_truth must exclude them too)
+            
+        Returns:
+            Dict with the chosen parameter, value, recall and the full sweep
+        """
+        if self.index_type in IVF_INDEX_TYPES:
+            param = 'nprobe'
+            values = values or [v for v in (1, 2, 4, 8, 16, 32, 64, 128, 256, 512) if v <= self.nlist]
+        elif self.index_type == 'HNSW':
+            param = 'ef_search'
+            values = values or [16, 32, 64, 128, 256, 512]
+        else:
+            raise ValueError(f"{self.index_type} index has no search-time parameter to tune")
+        
+        k = ground_truth.shape[1]
+        queries = self._prepare_vectors(queries)
+        
+        sweep = []
+        for value in sorted(values):
+            start = time.perf_counter()
+            if exclude_ids is None:
+                _, indices = self.search(queries, k, **{param: value})
+            else:
+                _, indices = self.search(queries, k + 1, **{param: value})
+                indices = drop_query_ids(indices, exclude_ids, k)
+            elapsed = time.perf_counter() - start
+            
+            sweep.append({
+                param: value,
+                'recall': recall_at_k(ground_truth, indices, k),
+                'ms_per_query': 1000 * elapsed / len(queries),
+            })
+            logger.info(f"{param}={value}: recall@{k}={sweep[-1]['recall']:.4f}, "
+                        f"{sweep[-1]['ms_per_query']:.3f} ms/query")
+        
+        meeting = [entry for entry in sweep if entry['recall'] >= target_recall]
+        best = meeting[0] if meeting else max(sweep, key=lambda entry: entry['recall'])
+        setattr(self, param, best[param])
+        
+        self.tuning = {
+            'param': param,
+            'value': best[param],
+            'recall': best['recall'],
+            'ms_per_query': best['ms_per_query'],
+            'target_recall': target_recall,
+            'met_target': bool(meeting),
+            'k': k,
+            'n_queries': len(queries),
+            'held_out': exclude_ids is None,
+        }
+        
+        return dict(self.tuning, sweep=sweep)
     
     def _prepare_vectors(self, vectors: np.ndarray) -> np.ndarray:
         """Ensure vectors are in correct format (contiguous float32)"""
@@ -195,51 +851,130 @@ class FAISSIndex:
             vectors = vectors.astype(np.float32)
         return vectors
     
+    def params(self) -> Dict:
+        """Constructor parameters and training state, as stored in the manifest"""
+        return {
+            'embedding_dim': self.embedding_dim,
+            'index_type': self.index_type,
+            'metric': self.metric,
+            'nlist': self.nlist,
+            'nprobe': self.nprobe,
+            'reduce_dim': self.reduce_dim,
+            'whiten': self.whiten,
+            'train_sample_size': self.train_sample_size,
+            'code_size': self.code_size,
+            'rerank': self.rerank,
+            'rerank_k_factor': self.rerank_k_factor,
+            'hnsw_m': self.hnsw_m,
+            'ef_construction': self.ef_construction,
+            'ef_search': self.ef_search,
+            'num_threads': self.num_threads,
+            'id_map': self.id_map,
+            'binary_prefilter': self.binary_prefilter,
+            'binary_bits': self.binary_bits,
+            'binary_k_factor': self.binary_k_factor,
+            'tuning': self.tuning,
+            'is_trained': self.is_trained
+        }
+    
     def save(self, directory: str, name: str = 'faiss_index'):
         """
         Save index and metadata
         
+        Writes <name>.index, columnar tile metadata as .npy files in
+        <name>_columns/ (memory-mappable), tombstones, and a JSON
+        manifest <name>_manifest.json with the format version, index
+        parameters, provenance and SHA-256 checksums of all files.
+        
         Args:
             directory: Directory to save to
             name: Base name for files
         """
-        Path(directory).mkdir(parents=True, exist_ok=True)
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
         
         # Save index
-        index_path = Path(directory) / f"{name}.index"
+        index_path = directory / f"{name}.index"
         faiss.write_index(self.index, str(index_path))
         
-        # Save metadata
-        metadata_path = Path(directory) / f"{name}_metadata.pkl"
-        with open(metadata_path, 'wb') as f:
-            pickle.dump({
-                'tile_metadata': self.tile_metadata,
-                'embedding_dim': self.embedding_dim,
-                'index_type': self.index_type,
-                'metric': self.metric,
-                'nlist': self.nlist,
-                'nprobe': self.nprobe,
-                'is_trained': self.is_trained
-            }, f)
+        # Save tile metadata and tombstoned rows
+        columns_dir = directory / f"{name}_columns"
+        self.tile_metadata.save(columns_dir)
+        tombstones_path = directory / f"{name}_tombstones.npy"
+        np.save(tombstones_path, self.tombstones)
+        files = [index_path, tombstones_path, *columns_dir.iterdir()]
+        
+        # Binary prefilter codes and the projection that produced them
+        if self.binary_index is not None:
+            binary_path = directory / f"{name}_binary.index"
+            projection_path = directory / f"{name}_binary_projection.npy"
+            faiss.write_index_binary(self.binary_index, str(binary_path))
+            np.save(projection_path, self.binary_projection)
+            files += [binary_path, projection_path]
+        
+        # Manifest last, so it only describes complete files
+        write_manifest(directory, name, self.params(), self.provenance, files)
+        
+        # Parameters now live in the manifest; drop a stale pickle sidecar
+        legacy_path = directory / f"{name}_metadata.pkl"
+        if legacy_path.exists():
+            legacy_path.unlink()
         
         logger.info(f"Saved index to {directory}")
     
     @classmethod
-    def load(cls, directory: str, name: str = 'faiss_index') -> 'FAISSIndex':
+    def load(
+        cls,
+        directory: str,
+        name: str = 'faiss_index',
+        mmap: bool = False,
+        verify: Union[bool, str] = 'size',
+        allow_pickle: bool = False
+    ) -> 'FAISSIndex':
         """
         Load index from disk
         
         Args:
             directory: Directory containing index files
             name: Base name of files
+            mmap: Memory-map the index and metadata columns read-only
+                  instead of reading them into memory. Load time becomes
+                  near-constant and processes serving the same index share
+                  pages; the loaded index cannot be modified.
+            verify: Check index files against the manifest: 'size'
+                    (default) compares file sizes, 'full' also verifies
+                    SHA-256 checksums (reads every file once, so an mmap
+                    load is no longer near-constant), 'none' skips checks
+            allow_pickle: Accept the legacy pickled-metadata format.
+                          Unpickling can run arbitrary code, so only
+                          enable this for indexes from a trusted source
+                          (then save() again to convert them).
             
         Returns:
             FAISSIndex instance
+            
+        Raises:
+            IndexFormatError: Unsupported version, modified files, or a
+                              legacy index without allow_pickle
         """
-        # Load metadata
-        metadata_path = Path(directory) / f"{name}_metadata.pkl"
-        with open(metadata_path, 'rb') as f:
-            data = pickle.load(f)
+        directory = Path(directory)
+        legacy_path = directory / f"{name}_metadata.pkl"
+        
+        if manifest_path(directory, name).exists():
+            manifest = read_manifest(directory, name, verify=verify)
+            data = manifest['params']
+            provenance = manifest.get('provenance', {})
+        elif legacy_path.exists():
+            if not allow_pickle:
+                raise IndexFormatError(
+                    f"{legacy_path} uses the legacy pickle format; load it with "
+                    f"allow_pickle=True only if it comes from a trusted source"
+                )
+            with open(legacy_path, 'rb') as f:
+                data = pickle.load(f)
+            provenance = {}
+        else:
+            raise FileNotFoundError(f"No index named '{name}' in {directory}")
         
         # Create instance
         instance = cls(
@@ -247,26 +982,227 @@ class FAISSIndex:
             index_type=data['index_type'],
             metric=data['metric'],
             nlist=data['nlist'],
-            nprobe=data['nprobe']
+            nprobe=data['nprobe'],
+            reduce_dim=data.get('reduce_dim'),
+            whiten=data.get('whiten', False),
+            train_sample_size=data.get('train_sample_size'),
+            code_size=data.get('code_size', 32),
+            rerank=data.get('rerank', False),
+            rerank_k_factor=data.get('rerank_k_factor', 4),
+            hnsw_m=data.get('hnsw_m', 32),
+            ef_construction=data.get('ef_construction', 200),
+            ef_search=data.get('ef_search', 64),
+            num_threads=data.get('num_threads'),
+            id_map=data.get('id_map', False),
+            binary_prefilter=data.get('binary_prefilter', False),
+            binary_bits=data.get('binary_bits', 256),
+            binary_k_factor=data.get('binary_k_factor', 16)
         )
+        instance.tuning = data.get('tuning')
+        instance.provenance = provenance
+        instance.mapped = mmap
         
         # Load index
-        index_path = Path(directory) / f"{name}.index"
-        instance.index = faiss.read_index(str(index_path))
-        instance.tile_metadata = data['tile_metadata']
+        index_path = directory / f"{name}.index"
+        if mmap:
+            io_flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+            if instance.index_type not in IVF_INDEX_TYPES:
+                # Zero-copy mapping of flat code arrays (newer FAISS only);
+                # IVF lists are mapped by IO_FLAG_MMAP and fail to read with it
+                io_flags |= getattr(faiss, 'IO_FLAG_MMAP_IFC', 0)
+            instance.index = faiss.read_index(str(index_path), io_flags)
+        else:
+            instance.index = faiss.read_index(str(index_path))
+        
+        # Load tile metadata (columnar, or list of dicts from older indexes)
+        columns_dir = directory / f"{name}_columns"
+        if columns_dir.exists():
+            instance.tile_metadata = TileMetadata.load(columns_dir, mmap=mmap)
+        else:
+            instance.tile_metadata = TileMetadata.from_records(data['tile_metadata'])
+        tombstones_path = directory / f"{name}_tombstones.npy"
+        if tombstones_path.exists():
+            instance.tombstones = np.load(tombstones_path, allow_pickle=False)
+        if instance.binary_prefilter:
+            instance.binary_index = faiss.read_index_binary(str(directory / f"{name}_binary.index"))
+            instance.binary_projection = np.load(directory / f"{name}_binary_projection.npy", allow_pickle=False)
         instance.is_trained = data['is_trained']
         
-        logger.info(f"Loaded index from {directory} with {instance.index.ntotal} vectors")
+        logger.info(f"Loaded index from {directory} with {instance.index.ntotal} vectors"
+                    f"{' (mmap)' if mmap else ''}")
         
         return instance
     
+    def check_compatibility(self, expected: Dict):
+        """
+        Ensure the index was built by the pipeline that will query it
+        
+        Args:
+            expected: Provenance of the running pipeline
+                      (index_format.build_provenance)
+            
+        Raises:
+            IndexCompatibilityError: Listing every mismatching field
+        """
+        issues = compatibility_issues(self.provenance, expected)
+        
+        expected_dim = expected.get('embedder', {}).get('embedding_dim')
+        recorded_dim = self.provenance.get('embedder', {}).get('embedding_dim')
+        if recorded_dim is None and expected_dim is not None and expected_dim != self.embedding_dim:
+            issues.append(f"embedding_dim: index has {self.embedding_dim}, embedder produces {expected_dim}")
+        
+        if issues:
+            raise IndexCompatibilityError("Index is incompatible with the running embedder: " + "; ".join(issues))
+        
+        if not self.provenance:
+            logger.warning("Index has no provenance record; compatibility only checked by dimension")
+    
     def reset(self):
         """Reset index (clear all vectors)"""
         self.index = self._create_index()
-        self.tile_metadata = []
+        if self.binary_index is not None:
+            self.binary_index = faiss.IndexBinaryFlat(self.binary_bits)
+        self.tile_metadata = TileMetadata()
+        self.tombstones = np.array([], dtype=np.int64)
         self.is_trained = False
     
     @property
     def ntotal(self) -> int:
         """Number of vectors in index"""
         return self.index.ntotal
+    
+    def image_ids(self) -> List[str]:
+        """Distinct image ids present in the index"""
+        if len(self.tombstones):
+            return self.tile_metadata.unique('image_id', mask=self._live_mask())
+        return self.tile_metadata.unique('image_id')
+    
+    def memory_usage(self, include_mapped: bool = False, include_metadata: bool = True) -> int:
+        """
+        Approximate memory size of the index, estimated from its structure
+        
+        Counts codes, ids, coarse centroids and graph links from the index
+        sizes rather than serializing it, so measuring needs no extra
+        memory and does not fault in memory-mapped files.
+        
+        Args:
+            include_mapped: Also count bytes backed by memory-mapped files
+                            (shared page cache rather than process memory)
+            include_metadata: Count tile metadata columns
+            
+        Returns:
+            Size in bytes
+        """
+        # Flags load() used: IVF lists are always mapped, flat codes only with IO_FLAG_MMAP_IFC
+        mapped_codes = (self.mapped and self.index_type not in IVF_INDEX_TYPES
+                        and hasattr(faiss, 'IO_FLAG_MMAP_IFC'))
+        resident, mapped = _faiss_index_bytes(self.index, self.mapped, mapped_codes)
+        if self.binary_index is not None:
+            resident += self.binary_index.ntotal * self.binary_index.code_size
+        
+        if include_metadata:
+            metadata_resident, metadata_mapped = self.tile_metadata.memory_usage()
+            resident += metadata_resident
+            mapped += metadata_mapped
+        
+        return int(resident + mapped if include_mapped else resident)
+
+
+def _faiss_index_bytes(
+    index: faiss.Index,
+    mapped_lists: bool = False,
+    mapped_codes: bool = False
+) -> Tuple[int, int]:
+    """
+    (resident, mapped) bytes of a FAISS index, estimated from its structure
+    
+    Args:
+        index: FAISS index, possibly wrapped (pre-transform, id map, refine)
+        mapped_lists: IVF inverted lists are memory-mapped (IO_FLAG_MMAP)
+        mapped_codes: Flat code arrays are memory-mapped (IO_FLAG_MMAP_IFC)
+    """
+    index = faiss.downcast_index(index)
+    
+    if isinstance(index, faiss.IndexPreTransform):
+        transforms = sum(4 * index.chain.at(i).d_in * (index.chain.at(i).d_out + 1)
+                         for i in range(index.chain.size()))
+        resident, in_file = _faiss_index_bytes(index.index, mapped_lists, mapped_codes)
+        return resident + transforms, in_file
+    
+    if isinstance(index, faiss.IndexIDMap2):
+        # id_map vector plus the reverse hash map
+        resident, in_file = _faiss_index_bytes(index.index, mapped_lists, mapped_codes)
+        return resident + 32 * index.ntotal, in_file
+    
+    if isinstance(index, faiss.IndexRefineFlat):
+        base = _faiss_index_bytes(index.base_index, mapped_lists, mapped_codes)
+        refine = _faiss_index_bytes(index.refine_index, mapped_lists, mapped_codes)
+        return base[0] + refine[0], base[1] + refine[1]
+    
+    if isinstance(index, faiss.IndexIVF):
+        # Inverted lists hold one code and one int64 id per vector
+        quantizer, _ = _faiss_index_bytes(index.quantizer)
+        if isinstance(index, faiss.IndexIVFPQ):
+            quantizer += 4 * index.pq.centroids.size()
+        lists = index.ntotal * (index.code_size + 8)
+        return (quantizer, lists) if mapped_lists else (quantizer + lists, 0)
+    
+    if isinstance(index, faiss.IndexHNSW):
+        # Neighbour ids (int32), per-node offsets (int64) and levels (int32)
+        links = 4 * index.hnsw.neighbors.size() + 12 * index.ntotal
+        resident, in_file = _faiss_index_bytes(index.storage, mapped_lists, mapped_codes)
+        return resident + links, in_file
+    
+    if isinstance(index, faiss.IndexFlatCodes):
+        codes = index.ntotal * index.code_size
+        return (0, codes) if mapped_codes else (codes, 0)
+    
+    # Unknown index type: assume float32 vectors
+    return 4 * index.ntotal * index.d, 0
+
+
+def recall_at_k(
+    reference_indices: np.ndarray,
+    candidate_indices: np.ndarray,
+    k: Optional[int] = None
+) -> float:
+    """
+    Mean fraction of the reference top-K neighbours found in the candidate top-K
+    
+    Args:
+        reference_indices: Ground-truth neighbour ids of shape (N, K), e.g. exact search
+        candidate_indices: Neighbour ids to evaluate of shape (N, K')
+        k: Number of neighbours to compare (defaults to reference width)
+        
+    Returns:
+        Recall in [0, 1]
+    """
+    k = k or reference_indices.shape[1]
+    recalls = []
+    
+    for ref, cand in zip(reference_indices[:, :k], candidate_indices[:, :k]):
+        ref = ref[ref >= 0]
+        if len(ref) == 0:
+            continue
+        recalls.append(len(np.intersect1d(ref, cand[cand >= 0])) / len(ref))
+    
+    return float(np.mean(recalls)) if recalls else 0.0
+
+
+def drop_query_ids(indices: np.ndarray, query_ids: np.ndarray, k: int) -> np.ndarray:
+    """
+    Remove each query's own id from its neighbour list
+    
+    Args:
+        indices: Neighbour ids of shape (N, K'), searched with K' > k
+        query_ids: Id of each query vector in the index, shape (N,)
+        k: Neighbours to keep per query
+        
+    Returns:
+        Neighbour ids of shape (N, k), padded with -1
+    """
+    keep = indices != np.asarray(query_ids)[:, None]
+    # Stable sort moves dropped entries to the end of each row
+    order = np.argsort(~keep, axis=1, kind='stable')
+    indices = np.where(keep, indices, -1)
+    return np.take_along_axis(indices, order, axis=1)[:, :k]
@@ -0,0 +1,212 @@
+"""
+Versioned on-disk index format
+JSON manifest with FAISS parameters, provenance of the embeddings
+(embedder checkpoint hash, tiler and normalization settings) and the
+size, modification time and SHA-256 checksum of every index file
+"""
+
+import hashlib
+import json
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 2
+
+# Provenance fields that must match the running pipeline for the
+# stored embeddings to be comparable with new query embeddings
+COMPATIBILITY_FIELDS = [
+    ('embedder', 'architecture'),
+    ('embedder', 'embedding_dim'),
+    ('embedder', 'input_channels'),
+    ('embedder', 'normalize_embeddings'),
+    ('embedder', 'checkpoint_sha256'),
+    ('tiler', 'tile_size'),
+    ('preprocessing', 'normalization'),
+]
+
+
+class IndexFormatError(ValueError):
+    """Index files are missing, corrupt or of an unsupported version"""
+
+
+class IndexCompatibilityError(ValueError):
+    """Index was built with a different embedder or preprocessing"""
+
+
+# Load-time checks of index files against the manifest: 'size' compares
+# file sizes (cheap, catches truncated copies), 'full' also re-hashes
+# every file (reads the whole index, undoing the benefit of mmap loads)
+VERIFY_MODES = ('none', 'size', 'full')
+
+
+def verify_mode(verify: Union[bool, str, None]) -> str:
+    """Normalize a verify argument (bool for backwards compatibility) to a VERIFY_MODES entry"""
+    if verify is None or verify is False:
+        return 'none'
+    if verify is True:
+        return 'size'
+    if verify not in VERIFY_MODES:
+        raise ValueError(f"Unknown verify mode: {verify!r} (expected one of {VERIFY_MODES})")
+    return verify
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    """SHA-256 hex digest of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_record(path: Path) -> Dict:
+    """Size, modification time and checksum of one index file"""
+    stat = path.stat()
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': file_sha256(path)}
+
+
+def manifest_path(directory: str, name: str) -> Path:
+    """Path of an index's manifest file"""
+    return Path(directory) / f"{name}_manifest.json"
+
+
+def write_manifest(
+    directory: str,
+    name: str,
+    params: Dict,
+    provenance: Dict,
+    files: List[Path]
+):
+    """
+    Write the manifest for a saved index
+
+    Args:
+        directory: Index directory
+        name: Base name of index files
+        params: FAISSIndex parameters
+        provenance: How the embeddings were produced (see build_provenance)
+        files: Index files to record, inside directory
+    """
+    directory = Path(directory)
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'params': params,
+        'provenance': provenance,
+        'files': {
+            path.relative_to(directory).as_posix(): file_record(path)
+            for path in sorted(files)
+        },
+    }
+
+    with open(manifest_path(directory, name), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+
+def read_manifest(directory: str, name: str, verify: Union[bool, str] = 'size') -> Dict:
+    """
+    Read and validate an index manifest
+
+    Args:
+        directory: Index directory
+        name: Base name of index files
+        verify: 'size' (or True) checks file sizes, and notes files
+                modified since save; 'full' also checks SHA-256
+                checksums, reading every file; 'none' (or False) only
+                checks the files exist
+
+    Returns:
+        Manifest dict
+
+    Raises:
+        IndexFormatError: Unsupported version, missing or modified files
+    """
+    with open(manifest_path(directory, name), 'r') as f:
+        manifest = json.load(f)
+
+    version = manifest.get('format_version')
+    if version != FORMAT_VERSION:
+        raise IndexFormatError(f"Unsupported index format version {version} (expected {FORMAT_VERSION})")
+
+    mode = verify_mode(verify)
+    for relative, expected in manifest['files'].items():
+        path = Path(directory) / relative
+        if not path.exists():
+            raise IndexFormatError(f"Index file missing: {path}")
+        if mode == 'none':
+            continue
+
+        # Early version 2 manifests stored the checksum only
+        if isinstance(expected, str):
+            expected = {'sha256': expected}
+
+        stat = path.stat()
+        if 'size' in expected and stat.st_size != expected['size']:
+            raise IndexFormatError(f"Size mismatch for {path}: {stat.st_size} bytes, expected {expected['size']}")
+        if mode == 'full' and file_sha256(path) != expected['sha256']:
+            raise IndexFormatError(f"Checksum mismatch for {path}")
+        if mode == 'size' and expected.get('mtime_ns') not in (None, stat.st_mtime_ns):
+            # Copies change mtime too, so this is only a hint
+            logger.info(f"{path} modified since the index was saved; load with verify='full' to check contents")
+
+    return manifest
+
+
+def build_provenance(
+    config: Dict,
+    checkpoint: Optional[str] = None,
+    precision: Optional[str] = None
+) -> Dict:
+    """
+    Describe how embeddings are produced by a pipeline configuration
+
+    Args:
+        config: Pipeline config (embedder, tiler, preprocessing sections)
+        checkpoint: Embedder checkpoint path actually loaded
+        precision: Inference precision used
+
+    Returns:
+        Provenance dict stored in (or compared against) index manifests
+    """
+    embedder = config.get('embedder', {})
+    tiler = config.get('tiler', {})
+
+    return {
+        'embedder': {
+            'architecture': embedder.get('architecture'),
+            'embedding_dim': embedder.get('embedding_dim'),
+            'input_channels': embedder.get('input_channels'),
+            'normalize_embeddings': embedder.get('normalize_embeddings'),
+            'checkpoint_sha256': file_sha256(checkpoint) if checkpoint and Path(checkpoint).exists() else None,
+            'precision': precision or embedder.get('precision', 'fp32'),
+        },
+        'tiler': {
+            'tile_size': tiler.get('tile_size'),
+            'stride': tiler.get('stride'),
+            'scales': tiler.get('scales'),
+        },
+        'preprocessing': {
+            'normalization': config.get('preprocessing', {}).get('normalization'),
+        },
+    }
+
+
+def compatibility_issues(stored: Dict, expected: Dict) -> List[str]:
+    """
+    Differences between an index's provenance and the running pipeline
+
+    Fields missing on either side (e.g. indexes built before provenance
+    was recorded) are not reported.
+
+    Returns:
+        List of human-readable mismatches (empty if compatible)
+    """
+    issues = []
+    for section, field in COMPATIBILITY_FIELDS:
+        have = stored.get(section, {}).get(field)
+        want = expected.get(section, {}).get(field)
+        if have is not None and want is not None and have != want:
+            issues.append(f"{section}.{field}: index has {have!r}, pipeline has {want!r}")
+    return issues
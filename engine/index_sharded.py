@@ -0,0 +1,501 @@
+"""
+Sharded FAISS index
+Partitions tiles into independently built and saved FAISSIndex shards
+(e.g. per scene group, acquisition batch or tile scale) and searches
+them in parallel
+"""
+
+import json
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+import logging
+
+from .index_faiss import FAISSIndex
+from .search_result import SearchResult
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'shards.json'
+
+
+class ShardedFAISSIndex:
+    """
+    Collection of FAISSIndex shards searched with parallel fan-out
+
+    Global vector ids are shard offset + local id, following shard order.
+    New shards can be added and saved without touching existing ones.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        """
+        Args:
+            max_workers: Threads used to search shards in parallel
+                         (None = one per shard, capped by the executor default)
+        """
+        self.max_workers = max_workers
+        self.shards: Dict[str, FAISSIndex] = {}
+        self.shard_scales: Dict[str, float] = {}  # Tile scale of per-scale shards
+        self._saved: set = set()  # Shards already on disk
+
+    # ------------------------------------------------------------------
+    # Building
+    # ------------------------------------------------------------------
+
+    def add_shard(self, name: str, index: FAISSIndex):
+        """
+        Register a built FAISSIndex as a new shard
+
+        Args:
+            name: Unique shard name (used as its directory name)
+            index: Shard index; must match existing shards' dim and metric
+        """
+        if name in self.shards:
+            raise ValueError(f"Shard already exists: {name}")
+
+        if self.shards:
+            reference = next(iter(self.shards.values()))
+            if (index.embedding_dim, index.metric) != (reference.embedding_dim, reference.metric):
+                raise ValueError(
+                    f"Shard {name} ({index.embedding_dim}-d, {index.metric}) does not match "
+                    f"existing shards ({reference.embedding_dim}-d, {reference.metric})"
+                )
+
+        self.shards[name] = index
+        logger.info(f"Added shard {name} with {index.ntotal} vectors. Total: {self.ntotal}")
+
+    def create_shard(
+        self,
+        name: str,
+        vectors: np.ndarray,
+        metadata: Optional[List[Dict]] = None,
+        **index_kwargs
+    ) -> FAISSIndex:
+        """
+        Build a new shard from vectors and add it
+
+        Args:
+            name: Unique shard name
+            vectors: Embeddings of shape (N, D)
+            metadata: Tile metadata dicts
+            **index_kwargs: FAISSIndex constructor arguments
+
+        Returns:
+            The new shard
+        """
+        index = FAISSIndex(embedding_dim=vectors.shape[1], **index_kwargs)
+        index.add(vectors, metadata)
+        self.add_shard(name, index)
+        return index
+
+    def add_scenes(
+        self,
+        vectors: np.ndarray,
+        metadata: List[Dict],
+        scenes_per_shard: int = 50,
+        prefix: str = 'shard',
+        **index_kwargs
+    ) -> List[str]:
+        """
+        Partition tiles by scene (image_id) into new shards
+
+        Args:
+            vectors: Embeddings of shape (N, D)
+            metadata: Tile metadata dicts with 'image_id'
+            scenes_per_shard: Scenes grouped into each shard
+            prefix: Shard name prefix
+            **index_kwargs: FAISSIndex constructor arguments
+
+        Returns:
+            Names of the created shards
+        """
+        image_ids = np.array([m['image_id'] for m in metadata])
+        scenes = list(dict.fromkeys(image_ids))  # Preserve first-seen order
+
+        names = []
+        for start in range(0, len(scenes), scenes_per_shard):
+            group = scenes[start:start + scenes_per_shard]
+            rows = np.flatnonzero(np.isin(image_ids, group))
+
+            name = f"{prefix}_{len(self.shards):04d}"
+            self.create_shard(name, vectors[rows], [metadata[i] for i in rows], **index_kwargs)
+            names.append(name)
+
+        return names
+
+    def add_scales(
+        self,
+        vectors: np.ndarray,
+        metadata: List[Dict],
+        prefix: str = 'scale',
+        **index_kwargs
+    ) -> List[str]:
+        """
+        Partition tiles by tiler scale into new per-scale shards
+
+        Searches given query_scales only visit the shards of those scales.
+
+        Args:
+            vectors: Embeddings of shape (N, D)
+            metadata: Tile metadata dicts with 'scale'
+            prefix: Shard name prefix
+            **index_kwargs: FAISSIndex constructor arguments
+
+        Returns:
+            Names of the created shards
+        """
+        scales = np.array([m['scale'] for m in metadata], dtype=np.float64)
+
+        names = []
+        for scale in np.unique(scales):
+            rows = np.flatnonzero(scales == scale)
+
+            name = f"{prefix}_{len(self.shards):04d}"
+            self.create_shard(name, vectors[rows], [metadata[i] for i in rows], **index_kwargs)
+            self.shard_scales[name] = float(scale)
+            names.append(name)
+
+        return names
+
+    # ------------------------------------------------------------------
+    # Search
+    # ------------------------------------------------------------------
+
+    @property
+    def ntotal(self) -> int:
+        """Number of vectors across all shards"""
+        return sum(shard.ntotal for shard in self.shards.values())
+
+    @property
+    def embedding_dim(self) -> int:
+        """Shared embedding dimension of the shards"""
+        return next(iter(self.shards.values())).embedding_dim if self.shards else 0
+
+    @property
+    def metric(self) -> str:
+        """Shared metric of the shards"""
+        return next(iter(self.shards.values())).metric if self.shards else 'cosine'
+
+    def image_ids(self) -> List[str]:
+        """Distinct image ids across all shards"""
+        ids = set()
+        for shard in self.shards.values():
+            ids.update(shard.image_ids())
+        return sorted(ids)
+
+    def memory_usage(self, include_mapped: bool = False, include_metadata: bool = True) -> int:
+        """Approximate memory size of all shards in bytes (see FAISSIndex.memory_usage)"""
+        return sum(shard.memory_usage(include_mapped, include_metadata) for shard in self.shards.values())
+
+    def _fan_out(self, fn, routes: List[Tuple[str, Optional[np.ndarray]]]) -> list:
+        """Run fn(shard, query rows) for each route in parallel, in route order"""
+        calls = [(self.shards[name], rows) for name, rows in routes]
+        if len(calls) <= 1:
+            return [fn(*call) for call in calls]
+
+        with ThreadPoolExecutor(max_workers=self.max_workers or len(calls)) as pool:
+            return list(pool.map(lambda call: fn(*call), calls))
+
+    def _route(
+        self,
+        names: List[str],
+        query_scales: Optional[List[List[float]]]
+    ) -> List[Tuple[str, Optional[np.ndarray]]]:
+        """
+        Queries each selected shard has to answer
+
+        Shards without a recorded scale answer every query. A query
+        whose scales match none of the selected per-scale shards is sent
+        to all of them rather than dropped.
+
+        Returns:
+            (shard name, query rows) pairs; rows None means all queries
+        """
+        if query_scales is None or not self.shard_scales:
+            return [(name, None) for name in names]
+
+        scaled = [name for name in names if name in self.shard_scales]
+        shard_scales = np.array([self.shard_scales[name] for name in scaled])
+        routed = np.array([
+            np.isclose(shard_scales[:, None], np.atleast_1d(scales)).any(axis=1)
+            for scales in query_scales
+        ]).reshape(len(query_scales), len(scaled))
+        routed[~routed.any(axis=1)] = True
+
+        routes = []
+        for name in names:
+            if name not in self.shard_scales:
+                routes.append((name, None))
+                continue
+            rows = np.flatnonzero(routed[:, scaled.index(name)])
+            if len(rows):
+                routes.append((name, rows))
+        return routes
+
+    def _offsets(self) -> Dict[str, int]:
+        """First global id of each shard"""
+        # Ids address metadata rows, which include tombstoned ones
+        offsets = np.cumsum([0] + [len(shard.tile_metadata) for shard in self.shards.values()])
+        return dict(zip(self.shards, offsets[:-1].tolist()))
+
+    def _shards_for(self, image_ids: Optional[List[str]]) -> List[str]:
+        """Names of shards that may hold any of the scenes (all if None)"""
+        if image_ids is None:
+            return list(self.shards)
+
+        return [
+            name for name, shard in self.shards.items()
+            if 'image_id' in shard.tile_metadata.fields
+            and np.isin(shard.tile_metadata.categories('image_id'), list(image_ids)).any()
+        ]
+
+    def _empty_distance(self) -> float:
+        """Distance FAISS reports for missing neighbours"""
+        return np.inf if self.metric == 'l2' else -np.inf
+
+    def _empty_result(self, n_queries: int, k: int) -> SearchResult:
+        """SearchResult with no hits, for an index without shards"""
+        return SearchResult(
+            np.full((n_queries, k), -np.inf, dtype=np.float32),
+            np.full((n_queries, k), self._empty_distance(), dtype=np.float32),
+            np.full((n_queries, k), -1, dtype=np.int64)
+        )
+
+    def search(
+        self,
+        query_vectors: np.ndarray,
+        k: int = 100,
+        image_ids: Optional[List[str]] = None,
+        query_scales: Optional[List[List[float]]] = None,
+        **search_kwargs
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Search all shards in parallel and merge the top-K
+
+        Args:
+            query_vectors: Query embeddings of shape (N, D)
+            k: Number of neighbors to retrieve
+            image_ids: Restrict results to these scenes; shards holding
+                       none of them are not searched
+            query_scales: Tile scales each query may match (see
+                          tiler.route_scales); per-scale shards of other
+                          scales are not searched for it (None = all)
+            **search_kwargs: Per-call overrides passed to FAISSIndex.search
+
+        Returns:
+            Tuple of (distances, global indices) both of shape (N, k)
+        """
+        n_queries = len(query_vectors)
+        names = self._shards_for(image_ids)
+        if not names:
+            return (np.full((n_queries, k), self._empty_distance(), dtype=np.float32),
+                    np.full((n_queries, k), -1, dtype=np.int64))
+
+        routes = self._route(names, query_scales)
+        results = self._fan_out(
+            lambda shard, rows: shard.search(
+                query_vectors if rows is None else query_vectors[rows], k,
+                image_ids=image_ids, **search_kwargs
+            ),
+            routes
+        )
+
+        offsets = self._offsets()
+        all_distances, all_indices = [], []
+        for (distances, indices), (name, rows) in zip(results, routes):
+            indices = np.where(indices >= 0, indices + offsets[name], -1)
+            if rows is not None:
+                placed = np.full((n_queries, indices.shape[1]), self._empty_distance(), dtype=distances.dtype)
+                placed[rows] = distances
+                distances = placed
+                placed = np.full((n_queries, indices.shape[1]), -1, dtype=indices.dtype)
+                placed[rows] = indices
+                indices = placed
+            all_distances.append(distances)
+            all_indices.append(indices)
+
+        distances = np.concatenate(all_distances, axis=1)
+        indices = np.concatenate(all_indices, axis=1)
+
+        # Best first: highest inner product for cosine, smallest distance for L2
+        keys = -distances if self.metric == 'cosine' else distances.copy()
+        keys[indices < 0] = np.inf
+        order = np.argsort(keys, axis=1, kind='stable')[:, :k]
+
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(indices, order, axis=1)
+
+    def _merge_routed(
+        self,
+        per_shard: List[SearchResult],
+        routes: List[Tuple[str, Optional[np.ndarray]]],
+        n_queries: int
+    ) -> List[SearchResult]:
+        """Shift shard results to global ids and expand routed subsets to all queries"""
+        offsets = self._offsets()
+        merged = []
+        for result, (name, rows) in zip(per_shard, routes):
+            result.indices = np.where(result.indices >= 0, result.indices + offsets[name], -1)
+            if rows is not None:
+                result = result.expand(rows, n_queries, self._empty_distance())
+            merged.append(result)
+        return merged
+
+    def search_with_metadata(
+        self,
+        query_vectors: np.ndarray,
+        k: int = 100,
+        image_ids: Optional[List[str]] = None,
+        query_scales: Optional[List[List[float]]] = None,
+        **search_kwargs
+    ) -> SearchResult:
+        """
+        Search all shards in parallel and merge results by score
+
+        Returns:
+            Columnar SearchResult with global indices, same format as
+            FAISSIndex.search_with_metadata
+        """
+        if not self.shards:
+            return self._empty_result(len(query_vectors), k)
+
+        # With no matching shard, one shard still gives a correctly shaped empty result
+        names = self._shards_for(image_ids) or list(self.shards)[:1]
+        routes = self._route(names, query_scales)
+        per_shard = self._fan_out(
+            lambda shard, rows: shard.search_with_metadata(
+                query_vectors if rows is None else query_vectors[rows], k,
+                image_ids=image_ids, **search_kwargs
+            ),
+            routes
+        )
+
+        return SearchResult.concatenate(self._merge_routed(per_shard, routes, len(query_vectors)), k)
+
+    def range_search(
+        self,
+        query_vectors: np.ndarray,
+        threshold: float,
+        max_results: int = 1000,
+        image_ids: Optional[List[str]] = None,
+        query_scales: Optional[List[List[float]]] = None,
+        **search_kwargs
+    ) -> SearchResult:
+        """
+        Range search all shards in parallel and merge, best first
+
+        Returns:
+            Columnar SearchResult with global indices and at most
+            max_results hits per query, as FAISSIndex.range_search
+        """
+        if not self.shards:
+            return self._empty_result(len(query_vectors), 0)
+
+        # With no matching shard, one shard still gives a correctly shaped empty result
+        names = self._shards_for(image_ids) or list(self.shards)[:1]
+        routes = self._route(names, query_scales)
+        per_shard = self._fan_out(
+            lambda shard, rows: shard.range_search(
+                query_vectors if rows is None else query_vectors[rows], threshold, max_results,
+                image_ids=image_ids, **search_kwargs
+            ),
+            routes
+        )
+
+        per_shard = self._merge_routed(per_shard, routes, len(query_vectors))
+        width = min(max_results, sum(result.scores.shape[1] for result in per_shard))
+        return SearchResult.concatenate(per_shard, width)
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+
+    def save(self, directory: str):
+        """
+        Save new shards and the shard manifest
+
+        Shards already on disk are not rewritten, so adding a shard to a
+        large archive only writes that shard.
+
+        Args:
+            directory: Directory holding one sub-directory per shard
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+
+        for name, shard in self.shards.items():
+            if name not in self._saved:
+                shard.save(str(directory / name), 'faiss_index')
+                self._saved.add(name)
+
+        with open(directory / MANIFEST_FILE, 'w') as f:
+            json.dump({'shards': list(self.shards), 'scales': self.shard_scales}, f, indent=2)
+
+        logger.info(f"Saved {len(self.shards)} shards to {directory}")
+
+    @classmethod
+    def load(
+        cls,
+        directory: str,
+        mmap: bool = False,
+        max_workers: Optional[int] = None,
+        verify: Union[bool, str] = 'size'
+    ) -> 'ShardedFAISSIndex':
+        """
+        Load all shards listed in the manifest
+
+        Args:
+            directory: Directory written by save()
+            mmap: Memory-map shard indexes and metadata
+            max_workers: Threads for parallel search
+            verify: Check shard files against their manifests
+                    ('size', 'full' or 'none', see FAISSIndex.load)
+
+        Returns:
+            ShardedFAISSIndex instance
+        """
+        directory = Path(directory)
+        with open(directory / MANIFEST_FILE, 'r') as f:
+            manifest = json.load(f)
+
+        instance = cls(max_workers=max_workers)
+        for name in manifest['shards']:
+            shard = FAISSIndex.load(str(directory / name), 'faiss_index', mmap=mmap, verify=verify)
+            instance.add_shard(name, shard)
+            instance._saved.add(name)
+        instance.shard_scales = manifest.get('scales', {})
+
+        return instance
+
+    def check_compatibility(self, expected: Dict):
+        """Ensure every shard was built by the running pipeline (see FAISSIndex.check_compatibility)"""
+        for shard in self.shards.values():
+            shard.check_compatibility(expected)
+
+    @staticmethod
+    def exists(directory: str) -> bool:
+        """Whether directory holds a sharded index"""
+        return (Path(directory) / MANIFEST_FILE).exists()
+
+
+def load_any_index(
+    directory: str,
+    name: str = 'faiss_index',
+    mmap: bool = False,
+    verify: Union[bool, str] = 'size'
+):
+    """
+    Load either a sharded or a single index from a directory
+
+    Args:
+        directory: Index directory
+        name: Base name of a single index's files
+        mmap: Memory-map index files
+        verify: 'size', 'full' or 'none' (see FAISSIndex.load)
+
+    Returns:
+        ShardedFAISSIndex or FAISSIndex
+    """
+    if ShardedFAISSIndex.exists(directory):
+        return ShardedFAISSIndex.load(directory, mmap=mmap, verify=verify)
+    return FAISSIndex.load(directory, name, mmap=mmap, verify=verify)
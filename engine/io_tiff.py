@@ -4,12 +4,19 @@ Handles reading, writing, and normalization of B,G,R,NIR bands
 """
 
 import numpy as np
-import rasterio
-from rasterio.windows import Window
 from typing import Tuple, Optional, Union, List
 import warnings
 
-warnings.filterwarnings('ignore', category=rasterio.errors.NotGeoreferencedWarning)
+
+def _rasterio():
+    """
+    Import rasterio on first use
+    Keeps `import engine` cheap for jobs that never touch TIFFs
+    """
+    import rasterio
+    
+    warnings.filterwarnings('ignore', category=rasterio.errors.NotGeoreferencedWarning)
+    return rasterio
 
 
 def read_tiff(
@@ -32,6 +39,9 @@ def read_tiff(
         - array: shape (C, H, W) or (H, W) for single band
         - metadata: dict with profile info
     """
+    rasterio = _rasterio()
+    from rasterio.windows import Window
+    
     with rasterio.open(filepath) as src:
         # Get metadata
         metadata = {
@@ -103,7 +113,7 @@ def write_tiff(
                 profile[key] = metadata[key]
     
     # Write
-    with rasterio.open(filepath, 'w', **profile) as dst:
+    with _rasterio().open(filepath, 'w', **profile) as dst:
         dst.write(array)
 
 
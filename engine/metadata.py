@@ -0,0 +1,308 @@
+"""
+Columnar tile metadata storage
+Stores per-tile metadata as one NumPy array per field instead of a list
+of dicts, so it can be saved as .npy files and memory-mapped on load
+"""
+
+import json
+import numpy as np
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+COLUMNS_FILE = 'columns.json'
+
+
+def _column_kind(values: list) -> str:
+    """Infer storage kind for a list of Python/NumPy scalars"""
+    if all(isinstance(v, (bool, np.bool_)) for v in values):
+        return 'bool'
+    if all(isinstance(v, (int, np.integer)) and not isinstance(v, (bool, np.bool_)) for v in values):
+        return 'int'
+    if all(isinstance(v, (int, float, np.integer, np.floating)) for v in values):
+        return 'float'
+    if all(isinstance(v, str) for v in values):
+        return 'category'
+    raise TypeError("Metadata values must be all bool, numeric or str per field")
+
+
+def _to_array(values: list, kind: str) -> np.ndarray:
+    """Convert a list of scalars to a compact array of the given kind"""
+    if kind == 'bool':
+        return np.asarray(values, dtype=bool)
+    if kind == 'float':
+        return np.asarray(values, dtype=np.float64)
+    array = np.asarray(values, dtype=np.int64)
+    if len(array) and array.min() >= np.iinfo(np.int32).min and array.max() <= np.iinfo(np.int32).max:
+        array = array.astype(np.int32)
+    return array
+
+
+class TileMetadata:
+    """
+    Columnar per-tile metadata
+
+    Behaves like a read-only sequence of dicts (len, indexing, iteration)
+    for compatibility, while exposing whole columns for vectorized use.
+    String fields (e.g. image_id) are dictionary-encoded as int32 codes
+    plus a categories array. All records must share the same fields.
+    """
+
+    def __init__(self):
+        self._columns: Dict[str, np.ndarray] = {}
+        self._kinds: Dict[str, str] = {}
+        self._categories: Dict[str, np.ndarray] = {}
+        self._category_lookup: Dict[str, Dict[str, int]] = {}
+        self._pending: List[Dict] = []
+        self._length = 0
+
+    # ------------------------------------------------------------------
+    # Sequence interface
+    # ------------------------------------------------------------------
+
+    def __len__(self) -> int:
+        return self._length + len(self._pending)
+
+    def __getitem__(self, idx: int) -> Dict:
+        self._flush()
+        idx = int(idx)
+        if idx < 0:
+            idx += self._length
+        if not 0 <= idx < self._length:
+            raise IndexError(f"Tile index {idx} out of range")
+
+        return {name: self._value(name, idx) for name in self._columns}
+
+    def __iter__(self) -> Iterator[Dict]:
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def append(self, record: Dict):
+        """Append one tile's metadata"""
+        self._pending.append(record)
+
+    def extend(self, records: List[Dict]):
+        """Append metadata for several tiles"""
+        self._pending.extend(records)
+
+    # ------------------------------------------------------------------
+    # Columnar access
+    # ------------------------------------------------------------------
+
+    @property
+    def fields(self) -> List[str]:
+        """Field names in insertion order"""
+        self._flush()
+        return list(self._columns)
+
+    def column(self, name: str) -> np.ndarray:
+        """Decoded column (strings as a NumPy str array)"""
+        self._flush()
+        if self._kinds[name] == 'category':
+            return self._categories[name][self._columns[name]]
+        return self._columns[name]
+
+    def gather(self, name: str, rows: np.ndarray) -> np.ndarray:
+        """Decoded values of a column at the given rows (any shape)"""
+        self._flush()
+        values = self._columns[name][rows]
+        if self._kinds[name] == 'category':
+            return self._categories[name][values]
+        return values
+
+    def codes(self, name: str) -> np.ndarray:
+        """Raw int32 codes of a string column"""
+        self._flush()
+        return self._columns[name]
+
+    def categories(self, name: str) -> np.ndarray:
+        """Distinct values of a string column, indexed by code"""
+        self._flush()
+        return self._categories[name]
+
+    def unique(self, name: str, mask: Optional[np.ndarray] = None) -> List:
+        """Distinct values present in a column (optionally only in masked rows)"""
+        self._flush()
+        if name not in self._columns:
+            return []
+        values = self._columns[name] if mask is None else self._columns[name][mask]
+        if self._kinds[name] == 'category':
+            used = np.unique(values)
+            return [str(v) for v in self._categories[name][used]]
+        return np.unique(values).tolist()
+
+    def memory_usage(self) -> Tuple[int, int]:
+        """(in-memory, memory-mapped) bytes of the columns and categories"""
+        self._flush()
+        resident = mapped = 0
+        for array in list(self._columns.values()) + list(self._categories.values()):
+            if isinstance(array, np.memmap):
+                mapped += array.nbytes
+            else:
+                resident += array.nbytes
+        return resident, mapped
+
+    def take(self, rows: np.ndarray) -> 'TileMetadata':
+        """New TileMetadata holding only the given rows, in order"""
+        self._flush()
+        rows = np.asarray(rows, dtype=np.int64)
+
+        instance = TileMetadata()
+        for name, array in self._columns.items():
+            instance._columns[name] = np.asarray(array[rows])
+            instance._kinds[name] = self._kinds[name]
+            if name in self._categories:
+                instance._categories[name] = self._categories[name]
+        instance._length = len(rows)
+
+        return instance
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+
+    def save(self, directory: str):
+        """
+        Save as one .npy file per column plus a JSON field listing
+
+        Args:
+            directory: Output directory (created if needed)
+        """
+        self._flush()
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+
+        for name, array in self._columns.items():
+            np.save(directory / f"{name}.npy", np.ascontiguousarray(array))
+            if self._kinds[name] == 'category':
+                np.save(directory / f"{name}.categories.npy", self._categories[name])
+
+        with open(directory / COLUMNS_FILE, 'w') as f:
+            json.dump({'length': self._length, 'kinds': self._kinds}, f)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = False) -> 'TileMetadata':
+        """
+        Load columns saved by save()
+
+        Args:
+            directory: Directory written by save()
+            mmap: Memory-map the column files read-only instead of reading
+                  them, so processes loading the same index share pages
+
+        Returns:
+            TileMetadata instance
+        """
+        directory = Path(directory)
+        with open(directory / COLUMNS_FILE, 'r') as f:
+            spec = json.load(f)
+
+        instance = cls()
+        mmap_mode = 'r' if mmap else None
+        for name, kind in spec['kinds'].items():
+            instance._kinds[name] = kind
+            instance._columns[name] = np.load(
+                directory / f"{name}.npy", mmap_mode=mmap_mode, allow_pickle=False
+            )
+            if kind == 'category':
+                instance._categories[name] = np.load(
+                    directory / f"{name}.categories.npy", allow_pickle=False
+                )
+        instance._length = spec['length']
+
+        return instance
+
+    @classmethod
+    def from_records(cls, records: List[Dict]) -> 'TileMetadata':
+        """Build from a list of dicts"""
+        instance = cls()
+        instance.extend(records)
+        return instance
+
+    # ------------------------------------------------------------------
+    # Internals
+    # ------------------------------------------------------------------
+
+    def _value(self, name: str, idx: int):
+        """Python value of one cell"""
+        value = self._columns[name][idx]
+        if self._kinds[name] == 'category':
+            return str(self._categories[name][value])
+        return value.item()
+
+    def _flush(self):
+        """
+        Convert pending dict records into column arrays
+
+        All new columns are built before any is stored, so a batch that
+        fails validation raises with the store and its pending records
+        unchanged rather than leaving columns of different lengths.
+        """
+        if not self._pending:
+            return
+
+        records = self._pending
+        names = list(records[0])
+        if self._columns and set(names) != set(self._columns):
+            raise ValueError(f"Metadata fields {sorted(names)} do not match existing {sorted(self._columns)}")
+        if any(set(r) != set(names) for r in records):
+            raise ValueError("All metadata records must share the same fields")
+
+        columns = {}
+        kinds = {}
+        categories = {}
+        lookups = {}
+        for name in names:
+            values = [r[name] for r in records]
+            kind = self._kinds.get(name) or _column_kind(values)
+
+            if kind == 'category':
+                new, categories[name], lookups[name] = self._encode(name, values)
+            else:
+                new_kind = _column_kind(values)
+                if name in self._kinds and new_kind != kind:
+                    # Promote int -> float if later records carry floats
+                    if {kind, new_kind} == {'int', 'float'}:
+                        kind = 'float'
+                    else:
+                        raise TypeError(f"Metadata field '{name}' changed type from {kind} to {new_kind}")
+                new = _to_array(values, kind)
+
+            if name in self._columns:
+                new = np.concatenate([self._columns[name], new])
+            columns[name] = new
+            kinds[name] = kind
+
+        self._columns.update(columns)
+        self._kinds.update(kinds)
+        self._categories.update(categories)
+        self._category_lookup.update(lookups)
+        self._length += len(records)
+        self._pending = []
+
+    def _encode(self, name: str, values: List[str]) -> Tuple[np.ndarray, np.ndarray, Dict[str, int]]:
+        """
+        Dictionary-encode strings, extending the category list as needed
+
+        Returns:
+            (codes, categories, lookup); the stored categories are only
+            replaced by the caller, once the whole batch is valid
+        """
+        lookup = self._category_lookup.get(name)
+        if lookup is None:
+            existing = self._categories.get(name, np.array([], dtype=str))
+            lookup = {str(v): i for i, v in enumerate(existing)}
+
+        n_before = len(lookup)
+        lookup = dict(lookup)
+        codes = np.empty(len(values), dtype=np.int32)
+        for i, value in enumerate(values):
+            code = lookup.get(value)
+            if code is None:
+                code = lookup[value] = len(lookup)
+            codes[i] = code
+
+        categories = self._categories.get(name)
+        if len(lookup) != n_before or categories is None:
+            categories = np.array(list(lookup), dtype=str)
+
+        return codes, categories, lookup
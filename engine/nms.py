@@ -1,157 +1,222 @@
 """
 Non-Maximum Suppression (NMS) for post-processing detections
-Supports both hard and soft NMS
+Supports both hard and soft NMS, on lists of Detection objects or on
+a DetectionBatch (suppression runs on the box and score arrays either way)
 """
 
 import numpy as np
-from typing import List
-from .candidate import Detection, compute_iou
+from dataclasses import replace
+from typing import List, Tuple, Union
+from .candidate import Detection, DetectionBatch
 
 
-def hard_nms(
-    detections: List[Detection],
+def box_iou(box: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    """
+    IoU of one box against many
+    
+    Args:
+        box: (4,) [x_min, y_min, x_max, y_max]
+        boxes: (N, 4) boxes
+        
+    Returns:
+        (N,) IoU scores (0 where boxes do not overlap)
+    """
+    box = box.astype(np.float64)
+    boxes = boxes.astype(np.float64)
+    
+    width = np.minimum(box[2], boxes[:, 2]) - np.maximum(box[0], boxes[:, 0])
+    height = np.minimum(box[3], boxes[:, 3]) - np.maximum(box[1], boxes[:, 1])
+    intersection = np.where((width > 0) & (height > 0), width * height, 0.0)
+    
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    union = area + areas - intersection
+    
+    return np.divide(intersection, union, out=np.zeros_like(union), where=union != 0)
+
+
+def _as_arrays(detections: List[Detection]) -> Tuple[np.ndarray, np.ndarray]:
+    """Boxes (N, 4) and scores (N,) of Detection objects"""
+    boxes = np.array([(d.x_min, d.y_min, d.x_max, d.y_max) for d in detections]).reshape(-1, 4)
+    scores = np.array([d.score for d in detections], dtype=np.float64)
+    return boxes, scores
+
+
+def hard_nms_rows(
+    boxes: np.ndarray,
+    scores: np.ndarray,
     iou_threshold: float = 0.5,
     score_threshold: float = 0.3
-) -> List[Detection]:
+) -> np.ndarray:
     """
-    Hard NMS: suppress detections with IoU > threshold
+    Hard NMS on arrays
     
     Args:
-        detections: List of Detection objects
+        boxes: (N, 4) boxes
+        scores: (N,) scores
         iou_threshold: IoU threshold for suppression
         score_threshold: Minimum score to keep
         
     Returns:
-        Filtered list of detections
+        Indices of kept detections, best first
     """
-    if not detections:
-        return []
+    rows = np.flatnonzero(scores >= score_threshold)
+    rows = rows[np.argsort(-scores[rows], kind='stable')]
+    boxes = boxes[rows]
     
-    # Filter by score
-    detections = [d for d in detections if d.score >= score_threshold]
+    suppressed = np.zeros(len(rows), dtype=bool)
+    keep = []
     
-    if not detections:
-        return []
+    for i in range(len(rows)):
+        if suppressed[i]:
+            continue
+        
+        keep.append(i)
+        # Suppress overlapping boxes
+        suppressed[i + 1:] |= box_iou(boxes[i], boxes[i + 1:]) > iou_threshold
     
-    # Sort by score descending
-    sorted_dets = sorted(detections, key=lambda d: d.score, reverse=True)
+    return rows[keep]
+
+
+def soft_nms_rows(
+    boxes: np.ndarray,
+    scores: np.ndarray,
+    iou_threshold: float = 0.5,
+    score_threshold: float = 0.3,
+    sigma: float = 0.5,
+    method: str = 'gaussian'
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Soft NMS on arrays
+    
+    Args:
+        boxes: (N, 4) boxes
+        scores: (N,) scores
+        iou_threshold: IoU threshold (linear decay)
+        score_threshold: Minimum score to keep
+        sigma: Gaussian sigma for soft decay
+        method: 'gaussian' or 'linear'
+        
+    Returns:
+        Tuple of (indices of kept detections, their decayed scores)
+    """
+    rows = np.argsort(-scores, kind='stable')
+    boxes = boxes[rows]
+    scores = scores[rows].astype(np.float64)
     
     keep = []
-    suppress = set()
     
-    for i, det in enumerate(sorted_dets):
-        if i in suppress:
+    for i in range(len(rows)):
+        if scores[i] < score_threshold:
             continue
         
-        keep.append(det)
-        box1 = (det.x_min, det.y_min, det.x_max, det.y_max)
+        keep.append(i)
         
-        # Suppress overlapping boxes
-        for j in range(i + 1, len(sorted_dets)):
-            if j in suppress:
-                continue
-            
-            other = sorted_dets[j]
-            box2 = (other.x_min, other.y_min, other.x_max, other.y_max)
-            
-            if compute_iou(box1, box2) > iou_threshold:
-                suppress.add(j)
-    
-    return keep
+        # Decay scores of remaining detections
+        iou = box_iou(boxes[i], boxes[i + 1:])
+        if method == 'gaussian':
+            scores[i + 1:] *= np.exp(-(iou ** 2) / sigma)
+        elif method == 'linear':
+            scores[i + 1:] *= np.where(iou > iou_threshold, 1 - iou, 1.0)
+    
+    return rows[keep], scores[keep]
+
+
+def hard_nms(
+    detections: Union[List[Detection], DetectionBatch],
+    iou_threshold: float = 0.5,
+    score_threshold: float = 0.3
+) -> Union[List[Detection], DetectionBatch]:
+    """
+    Hard NMS: suppress detections with IoU > threshold
+    
+    Args:
+        detections: List of Detection objects or a DetectionBatch
+        iou_threshold: IoU threshold for suppression
+        score_threshold: Minimum score to keep
+        
+    Returns:
+        Kept detections (same type as given), best first
+    """
+    if isinstance(detections, DetectionBatch):
+        return detections.take(hard_nms_rows(detections.boxes, detections.scores, iou_threshold, score_threshold))
+    
+    if not detections:
+        return []
+    
+    boxes, scores = _as_arrays(detections)
+    return [detections[i] for i in hard_nms_rows(boxes, scores, iou_threshold, score_threshold)]
 
 
 def soft_nms(
-    detections: List[Detection],
+    detections: Union[List[Detection], DetectionBatch],
     iou_threshold: float = 0.5,
     score_threshold: float = 0.3,
     sigma: float = 0.5,
     method: str = 'gaussian'
-) -> List[Detection]:
+) -> Union[List[Detection], DetectionBatch]:
     """
     Soft NMS: decay scores of overlapping detections
     
     Args:
-        detections: List of Detection objects
+        detections: List of Detection objects or a DetectionBatch
         iou_threshold: IoU threshold
         score_threshold: Minimum score to keep
         sigma: Gaussian sigma for soft decay
         method: 'gaussian' or 'linear'
         
     Returns:
-        List of detections with updated scores
+        Kept detections (same type as given) with updated scores; input
+        Detection objects are not modified
     """
+    if isinstance(detections, DetectionBatch):
+        rows, scores = soft_nms_rows(
+            detections.boxes, detections.scores, iou_threshold, score_threshold, sigma, method
+        )
+        kept = detections.take(rows)
+        kept.scores = scores
+        return kept
+    
     if not detections:
         return []
     
-    # Create mutable copy
-    detections = [Detection(
-        x_min=d.x_min,
-        y_min=d.y_min,
-        x_max=d.x_max,
-        y_max=d.y_max,
-        score=d.score,
-        class_name=d.class_name,
-        target_filename=d.target_filename,
-        metadata=d.metadata
-    ) for d in detections]
-    
-    # Sort by score descending
-    detections = sorted(detections, key=lambda d: d.score, reverse=True)
-    
-    keep = []
+    boxes, scores = _as_arrays(detections)
+    rows, scores = soft_nms_rows(boxes, scores, iou_threshold, score_threshold, sigma, method)
     
-    for i in range(len(detections)):
-        det = detections[i]
-        
-        if det.score < score_threshold:
-            continue
-        
-        keep.append(det)
-        box1 = (det.x_min, det.y_min, det.x_max, det.y_max)
-        
-        # Decay scores of remaining detections
-        for j in range(i + 1, len(detections)):
-            other = detections[j]
-            box2 = (other.x_min, other.y_min, other.x_max, other.y_max)
-            
-            iou = compute_iou(box1, box2)
-            
-            if iou > 0:
-                if method == 'gaussian':
-                    # Gaussian decay
-                    weight = np.exp(-(iou ** 2) / sigma)
-                elif method == 'linear':
-                    # Linear decay
-                    if iou > iou_threshold:
-                        weight = 1 - iou
-                    else:
-                        weight = 1
-                else:
-                    weight = 1
-                
-                other.score *= weight
-    
-    # Final filter
-    keep = [d for d in keep if d.score >= score_threshold]
-    
-    return keep
+    # Copies only for the kept detections
+    return [replace(detections[i], score=score) for i, score in zip(rows.tolist(), scores.tolist())]
 
 
 def merge_detections(
-    detections: List[Detection],
+    detections: Union[List[Detection], DetectionBatch],
     iou_threshold: float = 0.5
-) -> List[Detection]:
+) -> Union[List[Detection], DetectionBatch]:
     """
     Merge overlapping detections by averaging coordinates
     
     Args:
-        detections: List of Detection objects
+        detections: List of Detection objects, or a DetectionBatch (merged
+                    within each image and class)
         iou_threshold: IoU threshold for merging
         
     Returns:
-        List of merged detections
+        Merged detections (same type as given)
     """
-    from .candidate import cluster_detections, merge_cluster
+    from .candidate import cluster_boxes, cluster_detections, merge_boxes, merge_cluster
+    
+    if isinstance(detections, DetectionBatch):
+        clusters = [
+            rows[cluster]
+            for rows in detections.groups(by_class=True)
+            for cluster in cluster_boxes(detections.boxes[rows], detections.scores[rows], iou_threshold)
+        ]
+        boxes, scores = merge_boxes(detections.boxes, detections.scores, clusters)
+        
+        # Seed detection of each cluster carries its ids and metadata
+        merged = detections.take(np.array([cluster[0] for cluster in clusters], dtype=np.int64))
+        merged.boxes = boxes.astype(np.int32)
+        merged.scores = scores
+        return merged
     
     if not detections:
         return []
@@ -166,25 +231,53 @@ def merge_detections(
 
 
 def apply_nms_per_image(
-    grouped_detections: dict,
+    grouped_detections: Union[dict, DetectionBatch],
     method: str = 'soft',
     iou_threshold: float = 0.5,
     score_threshold: float = 0.3,
     sigma: float = 0.5
-) -> dict:
+) -> Union[dict, DetectionBatch]:
     """
     Apply NMS to detections grouped by image
     
     Args:
-        grouped_detections: Dict mapping image_id -> List[Detection]
+        grouped_detections: Dict mapping image_id -> List[Detection], or a
+                            DetectionBatch (suppression within each image
+                            and class)
         method: 'soft' or 'hard'
         iou_threshold: IoU threshold
         score_threshold: Score threshold
         sigma: Sigma for soft NMS
         
     Returns:
-        Dict with NMS applied per image
+        Dict with NMS applied per image, or a DetectionBatch grouped by image
     """
+    if method not in ('soft', 'hard'):
+        raise ValueError(f"Unknown NMS method: {method}")
+    
+    if isinstance(grouped_detections, DetectionBatch):
+        batch = grouped_detections
+        kept_rows = []
+        kept_scores = []
+        
+        for rows in batch.groups(by_class=True):
+            if method == 'soft':
+                keep, scores = soft_nms_rows(
+                    batch.boxes[rows], batch.scores[rows], iou_threshold, score_threshold, sigma
+                )
+            else:
+                keep = hard_nms_rows(batch.boxes[rows], batch.scores[rows], iou_threshold, score_threshold)
+                scores = batch.scores[rows][keep]
+            kept_rows.append(rows[keep])
+            kept_scores.append(scores)
+        
+        if not kept_rows:
+            return batch
+        
+        kept = batch.take(np.concatenate(kept_rows))
+        kept.scores = np.concatenate(kept_scores)
+        return kept
+    
     result = {}
     
     for image_id, detections in grouped_detections.items():
@@ -195,14 +288,12 @@ def apply_nms_per_image(
                 score_threshold=score_threshold,
                 sigma=sigma
             )
-        elif method == 'hard':
+        else:
             filtered = hard_nms(
                 detections,
                 iou_threshold=iou_threshold,
                 score_threshold=score_threshold
             )
-        else:
-            raise ValueError(f"Unknown NMS method: {method}")
         
         result[image_id] = filtered
     
@@ -210,38 +301,49 @@ def apply_nms_per_image(
 
 
 def filter_by_confidence(
-    detections: List[Detection],
+    detections: Union[List[Detection], DetectionBatch],
     threshold: float
-) -> List[Detection]:
+) -> Union[List[Detection], DetectionBatch]:
     """
     Filter detections by confidence threshold
     
     Args:
-        detections: List of Detection objects
+        detections: List of Detection objects or a DetectionBatch
         threshold: Minimum confidence score
         
     Returns:
-        Filtered list
+        Filtered detections (same type as given)
     """
+    if isinstance(detections, DetectionBatch):
+        return detections.take(detections.scores >= threshold)
+    
     return [d for d in detections if d.score >= threshold]
 
 
 def filter_by_area(
-    detections: List[Detection],
+    detections: Union[List[Detection], DetectionBatch],
     min_area: int = 100,
     max_area: int = None
-) -> List[Detection]:
+) -> Union[List[Detection], DetectionBatch]:
     """
     Filter detections by bounding box area
     
     Args:
-        detections: List of Detection objects
+        detections: List of Detection objects or a DetectionBatch
         min_area: Minimum area in pixels
         max_area: Maximum area in pixels (None = no limit)
         
     Returns:
-        Filtered list
+        Filtered detections (same type as given)
     """
+    if isinstance(detections, DetectionBatch):
+        boxes = detections.boxes.astype(np.int64)
+        areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+        keep = areas >= min_area
+        if max_area is not None:
+            keep &= areas <= max_area
+        return detections.take(keep)
+    
     filtered = []
     
     for det in detections:
@@ -0,0 +1,285 @@
+"""
+Scene-level descriptor index for coarse-to-fine retrieval
+Summarises each scene by a few prototype embeddings (k-means of its
+tile embeddings), so a query can rank scenes first and search tiles
+only in the most promising ones
+"""
+
+import numpy as np
+import faiss
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+import logging
+
+from .index_faiss import recall_at_k
+
+logger = logging.getLogger(__name__)
+
+
+class SceneIndex:
+    """
+    Prototype embeddings per scene, scored exactly with NumPy
+
+    A scene's score for a query is its best prototype's similarity, so
+    scenes containing a small matching region still rank highly even
+    when their mean embedding is dominated by background.
+    """
+
+    def __init__(self, prototypes_per_scene: int = 4, metric: str = 'cosine', seed: int = 0):
+        """
+        Args:
+            prototypes_per_scene: k-means centroids kept per scene
+                                  (1 = mean-pooled tile embedding)
+            metric: 'cosine' or 'l2', as the tile index
+            seed: k-means seed
+        """
+        self.prototypes_per_scene = prototypes_per_scene
+        self.metric = metric
+        self.seed = seed
+        self.prototypes = np.empty((0, 0), dtype=np.float32)  # (P, D), grouped by scene
+        self.scene_ids = np.empty(0, dtype=str)  # Scene of each prototype, sorted
+
+    # ------------------------------------------------------------------
+    # Building
+    # ------------------------------------------------------------------
+
+    def _summarise(self, embeddings: np.ndarray) -> np.ndarray:
+        """Prototype vectors of one scene's tile embeddings"""
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        k = min(self.prototypes_per_scene, len(embeddings))
+
+        if k <= 1:
+            centroids = embeddings.mean(axis=0, keepdims=True)
+        else:
+            kmeans = faiss.Kmeans(
+                embeddings.shape[1], k,
+                niter=20,
+                seed=self.seed,
+                spherical=self.metric == 'cosine',
+                min_points_per_centroid=1
+            )
+            kmeans.train(embeddings)
+            centroids = kmeans.centroids
+
+        if self.metric == 'cosine':
+            centroids = centroids / np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+        return centroids.astype(np.float32)
+
+    def add_scene(self, image_id: str, embeddings: np.ndarray):
+        """
+        Add (or replace) one scene's prototypes
+
+        Args:
+            image_id: Scene id
+            embeddings: The scene's tile embeddings (N, D)
+        """
+        if len(embeddings) == 0:
+            return
+
+        self._insert({image_id: self._summarise(embeddings)})
+
+    def add_scenes(self, embeddings: np.ndarray, metadata: List[Dict]):
+        """
+        Add (or replace) every scene present in tile embeddings and metadata
+
+        Args:
+            embeddings: Tile embeddings (N, D)
+            metadata: Tile metadata dicts with 'image_id'
+        """
+        image_ids = np.array([m['image_id'] for m in metadata])
+        if not len(image_ids):
+            return
+
+        scenes, first, inverse = np.unique(image_ids, return_index=True, return_inverse=True)
+        order = np.argsort(inverse, kind='stable')
+        bounds = np.r_[0, np.cumsum(np.bincount(inverse))]
+
+        # Summarise every scene first, then merge and sort once
+        prototypes = {}
+        for i in np.argsort(first):
+            prototypes[str(scenes[i])] = self._summarise(embeddings[order[bounds[i]:bounds[i + 1]]])
+        self._insert(prototypes)
+
+    def _insert(self, prototypes: Dict[str, np.ndarray]):
+        """Replace the prototypes of the given scenes, keeping scenes grouped"""
+        keep = ~np.isin(self.scene_ids, list(prototypes))
+        new_ids = np.concatenate([np.full(len(p), image_id) for image_id, p in prototypes.items()])
+        new_prototypes = np.concatenate(list(prototypes.values()))
+
+        if len(self.scene_ids):
+            new_prototypes = np.concatenate([self.prototypes[keep], new_prototypes])
+            new_ids = np.concatenate([self.scene_ids[keep], new_ids])
+
+        # Keep prototypes grouped by scene so scores reduce with reduceat
+        order = np.argsort(new_ids, kind='stable')
+        self.prototypes = new_prototypes[order]
+        self.scene_ids = new_ids[order]
+
+    def remove_scene(self, image_id: str):
+        """Drop a scene's prototypes"""
+        keep = self.scene_ids != image_id
+        self.prototypes = self.prototypes[keep]
+        self.scene_ids = self.scene_ids[keep]
+
+    @property
+    def scenes(self) -> List[str]:
+        """Indexed scene ids, sorted"""
+        return np.unique(self.scene_ids).tolist()
+
+    def __len__(self) -> int:
+        return len(self.scenes)
+
+    # ------------------------------------------------------------------
+    # Search
+    # ------------------------------------------------------------------
+
+    def scene_scores(self, query_vectors: np.ndarray) -> np.ndarray:
+        """
+        Score every scene for every query
+
+        Args:
+            query_vectors: Query embeddings (Q, D)
+
+        Returns:
+            Scores of shape (Q, len(scenes)), columns in `scenes` order;
+            higher is better
+        """
+        queries = np.asarray(query_vectors, dtype=np.float32)
+        if not len(self.scene_ids):
+            return np.empty((len(queries), 0), dtype=np.float32)
+
+        if self.metric == 'cosine':
+            queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+            scores = queries @ self.prototypes.T
+        else:
+            scores = -(
+                (queries ** 2).sum(axis=1, keepdims=True)
+                - 2 * queries @ self.prototypes.T
+                + (self.prototypes ** 2).sum(axis=1)
+            )
+
+        # Best prototype per scene (prototypes are contiguous per scene)
+        starts = np.flatnonzero(np.r_[True, self.scene_ids[1:] != self.scene_ids[:-1]])
+        return np.maximum.reduceat(scores, starts, axis=1)
+
+    def select_scenes(
+        self,
+        query_vectors: np.ndarray,
+        scene_budget: int,
+        image_ids: Optional[List[str]] = None
+    ) -> List[str]:
+        """
+        Scenes worth searching at tile level for a batch of queries
+
+        Scenes are ranked by their best score over all queries, as the
+        tile search for the batch is restricted to one set of scenes.
+
+        Args:
+            query_vectors: Query embeddings (Q, D)
+            scene_budget: Number of scenes to keep
+            image_ids: Only consider these scenes (None = all)
+
+        Returns:
+            Scene ids, best first
+        """
+        scenes = np.array(self.scenes)
+        scores = self.scene_scores(query_vectors).max(axis=0)
+        if image_ids is not None:
+            scores[~np.isin(scenes, list(image_ids))] = -np.inf
+
+        order = np.argsort(-scores, kind='stable')[:scene_budget]
+        return scenes[order][np.isfinite(scores[order])].tolist()
+
+    def evaluate(
+        self,
+        tile_index,
+        query_vectors: np.ndarray,
+        k: int,
+        scene_budgets: List[int],
+        batch_size: Optional[int] = None,
+        **search_kwargs
+    ) -> List[Dict]:
+        """
+        Recall of coarse-to-fine search against searching all scenes
+
+        Queries are split into consecutive batches, and each batch
+        searches one scene set chosen by select_scenes, as a search
+        request with that many chips does when served. By default all
+        queries form one batch; batch_size=1 gives per-chip selection,
+        an upper bound on what batched serving reaches.
+
+        Args:
+            tile_index: FAISSIndex or ShardedFAISSIndex the scenes describe
+            query_vectors: Query embeddings (Q, D)
+            k: Neighbours for recall@K
+            scene_budgets: Scene budgets to evaluate
+            batch_size: Queries sharing one scene selection (None = all)
+            **search_kwargs: Per-call search overrides (nprobe, ef_search)
+
+        Returns:
+            One dict per budget with scene_budget, recall and ms_per_query;
+            the first entry (scene_budget None) is the full search
+        """
+        start = time.perf_counter()
+        _, reference = tile_index.search(query_vectors, k, **search_kwargs)
+        report = [{
+            'scene_budget': None,
+            'recall': 1.0,
+            'ms_per_query': 1000 * (time.perf_counter() - start) / len(query_vectors),
+        }]
+
+        batch_size = batch_size or len(query_vectors)
+        for budget in scene_budgets:
+            start = time.perf_counter()
+            indices = []
+            for offset in range(0, len(query_vectors), batch_size):
+                batch = query_vectors[offset:offset + batch_size]
+                scenes = self.select_scenes(batch, budget)
+                indices.append(tile_index.search(batch, k, image_ids=scenes, **search_kwargs)[1])
+            report.append({
+                'scene_budget': budget,
+                'recall': recall_at_k(reference, np.vstack(indices), k),
+                'ms_per_query': 1000 * (time.perf_counter() - start) / len(query_vectors),
+            })
+
+        return report
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+
+    def save(self, directory: str, name: str = 'scene_index'):
+        """Save prototypes to {name}.npz (no pickled objects)"""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+
+        np.savez(
+            directory / f"{name}.npz",
+            prototypes=self.prototypes,
+            scene_ids=self.scene_ids.astype(str),
+            prototypes_per_scene=self.prototypes_per_scene,
+            metric=self.metric,
+            seed=self.seed
+        )
+        logger.info(f"Saved scene index ({len(self)} scenes) to {directory}")
+
+    @classmethod
+    def load(cls, directory: str, name: str = 'scene_index') -> 'SceneIndex':
+        """Load a scene index written by save()"""
+        with np.load(Path(directory) / f"{name}.npz", allow_pickle=False) as data:
+            instance = cls(
+                prototypes_per_scene=int(data['prototypes_per_scene']),
+                metric=str(data['metric']),
+                seed=int(data['seed'])
+            )
+            instance.prototypes = data['prototypes']
+            instance.scene_ids = data['scene_ids']
+
+        logger.info(f"Loaded scene index with {len(instance)} scenes")
+        return instance
+
+    @staticmethod
+    def exists(directory: str, name: str = 'scene_index') -> bool:
+        """Whether directory holds a scene index"""
+        return (Path(directory) / f"{name}.npz").exists()
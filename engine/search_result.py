@@ -0,0 +1,242 @@
+"""
+Columnar search results
+Holds FAISS neighbours and their tile metadata as (n_queries, k) arrays
+gathered with NumPy, instead of one dict per hit
+"""
+
+import numpy as np
+from typing import Dict, Iterator, List, Optional
+
+from .metadata import TileMetadata
+
+
+class SearchResult:
+    """
+    Search results for a batch of queries as (n_queries, k) arrays
+
+    Attributes:
+        scores: Similarity scores (higher is better); -inf where invalid
+        distances: Raw FAISS distances
+        indices: Tile ids (-1 where FAISS returned no neighbour)
+        columns: Tile metadata field -> gathered values, same shape
+
+    Indexing a SearchResult (result[i]) returns the legacy list of
+    {'score', 'distance', 'metadata'} dicts for query i.
+    """
+
+    def __init__(
+        self,
+        scores: np.ndarray,
+        distances: np.ndarray,
+        indices: np.ndarray,
+        columns: Optional[Dict[str, np.ndarray]] = None
+    ):
+        self.scores = scores
+        self.distances = distances
+        self.indices = indices
+        self.columns = columns or {}
+
+    @classmethod
+    def from_search(
+        cls,
+        distances: np.ndarray,
+        indices: np.ndarray,
+        tile_metadata: TileMetadata,
+        metric: str = 'cosine'
+    ) -> 'SearchResult':
+        """
+        Build from raw FAISS output by gathering metadata columns
+
+        Args:
+            distances: FAISS distances of shape (N, k)
+            indices: FAISS ids of shape (N, k)
+            tile_metadata: Metadata table the ids refer to
+            metric: 'cosine' (inner product is the score) or 'l2'
+                    (score = 1 / (1 + distance))
+
+        Returns:
+            SearchResult instance
+        """
+        valid = (indices >= 0) & (indices < len(tile_metadata))
+
+        if metric == 'cosine':
+            scores = distances.astype(np.float32, copy=True)
+        else:
+            scores = (1.0 / (1.0 + distances)).astype(np.float32)
+        scores[~valid] = -np.inf
+
+        columns = {}
+        if len(tile_metadata):
+            rows = np.where(valid, indices, 0)
+            for name in tile_metadata.fields:
+                columns[name] = tile_metadata.gather(name, rows)
+
+        return cls(scores, distances, indices, columns)
+
+    @classmethod
+    def concatenate(cls, results: List['SearchResult'], k: int) -> 'SearchResult':
+        """
+        Merge per-shard results for the same queries, keeping the top-k by score
+
+        Args:
+            results: Results with the same number of queries
+            k: Neighbours to keep per query
+
+        Returns:
+            Merged SearchResult
+        """
+        scores = np.concatenate([r.scores for r in results], axis=1)
+        order = np.argsort(-scores, axis=1, kind='stable')[:, :k]
+
+        def merge(arrays):
+            return np.take_along_axis(np.concatenate(arrays, axis=1), order, axis=1)
+
+        # Fields present in every result (indexes may differ in metadata schema)
+        names = [name for name in results[0].columns if all(name in r.columns for r in results)] if results else []
+        return cls(
+            np.take_along_axis(scores, order, axis=1),
+            merge([r.distances for r in results]),
+            merge([r.indices for r in results]),
+            {name: merge([r.columns[name] for r in results]) for name in names}
+        )
+
+    def expand(self, rows: np.ndarray, n_queries: int, empty_distance: float = -np.inf) -> 'SearchResult':
+        """
+        Place results for a subset of queries into a result for all queries
+
+        Args:
+            rows: Query index of each row of this result
+            n_queries: Total number of queries
+            empty_distance: Distance reported for the other queries
+
+        Returns:
+            SearchResult with n_queries rows; rows not listed have no hits
+        """
+        def place(values, fill):
+            out = np.full((n_queries,) + values.shape[1:], fill, dtype=values.dtype)
+            out[rows] = values
+            return out
+
+        return SearchResult(
+            place(self.scores, -np.inf),
+            place(self.distances, empty_distance),
+            place(self.indices, -1),
+            {name: place(values, values.dtype.type()) for name, values in self.columns.items()}
+        )
+
+    def fuse(self, method: str, k: int, rrf_k: int = 60) -> 'SearchResult':
+        """
+        Fuse the hit lists of several queries (e.g. chips of one class) into one
+
+        Each tile appears once, with a score aggregated over the queries:
+        'max' keeps the best similarity, 'mean' averages similarities over
+        all queries (a query that did not retrieve the tile contributes its
+        lowest retrieved score, an upper bound of the true similarity) and
+        'rrf' is reciprocal rank fusion, sum of 1 / (rrf_k + rank), scaled
+        so a tile ranked first by every query scores 1.
+
+        Args:
+            method: 'max', 'mean' or 'rrf'
+            k: Fused tiles to keep
+            rrf_k: Rank offset for 'rrf'
+
+        Returns:
+            SearchResult with one row, best first. Metadata comes from each
+            tile's best hit; extra columns hold its 'similarity' (best score),
+            'chip_index' (query giving it) and 'chip_support' (queries
+            retrieving it)
+        """
+        if method not in ('max', 'mean', 'rrf'):
+            raise ValueError(f"Unknown fusion method: {method}")
+
+        rows, ranks = np.nonzero(self.valid)
+        scores = self.scores[rows, ranks]
+        tiles, inverse, support = np.unique(self.indices[rows, ranks], return_inverse=True, return_counts=True)
+
+        # Best hit of each tile: first of its group when sorted by tile, then score
+        order = np.lexsort((-scores, inverse))
+        best = order[np.r_[0, np.cumsum(support)[:-1]]] if len(tiles) else order
+
+        if method == 'max':
+            fused = scores[best]
+        elif method == 'mean':
+            valid_scores = np.where(self.valid, self.scores, np.inf)
+            floor = valid_scores.min(axis=1)
+            floor[~np.isfinite(floor)] = scores.min() if len(scores) else 0.0
+            fused = (np.bincount(inverse, weights=scores - floor[rows], minlength=len(tiles)) + floor.sum()) / len(self)
+        else:
+            weights = 1.0 / (rrf_k + ranks + 1)
+            fused = np.bincount(inverse, weights=weights, minlength=len(tiles)) * (rrf_k + 1) / len(self)
+
+        top = np.argsort(-fused, kind='stable')[:k]
+        hits = best[top]
+
+        def gather(values):
+            return values[rows[hits], ranks[hits]][None]
+
+        columns = {name: gather(values) for name, values in self.columns.items()}
+        columns['similarity'] = scores[hits][None]
+        columns['chip_index'] = rows[hits][None]
+        columns['chip_support'] = support[top][None]
+
+        return SearchResult(
+            fused[top].astype(np.float32)[None],
+            gather(self.distances),
+            tiles[top][None],
+            columns
+        )
+
+    @property
+    def valid(self) -> np.ndarray:
+        """Mask of real neighbours"""
+        return np.isfinite(self.scores)
+
+    @property
+    def image_ids(self) -> np.ndarray:
+        """Image id of each hit"""
+        return self.columns['image_id']
+
+    @property
+    def boxes(self) -> np.ndarray:
+        """Tile boxes as (N, k, 4) [x_min, y_min, x_max, y_max]; 0 for missing fields"""
+        zeros = np.zeros(self.indices.shape, dtype=np.int64)
+        x = self.columns.get('x', zeros)
+        y = self.columns.get('y', zeros)
+        width = self.columns.get('width', zeros)
+        height = self.columns.get('height', zeros)
+        return np.stack([x, y, x + width, y + height], axis=-1)
+
+    def top(self, k: int) -> 'SearchResult':
+        """First k neighbours of each query"""
+        return SearchResult(
+            self.scores[:, :k],
+            self.distances[:, :k],
+            self.indices[:, :k],
+            {name: values[:, :k] for name, values in self.columns.items()}
+        )
+
+    # ------------------------------------------------------------------
+    # Legacy list-of-dicts interface
+    # ------------------------------------------------------------------
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+    def __getitem__(self, i: int) -> List[Dict]:
+        keep = self.valid[i]
+        scores = self.scores[i][keep].tolist()
+        distances = self.distances[i][keep].tolist()
+        values = {name: column[i][keep].tolist() for name, column in self.columns.items()}
+
+        return [
+            {
+                'score': scores[j],
+                'distance': distances[j],
+                'metadata': {name: column[j] for name, column in values.items()}
+            }
+            for j in range(len(scores))
+        ]
+
+    def __iter__(self) -> Iterator[List[Dict]]:
+        for i in range(len(self)):
+            yield self[i]
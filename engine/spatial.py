@@ -0,0 +1,130 @@
+"""
+Uniform grid spatial index over detection boxes
+Finds pairs of overlapping boxes without comparing every pair, for
+clustering and merging dense detections
+"""
+
+import numpy as np
+from typing import Optional, Tuple
+
+
+def pair_iou(boxes: np.ndarray, first: np.ndarray, second: np.ndarray) -> np.ndarray:
+    """
+    IoU of box pairs
+
+    Args:
+        boxes: (N, 4) [x_min, y_min, x_max, y_max]
+        first: (P,) index of the first box of each pair
+        second: (P,) index of the second box of each pair
+
+    Returns:
+        (P,) IoU scores (0 where boxes do not overlap)
+    """
+    a = boxes[first].astype(np.float64)
+    b = boxes[second].astype(np.float64)
+
+    width = np.minimum(a[:, 2], b[:, 2]) - np.maximum(a[:, 0], b[:, 0])
+    height = np.minimum(a[:, 3], b[:, 3]) - np.maximum(a[:, 1], b[:, 1])
+    intersection = np.where((width > 0) & (height > 0), width * height, 0.0)
+
+    union = (
+        (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+        + (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+        - intersection
+    )
+    return np.divide(intersection, union, out=np.zeros_like(union), where=union != 0)
+
+
+class BoxGrid:
+    """
+    Boxes bucketed into square grid cells
+
+    Each box is registered in every cell it covers, so two boxes with a
+    positive-area overlap always share a cell. Only boxes sharing a cell
+    are compared, which is near-linear for detections spread over a scene.
+    """
+
+    def __init__(self, boxes: np.ndarray, cell_size: Optional[float] = None):
+        """
+        Args:
+            boxes: (N, 4) [x_min, y_min, x_max, y_max]
+            cell_size: Grid cell side in pixels (default: twice the
+                       median box side, so most boxes cover 1-4 cells)
+        """
+        self.boxes = np.asarray(boxes).reshape(-1, 4)
+
+        if cell_size is None:
+            sides = np.maximum(self.boxes[:, 2] - self.boxes[:, 0], self.boxes[:, 3] - self.boxes[:, 1])
+            cell_size = 2 * float(np.median(sides)) if len(sides) else 1.0
+        self.cell_size = max(cell_size, 1.0)
+
+        self.cells, self.members = self._bucket()
+
+    def _bucket(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(cell, box) entries sorted by cell"""
+        boxes = self.boxes.astype(np.float64)
+        # Cells covering [x_min, x_max) x [y_min, y_max); degenerate boxes get one cell
+        x0 = np.floor(boxes[:, 0] / self.cell_size).astype(np.int64)
+        y0 = np.floor(boxes[:, 1] / self.cell_size).astype(np.int64)
+        x1 = np.maximum(np.ceil(boxes[:, 2] / self.cell_size).astype(np.int64) - 1, x0)
+        y1 = np.maximum(np.ceil(boxes[:, 3] / self.cell_size).astype(np.int64) - 1, y0)
+
+        nx = x1 - x0 + 1
+        counts = nx * (y1 - y0 + 1)
+        members = np.repeat(np.arange(len(boxes)), counts)
+        offset = np.arange(len(members)) - np.repeat(np.cumsum(counts) - counts, counts)
+        cx = x0[members] + offset % nx[members]
+        cy = y0[members] + offset // nx[members]
+
+        if len(members):
+            cx -= cx.min()
+            cy -= cy.min()
+        cells = cx * (cy.max() + 1 if len(cy) else 1) + cy
+
+        order = np.argsort(cells, kind='stable')
+        return cells[order], members[order]
+
+    def candidate_pairs(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Pairs of boxes sharing at least one cell
+
+        Returns:
+            (first, second) index arrays with first < second, each pair once
+        """
+        firsts = []
+        seconds = []
+
+        # Entries are sorted by cell: pair each with the next d entries of the same cell
+        offset = 1
+        while offset < len(self.cells):
+            same = self.cells[:-offset] == self.cells[offset:]
+            if not same.any():
+                break
+            firsts.append(self.members[:-offset][same])
+            seconds.append(self.members[offset:][same])
+            offset += 1
+
+        if not firsts:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty
+
+        first = np.concatenate(firsts)
+        second = np.concatenate(seconds)
+        low = np.minimum(first, second)
+        high = np.maximum(first, second)
+
+        # Boxes spanning several shared cells appear once per cell
+        keys = np.unique(low * len(self.boxes) + high)
+        return keys // len(self.boxes), keys % len(self.boxes)
+
+    def overlapping_pairs(self, iou_threshold: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Pairs of boxes with IoU at or above a positive threshold
+
+        Returns:
+            (first, second, iou) arrays with first < second
+        """
+        first, second = self.candidate_pairs()
+        iou = pair_iou(self.boxes, first, second)
+        keep = iou >= iou_threshold
+        return first[keep], second[keep], iou[keep]
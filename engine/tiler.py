@@ -210,6 +210,69 @@ def tile_image(
     return tiler.tile_image(image)
 
 
+def route_scales(
+    chip_size: int,
+    tile_size: int,
+    scales: List[float],
+    min_fill: float = 0.15,
+    max_fill: float = 1.0
+) -> List[float]:
+    """
+    Tile scales at which a query chip's object is usefully resolved
+    
+    A tile at scale s covers tile_size / s original pixels, so a chip of
+    chip_size pixels fills chip_size * s / tile_size of its width. Scales
+    where the object would be a speck (below min_fill) or not fit in one
+    tile (above max_fill) are skipped. If no scale qualifies, the one
+    closest to the range is returned.
+    
+    Args:
+        chip_size: Chip extent in original pixels (max of height, width)
+        tile_size: Base tile size (pixels)
+        scales: Tiler scale factors
+        min_fill: Smallest useful fraction of the tile width
+        max_fill: Largest fraction of the tile width
+        
+    Returns:
+        Compatible scales, in tiler order
+    """
+    fills = np.asarray(scales, dtype=np.float64) * chip_size / tile_size
+    compatible = (fills >= min_fill) & (fills <= max_fill)
+    if compatible.any():
+        return [scale for scale, keep in zip(scales, compatible) if keep]
+    
+    # Nearest scale, measured as a ratio outside the range
+    gap = np.maximum(np.log(min_fill / fills), np.log(fills / max_fill))
+    return [scales[int(np.argmin(gap))]]
+
+
+def stack_tiles(
+    tiles: List[Tile],
+    dtype: np.dtype = np.float32
+) -> np.ndarray:
+    """
+    Stack tile data into a single (N, C, H, W) batch buffer
+    
+    The buffer is preallocated in the target dtype, so a float16 batch
+    never materializes a float32 copy.
+    
+    Args:
+        tiles: List of Tile objects (all the same shape)
+        dtype: Output dtype, e.g. np.float16 for half-precision buffers
+        
+    Returns:
+        Array of shape (N, C, H, W)
+    """
+    if not tiles:
+        return np.empty((0,), dtype=dtype)
+    
+    batch = np.empty((len(tiles),) + tiles[0].data.shape, dtype=dtype)
+    for i, tile in enumerate(tiles):
+        batch[i] = tile.data
+    
+    return batch
+
+
 def reconstruct_from_tiles(
     tiles: List[Tile],
     image_shape: Tuple[int, int, int],
@@ -1,5 +1,6 @@
 """
 Training pipeline for embedder with triplet/contrastive loss
+Also supports distilling a teacher embedder into a lightweight student
 """
 
 import torch
@@ -12,7 +13,7 @@ from typing import List, Tuple, Optional, Dict
 from tqdm import tqdm
 import random
 
-from .embedder import Embedder
+from .embedder import Embedder, get_embedder
 from .io_tiff import read_tiff, normalize_bands
 
 
@@ -190,6 +191,47 @@ class TripletLoss(nn.Module):
             return torch.tensor(0.0, device=embeddings.device)
 
 
+class DistillationLoss(nn.Module):
+    """
+    Embedding distillation loss
+    
+    Combines a per-sample cosine term (student reproduces the teacher
+    embedding) with a relational term (student reproduces the teacher's
+    in-batch similarity matrix, which is what retrieval ranks on).
+    """
+    
+    def __init__(self, cosine_weight: float = 1.0, relation_weight: float = 0.5):
+        """
+        Args:
+            cosine_weight: Weight of the 1 - cos(student, teacher) term
+            relation_weight: Weight of the similarity-matrix MSE term
+        """
+        super().__init__()
+        self.cosine_weight = cosine_weight
+        self.relation_weight = relation_weight
+    
+    def forward(self, student_embeddings, teacher_embeddings):
+        """
+        Args:
+            student_embeddings: Tensor of shape (B, D)
+            teacher_embeddings: Tensor of shape (B, D)
+            
+        Returns:
+            Loss scalar
+        """
+        student = F.normalize(student_embeddings, p=2, dim=1)
+        teacher = F.normalize(teacher_embeddings, p=2, dim=1)
+        
+        loss = self.cosine_weight * (1 - (student * teacher).sum(dim=1)).mean()
+        
+        if self.relation_weight > 0:
+            student_sim = student @ student.t()
+            teacher_sim = teacher @ teacher.t()
+            loss = loss + self.relation_weight * F.mse_loss(student_sim, teacher_sim)
+        
+        return loss
+
+
 class Trainer:
     """
     Training manager for embedder
@@ -339,22 +381,70 @@ class Trainer:
         print(f"Loaded checkpoint from {path}")
 
 
-def train_embedder_from_config(config: Dict, image_paths: List[str]):
+class DistillationTrainer(Trainer):
     """
-    Convenience function to train embedder from config dict
-    
-    Args:
-        config: Configuration dict
-        image_paths: List of training image paths
+    Trains a student embedder to reproduce a frozen teacher's embeddings
+    Labels from the dataset are ignored; the teacher provides the targets.
     """
-    # Split train/val
+    
+    def __init__(self, model: Embedder, teacher: Embedder, **kwargs):
+        kwargs.setdefault('loss_fn', DistillationLoss())
+        super().__init__(model, **kwargs)
+        self.teacher = teacher.to(self.device)
+        self.teacher.eval()
+        for param in self.teacher.parameters():
+            param.requires_grad = False
+    
+    def _distillation_loss(self, images):
+        """Compute student loss against teacher targets for a batch"""
+        with torch.no_grad():
+            targets = self.teacher(images)
+        return self.loss_fn(self.model(images), targets)
+    
+    def train_epoch(self) -> float:
+        """Train for one epoch"""
+        self.model.train()
+        total_loss = 0
+        
+        pbar = tqdm(self.train_loader, desc='Distilling')
+        for images, _ in pbar:
+            images = images.to(self.device)
+            
+            loss = self._distillation_loss(images)
+            
+            self.optimizer.zero_grad()
+            loss.backward()
+            self.optimizer.step()
+            
+            total_loss += loss.item()
+            pbar.set_postfix({'loss': loss.item()})
+        
+        return total_loss / len(self.train_loader)
+    
+    def validate(self) -> float:
+        """Validate on validation set"""
+        if self.val_loader is None:
+            return 0.0
+        
+        self.model.eval()
+        total_loss = 0
+        
+        with torch.no_grad():
+            for images, _ in tqdm(self.val_loader, desc='Validation'):
+                images = images.to(self.device)
+                total_loss += self._distillation_loss(images).item()
+        
+        return total_loss / len(self.val_loader)
+
+
+def _build_loaders(config: Dict, image_paths: List[str]) -> Tuple[DataLoader, DataLoader]:
+    """Split image paths and create train/val dataloaders"""
     val_split = config['training'].get('val_split', 0.2)
     n_val = int(len(image_paths) * val_split)
     random.shuffle(image_paths)
     train_paths = image_paths[n_val:]
     val_paths = image_paths[:n_val]
     
-    # Create datasets
     train_dataset = TileDataset(
         train_paths,
         tile_size=config['tiler']['tile_size'],
@@ -369,7 +459,6 @@ def train_embedder_from_config(config: Dict, image_paths: List[str]):
         augment=False
     )
     
-    # Create dataloaders
     train_loader = DataLoader(
         train_dataset,
         batch_size=config['training']['batch_size'],
@@ -386,6 +475,37 @@ def train_embedder_from_config(config: Dict, image_paths: List[str]):
         pin_memory=True
     )
     
+    return train_loader, val_loader
+
+
+def _build_scheduler(config: Dict, optimizer: torch.optim.Optimizer):
+    """Create LR scheduler from config"""
+    scheduler = None
+    if config['training']['scheduler'] == 'cosine':
+        scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(
+            optimizer,
+            T_max=config['training']['num_epochs']
+        )
+    elif config['training']['scheduler'] == 'step':
+        scheduler = torch.optim.lr_scheduler.StepLR(
+            optimizer,
+            step_size=10,
+            gamma=0.5
+        )
+    return scheduler
+
+
+def train_embedder_from_config(config: Dict, image_paths: List[str]):
+    """
+    Convenience function to train embedder from config dict
+    
+    Args:
+        config: Configuration dict
+        image_paths: List of training image paths
+    """
+    # Create dataloaders
+    train_loader, val_loader = _build_loaders(config, image_paths)
+    
     # Create model
     model = Embedder(
         architecture=config['embedder']['architecture'],
@@ -402,18 +522,7 @@ def train_embedder_from_config(config: Dict, image_paths: List[str]):
     )
     
     # Create scheduler
-    scheduler = None
-    if config['training']['scheduler'] == 'cosine':
-        scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(
-            optimizer,
-            T_max=config['training']['num_epochs']
-        )
-    elif config['training']['scheduler'] == 'step':
-        scheduler = torch.optim.lr_scheduler.StepLR(
-            optimizer,
-            step_size=10,
-            gamma=0.5
-        )
+    scheduler = _build_scheduler(config, optimizer)
     
     # Create loss
     loss_fn = TripletLoss(
@@ -440,3 +549,73 @@ def train_embedder_from_config(config: Dict, image_paths: List[str]):
     )
     
     return trainer
+
+
+def distill_embedder_from_config(
+    config: Dict,
+    image_paths: List[str],
+    teacher_checkpoint: Optional[str] = None
+):
+    """
+    Distill a teacher embedder into a lightweight student
+    
+    Uses config['training']['distillation'] for teacher/student
+    architectures and loss weights; all other training settings are
+    shared with train_embedder_from_config.
+    
+    Args:
+        config: Configuration dict
+        image_paths: List of training image paths
+        teacher_checkpoint: Teacher checkpoint (overrides config)
+    """
+    distill_cfg = config['training'].get('distillation', {})
+    device = config['system']['device']
+    
+    train_loader, val_loader = _build_loaders(config, image_paths)
+    
+    teacher = get_embedder(
+        architecture=distill_cfg.get('teacher_architecture', config['embedder']['architecture']),
+        in_channels=config['embedder']['input_channels'],
+        embedding_dim=config['embedder']['embedding_dim'],
+        normalize=config['embedder']['normalize_embeddings'],
+        checkpoint=teacher_checkpoint or distill_cfg.get('teacher_checkpoint'),
+        device=device
+    )
+    
+    # Student shares the teacher's embedding space, so same dim/normalization
+    student = Embedder(
+        architecture=distill_cfg.get('student_architecture', 'custom_cnn'),
+        in_channels=config['embedder']['input_channels'],
+        embedding_dim=config['embedder']['embedding_dim'],
+        normalize=config['embedder']['normalize_embeddings']
+    )
+    
+    optimizer = torch.optim.Adam(
+        student.parameters(),
+        lr=config['training']['learning_rate'],
+        weight_decay=config['training']['weight_decay']
+    )
+    
+    loss_fn = DistillationLoss(
+        cosine_weight=distill_cfg.get('cosine_weight', 1.0),
+        relation_weight=distill_cfg.get('relation_weight', 0.5)
+    )
+    
+    trainer = DistillationTrainer(
+        model=student,
+        teacher=teacher,
+        train_loader=train_loader,
+        val_loader=val_loader,
+        loss_fn=loss_fn,
+        optimizer=optimizer,
+        scheduler=_build_scheduler(config, optimizer),
+        device=device,
+        checkpoint_dir=config['training']['checkpoint_dir']
+    )
+    
+    trainer.train(
+        num_epochs=config['training']['num_epochs'],
+        save_every=config['training']['save_every']
+    )
+    
+    return trainer
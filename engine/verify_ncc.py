@@ -4,7 +4,6 @@ Baseline verification method for multispectral imagery
 """
 
 import numpy as np
-import cv2
 from typing import Tuple, List
 from .candidate import Detection
 
@@ -83,6 +82,8 @@ class ZNCC:
         """
         if self.method == 'opencv':
             # Use OpenCV's matchTemplate
+            import cv2
+            
             result = cv2.matchTemplate(
                 image.astype(np.float32),
                 template.astype(np.float32),
@@ -3,14 +3,15 @@ Output writer for PS-03 submission format
 Writes space-delimited detection results
 """
 
+import numpy as np
 from pathlib import Path
-from typing import List, Optional
+from typing import List, Optional, Union
 from datetime import datetime
-from .candidate import Detection
+from .candidate import Detection, DetectionBatch
 
 
 def write_submission_file(
-    detections: List[Detection],
+    detections: Union[List[Detection], DetectionBatch],
     output_path: str,
     default_score: float = -1.0,
     sort_by_image: bool = True
@@ -21,26 +22,36 @@ def write_submission_file(
     Format: x_min y_min x_max y_max class_name target_filename score
     
     Args:
-        detections: List of Detection objects
+        detections: List of Detection objects or a DetectionBatch
         output_path: Path to output file
         default_score: Default score if score is None
         sort_by_image: Whether to sort by target filename
     """
+    if not isinstance(detections, DetectionBatch):
+        detections = DetectionBatch.from_detections(detections, columns=False)
+    
     # Ensure output directory exists
     Path(output_path).parent.mkdir(parents=True, exist_ok=True)
     
-    # Sort if requested
+    scores = np.where(np.isnan(detections.scores), default_score, detections.scores)
+    
+    # Sort if requested (stable, by filename then descending score)
     if sort_by_image:
-        detections = sorted(detections, key=lambda d: (d.target_filename, -d.score))
+        order = np.lexsort((-scores, detections.image_ids))
+        detections = detections.take(order)
+        scores = scores[order]
+    
+    lines = [
+        f"{box[0]} {box[1]} {box[2]} {box[3]} {class_name} {image_id} {score:.6f}\n"
+        for box, class_name, image_id, score in zip(
+            detections.boxes.tolist(), detections.class_labels.tolist(),
+            detections.image_ids.tolist(), scores.tolist()
+        )
+    ]
     
     # Write file
     with open(output_path, 'w') as f:
-        for det in detections:
-            score = det.score if det.score is not None else default_score
-            
-            line = f"{det.x_min} {det.y_min} {det.x_max} {det.y_max} " \
-                   f"{det.class_name} {det.target_filename} {score:.6f}\n"
-            f.write(line)
+        f.writelines(lines)
     
     print(f"Wrote {len(detections)} detections to {output_path}")
 
@@ -120,31 +131,33 @@ def read_submission_file(filepath: str) -> List[Detection]:
     return detections
 
 
+def _counts(values: np.ndarray) -> dict:
+    """Occurrences of each value, in order of first appearance"""
+    unique, first, counts = np.unique(values, return_index=True, return_counts=True)
+    order = np.argsort(first)
+    return dict(zip(unique[order].tolist(), counts[order].tolist()))
+
+
 def write_detections_summary(
-    detections: List[Detection],
+    detections: Union[List[Detection], DetectionBatch],
     output_path: str
 ):
     """
     Write summary statistics of detections
     
     Args:
-        detections: List of Detection objects
+        detections: List of Detection objects or a DetectionBatch
         output_path: Path to summary file
     """
-    from collections import defaultdict
+    if not isinstance(detections, DetectionBatch):
+        detections = DetectionBatch.from_detections(detections, columns=False)
     
     # Compute statistics
     total = len(detections)
     
-    by_class = defaultdict(int)
-    by_image = defaultdict(int)
-    scores = []
-    
-    for det in detections:
-        by_class[det.class_name] += 1
-        by_image[det.target_filename] += 1
-        if det.score is not None and det.score != -1:
-            scores.append(det.score)
+    by_class = _counts(detections.class_labels)
+    by_image = _counts(detections.image_ids)
+    scores = detections.scores[~np.isnan(detections.scores) & (detections.scores != -1)]
     
     # Write summary
     with open(output_path, 'w') as f:
@@ -165,8 +178,7 @@ def write_detections_summary(
         if len(by_image) > 10:
             f.write(f"  ... and {len(by_image) - 10} more images\n")
         
-        if scores:
-            import numpy as np
+        if len(scores):
             f.write(f"\nScore statistics:\n")
             f.write(f"  Mean: {np.mean(scores):.4f}\n")
             f.write(f"  Median: {np.median(scores):.4f}\n")
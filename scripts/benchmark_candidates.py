@@ -0,0 +1,88 @@
+"""
+Benchmark candidate retrieval on synthetic search results
+Compares the list pipeline (one dict and Detection per hit, sorted per
+image in Python) with the array pipeline (threshold mask, grouping by
+image and top-K per image in NumPy)
+"""
+
+import argparse
+import time
+import numpy as np
+from pathlib import Path
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from engine.candidate import CandidateRetriever
+from engine.search_result import SearchResult
+
+
+def synthetic_result(n_chips: int, k: int, n_images: int, seed: int = 0) -> SearchResult:
+    """Search results with random scores over tiles of n_images scenes"""
+    rng = np.random.default_rng(seed)
+    scores = -np.sort(-rng.uniform(0.0, 1.0, (n_chips, k)).astype(np.float32), axis=1)
+    indices = rng.integers(0, 10 * n_chips * k, (n_chips, k))
+
+    columns = {
+        'image_id': np.array([f'scene_{i:04d}' for i in range(n_images)])[indices % n_images],
+        'x': (indices % 1000) * 64,
+        'y': (indices // 1000 % 1000) * 64,
+        'width': np.full(indices.shape, 128),
+        'height': np.full(indices.shape, 128),
+        'scale': np.ones(indices.shape, dtype=np.float32),
+    }
+    return SearchResult(scores, 1.0 - scores, indices, columns)
+
+
+def time_call(fn, repeats: int) -> float:
+    """Best wall time of fn over repeats, in milliseconds"""
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return 1000 * best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark candidate retrieval pipelines')
+    parser.add_argument('--chips', type=int, default=50,
+                       help='Query chips')
+    parser.add_argument('--k', type=int, default=1000,
+                       help='Hits per chip')
+    parser.add_argument('--images', type=int, default=200,
+                       help='Target images the hits fall in')
+    parser.add_argument('--top-k-per-image', type=int, default=100,
+                       help='Candidates kept per image')
+    parser.add_argument('--threshold', type=float, default=0.5,
+                       help='Similarity threshold')
+    parser.add_argument('--repeats', type=int, default=5,
+                       help='Timing repeats (best is reported)')
+
+    args = parser.parse_args()
+
+    result = synthetic_result(args.chips, args.k, args.images)
+    chip_names = [f'chip_{i}' for i in range(args.chips)]
+    retriever = CandidateRetriever(
+        top_k_per_chip=args.k,
+        top_k_per_image=args.top_k_per_image,
+        similarity_threshold=args.threshold
+    )
+    legacy = list(result)
+
+    timings = {
+        'list pipeline': time_call(lambda: retriever.process(legacy, 'ship', chip_names), args.repeats),
+        'array pipeline': time_call(lambda: retriever.process_batch(result, 'ship', chip_names), args.repeats),
+        'array + Detection objects': time_call(lambda: retriever.process(result, 'ship', chip_names), args.repeats),
+    }
+
+    kept = len(retriever.process_batch(result, 'ship', chip_names))
+    print(f"{args.chips} chips x {args.k} hits over {args.images} images -> {kept} candidates")
+    print(f"\n{'pipeline':<28} {'ms':>9} {'speed-up':>9}")
+    for name, ms in timings.items():
+        print(f"{name:<28} {ms:>9.2f} {timings['list pipeline'] / ms:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""
+Benchmark FAISS index configurations against exact search
+Reports recall@K, memory per vector and query latency so accuracy
+can be traded against memory
+"""
+
+import argparse
+import time
+import numpy as np
+from pathlib import Path
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from engine.index_faiss import FAISSIndex, recall_at_k
+
+
+def load_vectors(index_dir: str = None, name: str = 'faiss_index', embeddings: str = None) -> np.ndarray:
+    """Load raw embeddings from a .npy file or reconstruct them from a Flat index"""
+    if embeddings:
+        return np.load(embeddings).astype(np.float32)
+
+    faiss_index = FAISSIndex.load(index_dir, name)
+    if faiss_index.index_type != 'Flat' or faiss_index.reduce_dim is not None:
+        raise ValueError("Benchmark needs a full-dimension Flat index (or --embeddings)")
+
+    return faiss_index.index.reconstruct_n(0, faiss_index.ntotal)
+
+
+def split_queries(vectors: np.ndarray, n_queries: int, seed: int = 0):
+    """Hold out n_queries vectors as queries, the rest form the database"""
+    rng = np.random.default_rng(seed)
+    perm = rng.permutation(len(vectors))
+    return vectors[perm[n_queries:]], vectors[perm[:n_queries]]
+
+
+def evaluate_variant(
+    database: np.ndarray,
+    queries: np.ndarray,
+    ground_truth: np.ndarray,
+    k: int,
+    **index_kwargs
+) -> dict:
+    """
+    Build one index configuration and measure it against exact search
+
+    Args:
+        database: Database vectors (N, D)
+        queries: Query vectors (Q, D)
+        ground_truth: Exact top-K ids for the queries (Q, K)
+        k: Neighbours for recall@K
+        **index_kwargs: FAISSIndex constructor arguments
+
+    Returns:
+        Dict with recall, bytes per vector, latency and build time
+    """
+    start = time.perf_counter()
+    faiss_index = FAISSIndex(embedding_dim=database.shape[1], **index_kwargs)
+    faiss_index.add(database)
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    _, indices = faiss_index.search(queries, k)
+    search_time = time.perf_counter() - start
+
+    return {
+        'recall': recall_at_k(ground_truth, indices, k),
+        'bytes_per_vector': faiss_index.memory_usage(include_metadata=False) / max(1, faiss_index.ntotal),
+        'ms_per_query': 1000 * search_time / len(queries),
+        'build_s': build_time,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark FAISS index configurations')
+    parser.add_argument('--index', type=str, default=None,
+                       help='Directory of a Flat index to take vectors from')
+    parser.add_argument('--name', type=str, default='faiss_index',
+                       help='Name of index files')
+    parser.add_argument('--embeddings', type=str, default=None,
+                       help='Alternatively, a .npy file of embeddings (N, D)')
+    parser.add_argument('--metric', type=str, default='cosine',
+                       help="'cosine' or 'l2'")
+    parser.add_argument('--k', type=int, default=100,
+                       help='Neighbours for recall@K')
+    parser.add_argument('--n-queries', type=int, default=500,
+                       help='Held-out query vectors')
+    parser.add_argument('--reduce-dims', type=int, nargs='*', default=[64, 128],
+                       help='PCA output dimensions to evaluate')
+    parser.add_argument('--whiten', action='store_true',
+                       help='Whiten PCA output')
+    parser.add_argument('--train-sample-size', type=int, default=100000,
+                       help='Max vectors used to fit trained stages')
+    parser.add_argument('--index-types', type=str, nargs='*', default=[],
+                       help='Index types to evaluate (IVF, IVFPQ, OPQ_IVFPQ, IVFSQ8, HNSW)')
+    parser.add_argument('--nlist', type=int, default=100,
+                       help='IVF clusters for compressed index types')
+    parser.add_argument('--nprobe', type=int, default=10,
+                       help='IVF clusters searched per query')
+    parser.add_argument('--code-size', type=int, default=32,
+                       help='PQ bytes per vector')
+    parser.add_argument('--ef-search', type=int, default=64,
+                       help='HNSW search list size')
+    parser.add_argument('--rerank', action='store_true',
+                       help='Also evaluate each index type with exact re-ranking')
+    parser.add_argument('--binary-bits', type=int, nargs='*', default=[],
+                       help='Binary code sizes to evaluate as a Hamming prefilter before exact re-ranking')
+    parser.add_argument('--binary-k-factor', type=int, default=16,
+                       help='Hamming candidates per result re-ranked exactly')
+
+    args = parser.parse_args()
+
+    if not args.index and not args.embeddings:
+        print("ERROR: Provide --index or --embeddings")
+        sys.exit(1)
+
+    vectors = load_vectors(args.index, args.name, args.embeddings)
+    database, queries = split_queries(vectors, min(args.n_queries, len(vectors) // 10))
+    k = min(args.k, len(database))
+    print(f"Database: {len(database)} x {database.shape[1]}, queries: {len(queries)}, k={k}")
+
+    # Exact baseline
+    exact = FAISSIndex(database.shape[1], index_type='Flat', metric=args.metric)
+    exact.add(database)
+    _, ground_truth = exact.search(queries, k)
+
+    variants = [('Flat', {})]
+    for dim in args.reduce_dims:
+        label = f"PCA{dim}{'W' if args.whiten else ''}"
+        variants.append((label, {'reduce_dim': dim, 'whiten': args.whiten}))
+    for index_type in args.index_types:
+        kwargs = {
+            'index_type': index_type,
+            'nlist': args.nlist,
+            'nprobe': args.nprobe,
+            'code_size': args.code_size,
+            'ef_search': args.ef_search,
+        }
+        variants.append((index_type, kwargs))
+        if args.rerank:
+            variants.append((f"{index_type}+RF", dict(kwargs, rerank=True)))
+    for bits in args.binary_bits:
+        # Codes cost bits / 8 bytes per vector on top of the float vectors kept for re-ranking
+        variants.append((f"BIN{bits}+RF", {
+            'binary_prefilter': True,
+            'binary_bits': bits,
+            'binary_k_factor': args.binary_k_factor,
+        }))
+
+    print(f"\n{'variant':<16} {'recall@K':>9} {'bytes/vec':>10} {'ms/query':>9} {'build s':>8}")
+    for label, kwargs in variants:
+        report = evaluate_variant(
+            database, queries, ground_truth, k,
+            metric=args.metric,
+            train_sample_size=args.train_sample_size,
+            **kwargs
+        )
+        print(f"{label:<16} {report['recall']:>9.4f} {report['bytes_per_vector']:>10.1f} "
+              f"{report['ms_per_query']:>9.3f} {report['build_s']:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
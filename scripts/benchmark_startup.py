@@ -0,0 +1,103 @@
+"""
+Benchmark cold-start time of the main entry points
+Measures import/startup wall time in fresh interpreters and reports
+which heavy dependencies each entry point loads
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).parent.parent
+
+HEAVY_MODULES = ['torch', 'torchvision', 'faiss', 'rasterio', 'cv2']
+
+# Entry point name -> Python snippet that performs its startup imports
+ENTRY_POINTS = {
+    'engine': "import engine",
+    'writer_only': "from engine import read_submission_file",
+    'api': "import api.main",
+    'eval_local_map': "import scripts.eval_local_map",
+    'run_search': "import scripts.run_search",
+}
+
+_PROBE = """
+import sys, time, json
+start = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - start
+heavy = {heavy!r}
+print(json.dumps({{'seconds': elapsed, 'loaded': [m for m in heavy if m in sys.modules]}}))
+"""
+
+
+def measure(code: str, repeats: int = 3) -> dict:
+    """
+    Run code in fresh interpreters and time it
+
+    Args:
+        code: Python statements to time
+        repeats: Number of fresh-process runs
+
+    Returns:
+        Dict with median in-process import time, median process wall
+        time and the heavy modules that ended up imported
+    """
+    import_times = []
+    wall_times = []
+    loaded = []
+
+    for _ in range(repeats):
+        probe = _PROBE.format(code=code, heavy=HEAVY_MODULES)
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, '-c', probe],
+            cwd=str(REPO_ROOT),
+            capture_output=True,
+            text=True
+        )
+        wall_times.append(time.perf_counter() - start)
+
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+        report = json.loads(result.stdout.strip().splitlines()[-1])
+        import_times.append(report['seconds'])
+        loaded = report['loaded']
+
+    return {
+        'import_s': statistics.median(import_times),
+        'wall_s': statistics.median(wall_times),
+        'loaded': loaded,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark entry point startup time')
+    parser.add_argument('--repeats', type=int, default=3,
+                       help='Fresh-process runs per entry point')
+    parser.add_argument('--only', type=str, nargs='*', default=None,
+                       help=f"Subset of entry points: {', '.join(ENTRY_POINTS)}")
+
+    args = parser.parse_args()
+
+    names = args.only or list(ENTRY_POINTS)
+
+    print(f"{'entry point':<16} {'import s':>9} {'wall s':>8}  heavy modules loaded")
+    for name in names:
+        try:
+            report = measure(ENTRY_POINTS[name], args.repeats)
+        except RuntimeError as e:
+            print(f"{name:<16} {'failed':>9}  {e}")
+            continue
+
+        loaded = ', '.join(report['loaded']) or '-'
+        print(f"{name:<16} {report['import_s']:>9.3f} {report['wall_s']:>8.3f}  {loaded}")
+
+
+if __name__ == '__main__':
+    main()
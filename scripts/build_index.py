@@ -14,7 +14,67 @@ import sys
 # Add parent directory to path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from engine import read_tiff, normalize_bands, TileGenerator, get_embedder, FAISSIndex
+from engine import (
+    read_tiff, normalize_bands, TileGenerator, get_embedder, FAISSIndex, ShardedFAISSIndex,
+    SceneIndex, build_provenance, IndexCompatibilityError
+)
+from engine.embedder import extract_embeddings
+from engine.tiler import stack_tiles
+from engine.index_builder import EmbeddingCache, build_index_streaming, choose_nlist
+
+
+def embed_image(
+    img_path: str,
+    embedder,
+    tiler: TileGenerator,
+    device: str = 'cpu',
+    normalize_method: str = 'percentile',
+    precision: str = 'fp32',
+    batch_size: int = 32
+):
+    """
+    Tile one image and embed its tiles
+    
+    Returns:
+        Tuple of (embeddings, metadata), or (None, []) if no tiles
+    """
+    img_name = Path(img_path).stem
+    tile_dtype = np.float32 if precision == 'fp32' else np.float16
+    
+    # Read and normalize
+    image, _ = read_tiff(img_path)
+    image = normalize_bands(image, method=normalize_method)
+    
+    # Generate tiles
+    tiles = tiler.tile_image(image, image_id=img_name)
+    
+    if not tiles:
+        print(f"Warning: No tiles generated for {img_name}")
+        return None, []
+    
+    # Extract embeddings in batches
+    tile_data = stack_tiles(tiles, dtype=tile_dtype)
+    embeddings = extract_embeddings(
+        embedder,
+        tile_data,
+        batch_size=batch_size,
+        device=device,
+        precision=precision
+    )
+    
+    # Store metadata
+    metadata = []
+    for tile in tiles:
+        metadata.append({
+            'image_id': img_name,
+            'x': tile.x,
+            'y': tile.y,
+            'width': tile.width,
+            'height': tile.height,
+            'scale': tile.scale
+        })
+    
+    return embeddings, metadata
 
 
 def build_index_from_images(
@@ -22,7 +82,9 @@ def build_index_from_images(
     embedder,
     tiler: TileGenerator,
     device: str = 'cpu',
-    normalize_method: str = 'percentile'
+    normalize_method: str = 'percentile',
+    precision: str = 'fp32',
+    batch_size: int = 32
 ):
     """
     Build FAISS index from list of images
@@ -33,6 +95,9 @@ def build_index_from_images(
         tiler: TileGenerator instance
         device: Device for embeddings
         normalize_method: Normalization method
+        precision: Inference precision ('fp32', 'bf16', 'fp16');
+                   reduced precision also stores tile batches as float16
+        batch_size: Tiles per embedder forward pass
         
     Returns:
         Tuple of (embeddings, metadata, image_ids)
@@ -43,45 +108,13 @@ def build_index_from_images(
     embedder.eval()
     
     for img_path in tqdm(image_paths, desc='Processing images'):
-        img_name = Path(img_path).stem
-        
-        # Read and normalize
-        image, _ = read_tiff(img_path)
-        image = normalize_bands(image, method=normalize_method)
-        
-        # Generate tiles
-        tiles = tiler.tile_image(image, image_id=img_name)
-        
-        if not tiles:
-            print(f"Warning: No tiles generated for {img_name}")
+        embeddings, metadata = embed_image(
+            img_path, embedder, tiler, device, normalize_method, precision, batch_size
+        )
+        if embeddings is None:
             continue
         
-        # Extract embeddings in batches
-        batch_size = 32
-        tile_data = np.stack([t.data for t in tiles])
-        
-        embeddings = []
-        with torch.no_grad():
-            for i in range(0, len(tile_data), batch_size):
-                batch = tile_data[i:i+batch_size]
-                batch_tensor = torch.from_numpy(batch).float().to(device)
-                emb = embedder(batch_tensor)
-                embeddings.append(emb.cpu().numpy())
-        
-        embeddings = np.vstack(embeddings)
-        
-        # Store metadata
-        for i, tile in enumerate(tiles):
-            metadata = {
-                'image_id': img_name,
-                'x': tile.x,
-                'y': tile.y,
-                'width': tile.width,
-                'height': tile.height,
-                'scale': tile.scale
-            }
-            all_metadata.append(metadata)
-        
+        all_metadata.extend(metadata)
         all_embeddings.append(embeddings)
     
     # Concatenate all embeddings
@@ -90,6 +123,80 @@ def build_index_from_images(
     return all_embeddings, all_metadata
 
 
+def cache_embeddings_from_images(
+    image_paths: list,
+    cache: EmbeddingCache,
+    embedder,
+    tiler: TileGenerator,
+    device: str = 'cpu',
+    normalize_method: str = 'percentile',
+    precision: str = 'fp32',
+    batch_size: int = 32
+) -> int:
+    """
+    Embed images scene by scene into an on-disk cache
+    
+    Only one scene's embeddings are held in memory at a time, and scenes
+    already in the cache are skipped, so interrupted runs resume.
+    
+    Returns:
+        Number of newly embedded scenes
+    """
+    embedder.eval()
+    n_new = 0
+    
+    for img_path in tqdm(image_paths, desc='Processing images'):
+        img_name = Path(img_path).stem
+        if img_name in cache:
+            continue
+        
+        embeddings, metadata = embed_image(
+            img_path, embedder, tiler, device, normalize_method, precision, batch_size
+        )
+        if embeddings is None:
+            continue
+        
+        cache.save_scene(img_name, embeddings, metadata)
+        n_new += 1
+    
+    return n_new
+
+
+def faiss_index_kwargs(config: dict) -> dict:
+    """FAISSIndex constructor arguments from the config's faiss section"""
+    return dict(
+        index_type=config['faiss']['index_type'],
+        metric=config['faiss']['metric'],
+        nlist=config['faiss']['nlist'],
+        nprobe=config['faiss']['nprobe'],
+        reduce_dim=config['faiss'].get('reduce_dim'),
+        whiten=config['faiss'].get('whiten', False),
+        train_sample_size=config['faiss'].get('train_sample_size'),
+        code_size=config['faiss'].get('code_size', 32),
+        rerank=config['faiss'].get('rerank', False),
+        rerank_k_factor=config['faiss'].get('rerank_k_factor', 4),
+        hnsw_m=config['faiss'].get('hnsw_m', 32),
+        ef_construction=config['faiss'].get('ef_construction', 200),
+        ef_search=config['faiss'].get('ef_search', 64),
+        num_threads=config['faiss'].get('num_threads'),
+        id_map=config['faiss'].get('id_map', False),
+        binary_prefilter=config['faiss'].get('binary_prefilter', False),
+        binary_bits=config['faiss'].get('binary_bits', 256),
+        binary_k_factor=config['faiss'].get('binary_k_factor', 16)
+    )
+
+
+def open_scene_index(directory: Path, config: dict, append: bool) -> SceneIndex:
+    """Existing scene index next to the tile index (if appending) or a new one"""
+    if append and SceneIndex.exists(str(directory)):
+        return SceneIndex.load(str(directory))
+    
+    return SceneIndex(
+        prototypes_per_scene=config['retrieval'].get('scene_prototypes', 4),
+        metric=config['faiss']['metric']
+    )
+
+
 def main():
     parser = argparse.ArgumentParser(description='Build FAISS index from target images')
     parser.add_argument('--targets', type=str, required=True,
@@ -106,6 +213,26 @@ def main():
                        help='Device (cuda/cpu), overrides config')
     parser.add_argument('--pattern', type=str, default='*.tif',
                        help='File pattern for images')
+    parser.add_argument('--precision', type=str, default=None,
+                       choices=['fp32', 'bf16', 'fp16'],
+                       help='Inference precision, overrides config')
+    parser.add_argument('--shard', type=str, default=None,
+                       help='Add these images as a new shard of a sharded index in --out')
+    parser.add_argument('--scenes-per-shard', type=int, default=None,
+                       help='Split these images into new shards of this many scenes each')
+    parser.add_argument('--per-scale', action='store_true',
+                       help='Write one sub-index (shard) per tiler scale, overrides config; '
+                            'replaces the index in --out unless adding with --shard')
+    parser.add_argument('--update', action='store_true',
+                       help='Replace/add these scenes in an existing id-mapped index in --out')
+    parser.add_argument('--compact', action='store_true',
+                       help='With --update, drop tombstoned rows and renumber ids before saving')
+    parser.add_argument('--cache', type=str, default=None,
+                       help='Embedding cache directory: embed scene by scene to disk, then '
+                            'train on a sample across the target scenes and stream-add '
+                            '(single index only; reused only by the same pipeline)')
+    parser.add_argument('--chunk-size', type=int, default=65536,
+                       help='Vectors per streamed add with --cache')
     
     args = parser.parse_args()
     
@@ -119,7 +246,18 @@ def main():
         print("CUDA not available, using CPU")
         device = 'cpu'
     
-    print(f"Building index on {device}")
+    precision = args.precision or config['embedder'].get('precision', 'fp32')
+    print(f"Building index on {device} ({precision})")
+    
+    per_scale = args.per_scale or config['faiss'].get('per_scale', False)
+    if args.cache and (args.shard or args.scenes_per_shard or args.update or per_scale):
+        # The streamed build writes one single index
+        print("ERROR: --cache cannot be combined with --shard, --scenes-per-shard, --update or per-scale shards")
+        return
+    if per_scale and args.update:
+        # Per-scale shards hold each scene in several shards; replace them with a rebuild
+        print("ERROR: --update cannot be combined with per-scale shards; rebuild the index instead")
+        return
     
     # Get image paths
     target_dir = Path(args.targets)
@@ -149,6 +287,9 @@ def main():
     
     print(f"Loaded embedder: {config['embedder']['architecture']}")
     
+    # Recorded in the index manifest so searches can check they match
+    provenance = build_provenance(config, checkpoint, precision)
+    
     # Create tiler
     tiler = TileGenerator(
         tile_size=config['tiler']['tile_size'],
@@ -156,6 +297,55 @@ def main():
         scales=config['tiler']['scales']
     )
     
+    if args.cache:
+        # Two-phase build: embeddings never need to fit in memory together
+        try:
+            cache = EmbeddingCache(args.cache, provenance=provenance)
+        except IndexCompatibilityError as e:
+            print(f"ERROR: {e}")
+            return
+        print(f"Extracting embeddings to cache {cache.directory}...")
+        n_new = cache_embeddings_from_images(
+            image_paths,
+            cache,
+            embedder,
+            tiler,
+            device=device,
+            normalize_method=config['preprocessing']['normalization'],
+            precision=precision
+        )
+        print(f"Embedded {n_new} new scenes ({len(cache.scenes())} cached)")
+        
+        # Only the --targets scenes, not everything else cached in the directory
+        scenes = [Path(p).stem for p in image_paths if Path(p).stem in cache]
+        
+        print("Building FAISS index (sampled training, streamed adds)...")
+        index_kwargs = faiss_index_kwargs(config)
+        nlist = index_kwargs.pop('nlist')
+        faiss_index = build_index_streaming(
+            cache,
+            nlist=None if nlist == 'auto' else nlist,
+            chunk_size=args.chunk_size,
+            scenes=scenes,
+            **index_kwargs
+        )
+        faiss_index.provenance = provenance
+        
+        output_dir = Path(args.out)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        faiss_index.save(str(output_dir), args.name)
+        
+        scene_index = open_scene_index(output_dir, config, append=False)
+        for image_id in scenes:
+            scene_index.add_scene(image_id, cache.load_embeddings(image_id))
+        scene_index.save(str(output_dir))
+        
+        print(f"\n✓ Index saved to {output_dir}/{args.name}")
+        print(f"  Total vectors: {faiss_index.ntotal}")
+        print(f"  nlist: {faiss_index.nlist}")
+        print(f"  Scenes: {len(scene_index)}")
+        return
+    
     # Build embeddings
     print("Extracting embeddings...")
     embeddings, metadata = build_index_from_images(
@@ -163,28 +353,106 @@ def main():
         embedder,
         tiler,
         device=device,
-        normalize_method=config['preprocessing']['normalization']
+        normalize_method=config['preprocessing']['normalization'],
+        precision=precision
     )
     
     print(f"Extracted {len(embeddings)} tile embeddings")
     
+    # FAISS index parameters
+    index_kwargs = faiss_index_kwargs(config)
+    if index_kwargs['nlist'] == 'auto':
+        index_kwargs['nlist'] = choose_nlist(len(embeddings))
+    
+    output_dir = Path(args.out)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    
+    # --shard / --scenes-per-shard add shards to an existing index; a plain
+    # per-scale build replaces whatever index is in --out
+    append = bool(args.shard or args.scenes_per_shard)
+    
+    if append or per_scale:
+        if append and ShardedFAISSIndex.exists(str(output_dir)):
+            # Add new shards next to existing ones without rebuilding them
+            sharded = ShardedFAISSIndex.load(str(output_dir))
+            sharded.check_compatibility(provenance)
+        else:
+            sharded = ShardedFAISSIndex()
+        
+        print("Building FAISS shards...")
+        if per_scale:
+            # Queries are routed to the scales compatible with their chip size
+            names = sharded.add_scales(
+                embeddings, metadata,
+                prefix=args.shard or 'scale',
+                **index_kwargs
+            )
+        elif args.scenes_per_shard:
+            names = sharded.add_scenes(
+                embeddings, metadata,
+                scenes_per_shard=args.scenes_per_shard,
+                prefix=args.shard or 'shard',
+                **index_kwargs
+            )
+        else:
+            sharded.create_shard(args.shard, embeddings, metadata, **index_kwargs)
+            names = [args.shard]
+        for name in names:
+            sharded.shards[name].provenance = provenance
+        
+        sharded.save(str(output_dir))
+        
+        scene_index = open_scene_index(output_dir, config, append=append)
+        scene_index.add_scenes(embeddings, metadata)
+        scene_index.save(str(output_dir))
+        
+        print(f"\n✓ {'Added' if append else 'Wrote'} shards {', '.join(names)} to {output_dir}")
+        print(f"  Shards: {len(sharded.shards)}")
+        print(f"  Total vectors: {sharded.ntotal}")
+        return
+    
+    if args.update:
+        # Swap reprocessed scenes in place instead of rebuilding
+        faiss_index = FAISSIndex.load(str(output_dir), args.name)
+        faiss_index.check_compatibility(provenance)
+        image_ids = np.array([m['image_id'] for m in metadata])
+        
+        print("Updating FAISS index...")
+        for image_id in dict.fromkeys(image_ids):
+            rows = np.flatnonzero(image_ids == image_id)
+            removed = faiss_index.replace_scene(image_id, embeddings[rows], [metadata[i] for i in rows])
+            print(f"  {image_id}: {removed} tiles replaced by {len(rows)}")
+        
+        if args.compact:
+            print(f"  Compacted {faiss_index.compact()} tombstoned rows")
+        faiss_index.save(str(output_dir), args.name)
+        
+        scene_index = open_scene_index(output_dir, config, append=True)
+        scene_index.add_scenes(embeddings, metadata)
+        scene_index.save(str(output_dir))
+        
+        print(f"\n✓ Index updated in {output_dir}/{args.name}")
+        print(f"  Total vectors: {faiss_index.ntotal}")
+        return
+    
     # Create FAISS index
     print("Building FAISS index...")
     faiss_index = FAISSIndex(
         embedding_dim=config['embedder']['embedding_dim'],
-        index_type=config['faiss']['index_type'],
-        metric=config['faiss']['metric'],
-        nlist=config['faiss']['nlist'],
-        nprobe=config['faiss']['nprobe']
+        **index_kwargs
     )
     
     faiss_index.add(embeddings, metadata)
+    faiss_index.provenance = provenance
     
     # Save index
-    output_dir = Path(args.out)
-    output_dir.mkdir(parents=True, exist_ok=True)
     faiss_index.save(str(output_dir), args.name)
     
+    # Scene-level prototypes for coarse-to-fine retrieval
+    scene_index = open_scene_index(output_dir, config, append=False)
+    scene_index.add_scenes(embeddings, metadata)
+    scene_index.save(str(output_dir))
+    
     print(f"\n✓ Index saved to {output_dir}/{args.name}")
     print(f"  Total vectors: {faiss_index.ntotal}")
     print(f"  Unique images: {len(set(m['image_id'] for m in metadata))}")
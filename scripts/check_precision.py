@@ -0,0 +1,156 @@
+"""
+Retrieval-quality regression check for reduced-precision inference
+Compares bf16/fp16 embeddings against float32 on real target tiles
+"""
+
+import argparse
+import yaml
+import numpy as np
+from pathlib import Path
+import time
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from engine import read_tiff, normalize_bands, TileGenerator, get_embedder, FAISSIndex
+from engine.embedder import extract_embeddings
+from engine.index_faiss import recall_at_k
+from engine.tiler import stack_tiles
+
+
+def compare_precision(
+    embedder,
+    tile_data: np.ndarray,
+    precision: str,
+    k: int = 10,
+    batch_size: int = 32,
+    device: str = 'cpu'
+) -> dict:
+    """
+    Embed tiles in float32 and in reduced precision and compare retrieval
+
+    Args:
+        embedder: Embedder model
+        tile_data: Tiles of shape (N, C, H, W), float32
+        precision: Reduced precision to check ('bf16' or 'fp16')
+        k: Neighbours used for recall@K
+        batch_size: Batch size for inference
+        device: Device for inference
+
+    Returns:
+        Dict with cosine agreement, recall@K and timings
+    """
+    start = time.perf_counter()
+    reference = extract_embeddings(embedder, tile_data, batch_size, device, 'fp32')
+    fp32_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    reduced = extract_embeddings(
+        embedder, tile_data.astype(np.float16), batch_size, device, precision
+    )
+    reduced_time = time.perf_counter() - start
+
+    # Per-tile agreement between the two embeddings of the same tile
+    cosine = np.sum(reference * reduced, axis=1) / (
+        np.linalg.norm(reference, axis=1) * np.linalg.norm(reduced, axis=1) + 1e-8
+    )
+
+    # Neighbour agreement: exact top-K in each embedding space
+    k = min(k, len(reference))
+    ref_index = FAISSIndex(reference.shape[1], index_type='Flat', metric='cosine')
+    ref_index.add(reference)
+    _, ref_neighbors = ref_index.search(reference, k)
+
+    red_index = FAISSIndex(reduced.shape[1], index_type='Flat', metric='cosine')
+    red_index.add(reduced)
+    _, red_neighbors = red_index.search(reduced, k)
+
+    return {
+        'n_tiles': len(reference),
+        'mean_cosine': float(cosine.mean()),
+        'min_cosine': float(cosine.min()),
+        'recall_at_k': recall_at_k(ref_neighbors, red_neighbors, k),
+        'fp32_tiles_per_sec': len(reference) / fp32_time,
+        'reduced_tiles_per_sec': len(reference) / reduced_time,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check reduced-precision retrieval quality')
+    parser.add_argument('--targets', type=str, required=True,
+                       help='Path to target images directory')
+    parser.add_argument('--config', type=str, default='configs/default.yaml',
+                       help='Path to config file')
+    parser.add_argument('--checkpoint', type=str, default=None,
+                       help='Path to embedder checkpoint')
+    parser.add_argument('--precision', type=str, default='bf16',
+                       choices=['bf16', 'fp16'],
+                       help='Reduced precision to compare against fp32')
+    parser.add_argument('--max-tiles', type=int, default=512,
+                       help='Maximum number of tiles to compare')
+    parser.add_argument('--k', type=int, default=10,
+                       help='Neighbours for recall@K')
+    parser.add_argument('--min-recall', type=float, default=0.9,
+                       help='Fail if recall@K drops below this value')
+    parser.add_argument('--device', type=str, default='cpu',
+                       help='Device (cuda/cpu)')
+    parser.add_argument('--pattern', type=str, default='*.tif',
+                       help='File pattern for images')
+
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as f:
+        config = yaml.safe_load(f)
+
+    image_paths = sorted(Path(args.targets).glob(args.pattern))
+    if not image_paths:
+        print(f"ERROR: No images found in {args.targets} with pattern {args.pattern}")
+        sys.exit(1)
+
+    embedder = get_embedder(
+        architecture=config['embedder']['architecture'],
+        in_channels=config['embedder']['input_channels'],
+        embedding_dim=config['embedder']['embedding_dim'],
+        normalize=config['embedder']['normalize_embeddings'],
+        checkpoint=args.checkpoint or config['embedder'].get('checkpoint'),
+        device=args.device
+    )
+
+    tiler = TileGenerator(
+        tile_size=config['tiler']['tile_size'],
+        stride=config['tiler']['stride'],
+        scales=[1.0]
+    )
+
+    # Collect tiles across images up to the budget
+    tiles = []
+    for img_path in image_paths:
+        image, _ = read_tiff(str(img_path))
+        image = normalize_bands(image, method=config['preprocessing']['normalization'])
+        tiles.extend(tiler.tile_image(image, image_id=img_path.stem))
+        if len(tiles) >= args.max_tiles:
+            break
+
+    tile_data = stack_tiles(tiles[:args.max_tiles])
+    print(f"Comparing fp32 vs {args.precision} on {len(tile_data)} tiles")
+
+    report = compare_precision(
+        embedder, tile_data, args.precision, k=args.k, device=args.device
+    )
+
+    print(f"  Mean cosine(fp32, {args.precision}): {report['mean_cosine']:.5f}")
+    print(f"  Min cosine:  {report['min_cosine']:.5f}")
+    print(f"  Recall@{args.k}:   {report['recall_at_k']:.4f}")
+    print(f"  fp32 throughput:  {report['fp32_tiles_per_sec']:.1f} tiles/sec")
+    print(f"  {args.precision} throughput:  {report['reduced_tiles_per_sec']:.1f} tiles/sec")
+
+    if report['recall_at_k'] < args.min_recall:
+        print(f"✗ Recall@{args.k} below {args.min_recall}")
+        sys.exit(1)
+
+    print("✓ Reduced precision within tolerance")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""
+Compare a teacher embedder with a distilled student
+Reports throughput (tiles/sec) and retrieval agreement on target tiles
+"""
+
+import argparse
+import time
+import yaml
+import numpy as np
+from pathlib import Path
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from engine import read_tiff, normalize_bands, TileGenerator, get_embedder, FAISSIndex
+from engine.embedder import extract_embeddings
+from engine.index_faiss import recall_at_k
+from engine.tiler import stack_tiles
+
+
+def timed_embeddings(embedder, tile_data, batch_size, device, precision='fp32'):
+    """Extract embeddings and return (embeddings, tiles_per_sec)"""
+    # Warm-up batch so lazy initialisation does not skew the timing
+    extract_embeddings(embedder, tile_data[:batch_size], batch_size, device, precision)
+
+    start = time.perf_counter()
+    embeddings = extract_embeddings(embedder, tile_data, batch_size, device, precision)
+    elapsed = time.perf_counter() - start
+
+    return embeddings, len(tile_data) / elapsed
+
+
+def retrieval_agreement(teacher_emb: np.ndarray, student_emb: np.ndarray, k: int = 10) -> dict:
+    """
+    Measure how closely the student reproduces teacher retrieval
+
+    Args:
+        teacher_emb: Teacher embeddings (N, D)
+        student_emb: Student embeddings (N, D)
+        k: Neighbours for recall@K
+
+    Returns:
+        Dict with per-tile cosine and neighbour recall@K
+    """
+    k = min(k, len(teacher_emb))
+
+    teacher_index = FAISSIndex(teacher_emb.shape[1], index_type='Flat', metric='cosine')
+    teacher_index.add(teacher_emb)
+    _, teacher_neighbors = teacher_index.search(teacher_emb, k)
+
+    student_index = FAISSIndex(student_emb.shape[1], index_type='Flat', metric='cosine')
+    student_index.add(student_emb)
+    _, student_neighbors = student_index.search(student_emb, k)
+
+    cosine = np.sum(teacher_emb * student_emb, axis=1) / (
+        np.linalg.norm(teacher_emb, axis=1) * np.linalg.norm(student_emb, axis=1) + 1e-8
+    )
+
+    return {
+        'mean_cosine': float(cosine.mean()),
+        'recall_at_k': recall_at_k(teacher_neighbors, student_neighbors, k),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare teacher and student embedders')
+    parser.add_argument('--targets', type=str, required=True,
+                       help='Path to target images directory')
+    parser.add_argument('--teacher', type=str, required=True,
+                       help='Teacher checkpoint')
+    parser.add_argument('--student', type=str, required=True,
+                       help='Student checkpoint')
+    parser.add_argument('--config', type=str, default='configs/default.yaml',
+                       help='Path to config file')
+    parser.add_argument('--max-tiles', type=int, default=512,
+                       help='Maximum number of tiles to compare')
+    parser.add_argument('--k', type=int, default=10,
+                       help='Neighbours for recall@K')
+    parser.add_argument('--batch-size', type=int, default=32,
+                       help='Inference batch size')
+    parser.add_argument('--device', type=str, default='cpu',
+                       help='Device (cuda/cpu)')
+    parser.add_argument('--pattern', type=str, default='*.tif',
+                       help='File pattern for images')
+
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as f:
+        config = yaml.safe_load(f)
+
+    distill_cfg = config['training'].get('distillation', {})
+    models = {}
+    for role, arch, checkpoint in [
+        ('teacher', distill_cfg.get('teacher_architecture', 'resnet34'), args.teacher),
+        ('student', distill_cfg.get('student_architecture', 'custom_cnn'), args.student),
+    ]:
+        models[role] = get_embedder(
+            architecture=arch,
+            in_channels=config['embedder']['input_channels'],
+            embedding_dim=config['embedder']['embedding_dim'],
+            normalize=config['embedder']['normalize_embeddings'],
+            checkpoint=checkpoint,
+            device=args.device
+        )
+        print(f"Loaded {role}: {arch}")
+
+    image_paths = sorted(Path(args.targets).glob(args.pattern))
+    if not image_paths:
+        print(f"ERROR: No images found in {args.targets} with pattern {args.pattern}")
+        sys.exit(1)
+
+    tiler = TileGenerator(
+        tile_size=config['tiler']['tile_size'],
+        stride=config['tiler']['stride'],
+        scales=[1.0]
+    )
+
+    tiles = []
+    for img_path in image_paths:
+        image, _ = read_tiff(str(img_path))
+        image = normalize_bands(image, method=config['preprocessing']['normalization'])
+        tiles.extend(tiler.tile_image(image, image_id=img_path.stem))
+        if len(tiles) >= args.max_tiles:
+            break
+
+    tile_data = stack_tiles(tiles[:args.max_tiles])
+    print(f"Comparing on {len(tile_data)} tiles")
+
+    teacher_emb, teacher_tps = timed_embeddings(models['teacher'], tile_data, args.batch_size, args.device)
+    student_emb, student_tps = timed_embeddings(models['student'], tile_data, args.batch_size, args.device)
+
+    agreement = retrieval_agreement(teacher_emb, student_emb, args.k)
+
+    print(f"\n  Teacher throughput: {teacher_tps:.1f} tiles/sec")
+    print(f"  Student throughput: {student_tps:.1f} tiles/sec ({student_tps / teacher_tps:.1f}x)")
+    print(f"  Mean cosine(teacher, student): {agreement['mean_cosine']:.4f}")
+    print(f"  Neighbour recall@{args.k}: {agreement['recall_at_k']:.4f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Measure coarse-to-fine retrieval against full tile search
+Ranks scenes with the scene index, searches tiles only in the top
+scenes for several budgets, and reports recall@K relative to searching
+every scene, so a scene_budget can be chosen for the config. Queries
+share one scene selection per batch, as the chips of a search request do
+"""
+
+import argparse
+import numpy as np
+from pathlib import Path
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from engine.index_sharded import load_any_index
+from engine.scene_index import SceneIndex
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate scene budgets for coarse-to-fine retrieval')
+    parser.add_argument('--index', type=str, required=True,
+                       help='Directory of the tile index and scene index')
+    parser.add_argument('--name', type=str, default='faiss_index',
+                       help='Name of index files')
+    parser.add_argument('--queries', type=str, required=True,
+                       help='.npy file of query embeddings (Q, D), e.g. chip embeddings')
+    parser.add_argument('--k', type=int, default=100,
+                       help='Neighbours for recall@K')
+    parser.add_argument('--scene-budgets', type=int, nargs='+', default=[1, 2, 5, 10, 20, 50],
+                       help='Scene budgets to evaluate')
+    parser.add_argument('--batch-size', type=int, default=None,
+                       help='Queries per search request sharing one scene selection '
+                            '(default: all queries, as one run_search call; 1 = per chip)')
+
+    args = parser.parse_args()
+
+    if not SceneIndex.exists(args.index):
+        print(f"ERROR: No scene index in {args.index} (rebuild with scripts/build_index.py)")
+        sys.exit(1)
+
+    tile_index = load_any_index(args.index, args.name)
+    scene_index = SceneIndex.load(args.index)
+    queries = np.load(args.queries).astype(np.float32)
+    k = min(args.k, tile_index.ntotal)
+
+    batch_size = args.batch_size or len(queries)
+    print(f"Tiles: {tile_index.ntotal}, scenes: {len(scene_index)}, queries: {len(queries)} "
+          f"({batch_size} per scene selection), k={k}")
+    report = scene_index.evaluate(tile_index, queries, k, args.scene_budgets, batch_size=batch_size)
+
+    print(f"\n{'scenes':>8} {'recall@K':>9} {'ms/query':>9}")
+    for entry in report:
+        budget = entry['scene_budget'] or 'all'
+        print(f"{budget:>8} {entry['recall']:>9.4f} {entry['ms_per_query']:>9.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -16,9 +16,11 @@ from datetime import datetime
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from engine import (
-    read_tiff, normalize_bands, get_embedder, FAISSIndex,
-    CandidateRetriever, ZNCC, write_submission_file
+    read_tiff, normalize_bands, get_embedder, load_any_index,
+    CandidateRetriever, SceneIndex, ZNCC, write_submission_file, build_provenance
 )
+from engine.embedder import inference_context
+from engine.tiler import route_scales
 
 
 def load_chips(chip_paths: list, normalize_method: str = 'percentile'):
@@ -35,17 +37,17 @@ def load_chips(chip_paths: list, normalize_method: str = 'percentile'):
     return chips, chip_names
 
 
-def extract_chip_embeddings(chips: list, embedder, device: str):
+def extract_chip_embeddings(chips: list, embedder, device: str, precision: str = 'fp32'):
     """Extract embeddings from chips"""
     embeddings = []
     
     embedder.eval()
-    with torch.no_grad():
+    with torch.no_grad(), inference_context(device, precision):
         for chip in chips:
             # Ensure correct shape (add batch dimension)
             chip_tensor = torch.from_numpy(chip).float().unsqueeze(0).to(device)
             emb = embedder(chip_tensor)
-            embeddings.append(emb.cpu().numpy())
+            embeddings.append(emb.float().cpu().numpy())
     
     embeddings = np.vstack(embeddings)
     return embeddings
@@ -59,7 +61,8 @@ def run_search(
     config: dict,
     checkpoint: str = None,
     use_zncc: bool = True,
-    device: str = 'cpu'
+    device: str = 'cpu',
+    image_ids: list = None
 ):
     """
     Run complete search pipeline
@@ -73,6 +76,7 @@ def run_search(
         checkpoint: Path to embedder checkpoint
         use_zncc: Whether to use ZNCC verification
         device: Device for computation
+        image_ids: Only search tiles of these target scenes (None = all)
     """
     print(f"Running search on {device}")
     print(f"Class: {class_name}")
@@ -97,31 +101,63 @@ def run_search(
     
     # Extract chip embeddings
     print("Extracting chip embeddings...")
-    chip_embeddings = extract_chip_embeddings(chips, embedder, device)
+    chip_embeddings = extract_chip_embeddings(
+        chips, embedder, device,
+        precision=config['embedder'].get('precision', 'fp32')
+    )
     print(f"Embeddings shape: {chip_embeddings.shape}")
     
     # Load FAISS index
     print("\nLoading FAISS index...")
-    faiss_index = FAISSIndex.load(index_dir, 'faiss_index')
+    faiss_index = load_any_index(
+        index_dir, 'faiss_index',
+        mmap=config['faiss'].get('mmap', False),
+        verify=config['faiss'].get('verify', 'size')
+    )
+    faiss_index.check_compatibility(build_provenance(config, checkpoint))
     print(f"Index loaded: {faiss_index.ntotal} vectors")
     
-    # Search
-    print("\nSearching...")
-    search_results = faiss_index.search_with_metadata(
-        chip_embeddings,
-        k=config['retrieval']['top_k_per_chip']
-    )
+    scene_index = SceneIndex.load(index_dir) if SceneIndex.exists(index_dir) else None
     
-    # Retrieve candidates
-    print("Retrieving candidates...")
     retriever = CandidateRetriever(
         top_k_per_chip=config['retrieval']['top_k_per_chip'],
         top_k_per_image=config['retrieval']['top_k_per_image'],
-        similarity_threshold=config['retrieval']['similarity_threshold']
+        similarity_threshold=config['retrieval']['similarity_threshold'],
+        search_mode=config['retrieval'].get('search_mode', 'knn'),
+        max_results_per_chip=config['retrieval'].get('max_results_per_chip'),
+        scene_budget=config['retrieval'].get('scene_budget'),
+        fusion=config['retrieval'].get('fusion'),
+        rrf_k=config['retrieval'].get('rrf_k', 60)
     )
     
-    detections, grouped = retriever.process(search_results, class_name, chip_names)
-    print(f"Retrieved {len(detections)} candidates from {len(grouped)} images")
+    # Search
+    print(f"\nSearching ({retriever.search_mode})...")
+    if scene_index is not None and retriever.scene_budget:
+        print(f"Coarse-to-fine: top {retriever.scene_budget} of {len(scene_index)} scenes")
+    if retriever.fusion:
+        print(f"Fusing {len(chips)} chips ({retriever.fusion})")
+    # Per-scale indexes: each chip only searches tile scales matching its size
+    query_scales = [
+        route_scales(
+            max(chip.shape[-2:]),
+            config['tiler']['tile_size'],
+            config['tiler']['scales'],
+            min_fill=config['tiler'].get('route_min_fill', 0.15),
+            max_fill=config['tiler'].get('route_max_fill', 1.0)
+        )
+        for chip in chips
+    ]
+    search_results = retriever.search(
+        faiss_index, chip_embeddings,
+        scene_index=scene_index,
+        query_scales=query_scales,
+        image_ids=image_ids
+    )
+    
+    # Retrieve candidates
+    print("Retrieving candidates...")
+    candidates = retriever.process_batch(search_results, class_name, chip_names)
+    print(f"Retrieved {len(candidates)} candidates from {len(np.unique(candidates.image_ids))} images")
     
     # ZNCC verification (optional)
     if use_zncc and config['scoring']['use_zncc']:
@@ -133,6 +169,7 @@ def run_search(
         # For now, we'll combine scores based on embedder similarity only
         
         # If you have target images available, uncomment and adapt:
+        # grouped = retriever.aggregate_by_image(candidates.to_detections())
         # for image_id, dets in grouped.items():
         #     target_path = f"data/testing_set/{image_id}.tif"
         #     if Path(target_path).exists():
@@ -144,31 +181,20 @@ def run_search(
         #                                     embedder_weight=1-config['scoring']['zncc_weight'],
         #                                     zncc_weight=config['scoring']['zncc_weight'])
         #         grouped[image_id] = dets
+        # candidates = DetectionBatch.from_detections([d for dets in grouped.values() for d in dets])
     
     # Apply NMS per image
     print("Applying NMS...")
-    grouped = {}
     from engine.nms import apply_nms_per_image
     
-    # Group detections by image first
-    from collections import defaultdict
-    grouped_temp = defaultdict(list)
-    for det in detections:
-        grouped_temp[det.target_filename].append(det)
-    
-    grouped = apply_nms_per_image(
-        dict(grouped_temp),
+    final_detections = apply_nms_per_image(
+        candidates,
         method=config['nms']['method'],
         iou_threshold=config['nms']['iou_threshold'],
         score_threshold=config['nms']['score_threshold'],
         sigma=config['nms']['sigma']
     )
     
-    # Flatten to final detections
-    final_detections = []
-    for dets in grouped.values():
-        final_detections.extend(dets)
-    
     print(f"After NMS: {len(final_detections)} detections")
     
     # Write submission file
@@ -177,7 +203,7 @@ def run_search(
     
     print(f"\n✓ Search complete!")
     print(f"  Detections: {len(final_detections)}")
-    print(f"  Images: {len(grouped)}")
+    print(f"  Images: {len(np.unique(final_detections.image_ids))}")
     print(f"  Output: {output_path}")
 
 
@@ -203,6 +229,16 @@ def main():
                        help='Disable ZNCC verification')
     parser.add_argument('--team', type=str, default='TeamName',
                        help='Team name for submission filename')
+    parser.add_argument('--image-ids', type=str, nargs='+', default=None,
+                       help='Only search these target scenes (image ids)')
+    parser.add_argument('--scene-budget', type=int, default=None,
+                       help='Search tiles only in this many top-ranked scenes (overrides config)')
+    parser.add_argument('--fusion', type=str, default=None,
+                       choices=['none', 'mean', 'max', 'rrf', 'prototype'],
+                       help='Fuse the chips into one ranked list (overrides config)')
+    parser.add_argument('--verify-index', type=str, default=None,
+                       choices=['none', 'size', 'full'],
+                       help='Check index files on load; full re-hashes every file (overrides config)')
     
     args = parser.parse_args()
     
@@ -210,6 +246,13 @@ def main():
     with open(args.config, 'r') as f:
         config = yaml.safe_load(f)
     
+    if args.scene_budget is not None:
+        config['retrieval']['scene_budget'] = args.scene_budget
+    if args.fusion is not None:
+        config['retrieval']['fusion'] = None if args.fusion == 'none' else args.fusion
+    if args.verify_index is not None:
+        config['faiss']['verify'] = args.verify_index
+    
     # Determine device
     device = args.device or config['system']['device']
     if device == 'cuda' and not torch.cuda.is_available():
@@ -269,7 +312,8 @@ def main():
         config=config,
         checkpoint=args.checkpoint,
         use_zncc=not args.no_zncc,
-        device=device
+        device=device,
+        image_ids=args.image_ids
     )
 
 
@@ -10,7 +10,7 @@ import sys
 # Add parent directory to path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from engine.train import train_embedder_from_config
+from engine.train import train_embedder_from_config, distill_embedder_from_config
 
 
 def main():
@@ -27,6 +27,10 @@ def main():
                        help='Device (cuda/cpu), overrides config')
     parser.add_argument('--pattern', type=str, default='*.tif',
                        help='File pattern for images')
+    parser.add_argument('--distill', action='store_true',
+                       help='Distill a teacher checkpoint into a lightweight student')
+    parser.add_argument('--teacher', type=str, default=None,
+                       help='Teacher checkpoint for --distill (overrides config)')
     
     args = parser.parse_args()
     
@@ -62,8 +66,14 @@ def main():
     print(f"Checkpoint dir: {config['training']['checkpoint_dir']}")
     
     # Train
-    print("\nStarting training...")
-    trainer = train_embedder_from_config(config, image_paths)
+    if args.distill:
+        distill_cfg = config['training'].get('distillation', {})
+        print(f"\nDistilling {distill_cfg.get('teacher_architecture')} -> "
+              f"{distill_cfg.get('student_architecture')}...")
+        trainer = distill_embedder_from_config(config, image_paths, teacher_checkpoint=args.teacher)
+    else:
+        print("\nStarting training...")
+        trainer = train_embedder_from_config(config, image_paths)
     
     print("\n✓ Training complete!")
     print(f"  Best loss: {trainer.best_loss:.4f}")
@@ -0,0 +1,105 @@
+"""
+Tune nprobe / efSearch of a saved index against a recall target
+Measures recall@K of held-out queries against exact search across a
+sweep, and saves the cheapest setting that meets the target into the
+index metadata. Without held-out queries, queries are sampled from the
+indexed embeddings and their self-matches are excluded
+"""
+
+import argparse
+import numpy as np
+from pathlib import Path
+import sys
+from typing import Optional
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from engine.index_faiss import FAISSIndex, drop_query_ids
+
+
+def exact_neighbours(
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    k: int,
+    metric: str,
+    exclude_ids: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """Exact top-K ids of queries among vectors, optionally without each query's own id"""
+    exact = FAISSIndex(vectors.shape[1], index_type='Flat', metric=metric)
+    exact.add(vectors)
+    if exclude_ids is None:
+        _, indices = exact.search(queries, k)
+        return indices
+    _, indices = exact.search(queries, k + 1)
+    return drop_query_ids(indices, exclude_ids, k)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tune FAISS search parameters against a recall target')
+    parser.add_argument('--index', type=str, required=True,
+                       help='Directory of the index to tune')
+    parser.add_argument('--name', type=str, default='faiss_index',
+                       help='Name of index files')
+    parser.add_argument('--embeddings', type=str, required=True,
+                       help='.npy file of the indexed embeddings (N, D), in index order')
+    parser.add_argument('--k', type=int, default=100,
+                       help='Neighbours for recall@K')
+    parser.add_argument('--queries', type=str, default=None,
+                       help='.npy file of held-out query vectors (Q, D) not in the index '
+                            '(default: sample from --embeddings and exclude self-matches)')
+    parser.add_argument('--n-queries', type=int, default=500,
+                       help='Query vectors sampled from the queries or embeddings')
+    parser.add_argument('--target-recall', type=float, default=0.95,
+                       help='Required recall@K')
+    parser.add_argument('--values', type=int, nargs='*', default=None,
+                       help='nprobe / efSearch values to try (default: powers of two)')
+    parser.add_argument('--dry-run', action='store_true',
+                       help='Report only, do not save the chosen setting')
+
+    args = parser.parse_args()
+
+    faiss_index = FAISSIndex.load(args.index, args.name)
+    vectors = np.load(args.embeddings).astype(np.float32)
+    if len(vectors) != faiss_index.ntotal or len(faiss_index.tombstones):
+        print(f"ERROR: Embeddings ({len(vectors)}) do not match index contents ({faiss_index.ntotal} vectors)")
+        sys.exit(1)
+
+    rng = np.random.default_rng(0)
+    if args.queries:
+        queries = np.load(args.queries).astype(np.float32)
+        queries = queries[rng.choice(len(queries), min(args.n_queries, len(queries)), replace=False)]
+        query_ids = None
+        k = min(args.k, len(vectors))
+    else:
+        # Each query is its own exact top-1 and sits in the first probed list;
+        # counting that hit would make low nprobe / efSearch look good enough
+        query_ids = rng.choice(len(vectors), min(args.n_queries, len(vectors)), replace=False)
+        queries = vectors[query_ids]
+        k = min(args.k, len(vectors) - 1)
+
+    source = 'held-out' if query_ids is None else 'sampled from index, self-matches excluded'
+    print(f"Index: {faiss_index.index_type}, {faiss_index.ntotal} vectors, "
+          f"queries: {len(queries)} ({source}), k={k}")
+    ground_truth = exact_neighbours(vectors, queries, k, faiss_index.metric, query_ids)
+
+    report = faiss_index.tune(queries, ground_truth, args.target_recall, args.values, exclude_ids=query_ids)
+    param = report['param']
+
+    print(f"\n{param:>10} {'recall@K':>9} {'ms/query':>9}")
+    for entry in report['sweep']:
+        marker = '  <-' if entry[param] == report['value'] else ''
+        print(f"{entry[param]:>10} {entry['recall']:>9.4f} {entry['ms_per_query']:>9.3f}{marker}")
+
+    if not report['met_target']:
+        print(f"\nWARNING: No value reached recall {args.target_recall}; using best recall")
+
+    if args.dry_run:
+        return
+
+    faiss_index.save(args.index, args.name)
+    print(f"\n✓ Saved {param}={report['value']} (recall@{k}={report['recall']:.4f}) to {args.index}/{args.name}")
+
+
+if __name__ == '__main__':
+    main()
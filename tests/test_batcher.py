@@ -0,0 +1,102 @@
+"""
+Unit tests for micro-batching inference scheduler
+"""
+
+import pytest
+import asyncio
+import numpy as np
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from engine.batcher import MicroBatcher
+
+
+def _sum_embed(batch):
+    """Fake embedder: one 'embedding' per input, records batch sizes"""
+    _sum_embed.sizes.append(len(batch))
+    return batch.reshape(len(batch), -1).sum(axis=1, keepdims=True)
+
+
+def test_concurrent_requests_are_batched():
+    """Test requests arriving within the latency window share a batch"""
+    _sum_embed.sizes = []
+    batcher = MicroBatcher(_sum_embed, max_batch_size=8, max_latency_ms=50)
+    batcher.start()
+    
+    async def run():
+        items = [np.full((4, 8, 8), i, dtype=np.float32) for i in range(6)]
+        return await asyncio.gather(*(batcher.embed(item) for item in items))
+    
+    try:
+        results = asyncio.run(run())
+    finally:
+        batcher.stop()
+    
+    assert [float(r[0]) for r in results] == [i * 4 * 8 * 8 for i in range(6)]
+    assert sum(_sum_embed.sizes) == 6
+    assert len(_sum_embed.sizes) < 6
+
+
+def test_mixed_shapes_and_max_batch_size():
+    """Test inputs are grouped by shape and capped at max_batch_size"""
+    _sum_embed.sizes = []
+    batcher = MicroBatcher(_sum_embed, max_batch_size=3, max_latency_ms=50)
+    
+    futures = []
+    for i in range(5):
+        shape = (4, 8, 8) if i % 2 == 0 else (4, 16, 16)
+        futures.append(batcher.submit(np.ones(shape, dtype=np.float32)))
+    
+    results = [f.result(timeout=5) for f in futures]
+    batcher.stop()
+    
+    assert [float(r[0]) for r in results] == [256, 1024, 256, 1024, 256]
+    assert max(_sum_embed.sizes) <= 3
+
+
+def test_errors_propagate_to_callers():
+    """Test a failing batch resolves every waiting future with the error"""
+    def failing(batch):
+        raise RuntimeError("boom")
+    
+    batcher = MicroBatcher(failing, max_batch_size=4, max_latency_ms=1)
+    future = batcher.submit(np.zeros((4, 8, 8), dtype=np.float32))
+    
+    with pytest.raises(RuntimeError):
+        future.result(timeout=5)
+    
+    batcher.stop()
+
+
+def test_stop_drains_requests_queued_behind_it():
+    """Test requests submitted while stopping are served by the same worker"""
+    import threading
+    
+    release = threading.Event()
+    
+    def slow(batch):
+        release.wait(5)
+        return _sum_embed(batch)
+    
+    _sum_embed.sizes = []
+    batcher = MicroBatcher(slow, max_batch_size=4, max_latency_ms=1)
+    first = batcher.submit(np.ones((4, 8, 8), dtype=np.float32))
+    worker = batcher._thread
+    
+    # Worker is busy: stop times out and the sentinel stays queued
+    batcher.stop(timeout=0.05)
+    assert worker.is_alive() and batcher._thread is worker
+    
+    late = [batcher.submit(np.ones((4, 8, 8), dtype=np.float32)) for _ in range(3)]
+    assert batcher._thread is worker  # No second worker
+    
+    release.set()
+    assert [float(f.result(timeout=5)[0]) for f in [first] + late] == [256] * 4
+    worker.join(5)
+    assert batcher._thread is None
+    
+    # A stopped batcher restarts on the next request
+    assert float(batcher.submit(np.ones((4, 8, 8), dtype=np.float32)).result(timeout=5)[0]) == 256
+    batcher.stop()
@@ -130,3 +130,59 @@ def test_embedder_variable_input_size():
             output = embedder(x)
         
         assert output.shape == (1, 256), f"Failed for size {size}"
+
+
+def test_extract_embeddings_reduced_precision():
+    """Test bf16 inference on float16 tiles stays close to float32"""
+    embedder = get_embedder(architecture='custom_cnn', device='cpu')
+    
+    images = np.random.rand(6, 4, 128, 128).astype(np.float32)
+    
+    reference = extract_embeddings(embedder, images, batch_size=4, device='cpu')
+    reduced = extract_embeddings(
+        embedder, images.astype(np.float16), batch_size=4, device='cpu', precision='bf16'
+    )
+    
+    assert reduced.dtype == np.float32
+    assert reduced.shape == reference.shape
+    
+    cosine = np.sum(reference * reduced, axis=1)
+    assert np.all(cosine > 0.98)
+
+
+def test_distillation_step_reduces_loss():
+    """Test student distillation against a frozen teacher"""
+    from torch.utils.data import DataLoader, TensorDataset
+    from engine.train import DistillationLoss, DistillationTrainer
+    import tempfile
+    
+    torch.manual_seed(0)
+    teacher = Embedder(architecture='custom_cnn', embedding_dim=32)
+    student = Embedder(architecture='custom_cnn', embedding_dim=32)
+    
+    images = torch.rand(8, 4, 64, 64)
+    loader = DataLoader(TensorDataset(images, torch.zeros(8)), batch_size=4)
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        trainer = DistillationTrainer(
+            model=student,
+            teacher=teacher,
+            train_loader=loader,
+            loss_fn=DistillationLoss(),
+            device='cpu',
+            checkpoint_dir=tmpdir
+        )
+        
+        student.eval()
+        with torch.no_grad():
+            before = trainer.loss_fn(student(images), teacher(images)).item()
+        
+        for _ in range(5):
+            trainer.train_epoch()
+        
+        student.eval()
+        with torch.no_grad():
+            after = trainer.loss_fn(student(images), teacher(images)).item()
+    
+    assert after < before
+    assert all(not p.requires_grad for p in teacher.parameters())
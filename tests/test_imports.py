@@ -0,0 +1,42 @@
+"""
+Unit tests for lazy package imports
+"""
+
+import subprocess
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).parent.parent
+
+
+def _loaded_modules(code):
+    """Run code in a fresh interpreter and return the heavy modules it loaded"""
+    probe = (
+        f"{code}\n"
+        "import sys\n"
+        "print(','.join(m for m in ['torch', 'faiss', 'rasterio', 'cv2'] if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, '-c', probe], cwd=str(REPO_ROOT),
+        capture_output=True, text=True, check=True
+    )
+    return [m for m in result.stdout.strip().split(',') if m]
+
+
+def test_import_engine_is_lazy():
+    """Test importing the package loads no heavy dependencies"""
+    assert _loaded_modules("import engine") == []
+
+
+def test_writer_import_is_lightweight():
+    """Test evaluation-only imports avoid torch/faiss/rasterio/cv2"""
+    assert _loaded_modules("from engine import read_submission_file, compute_iou") == []
+
+
+def test_lazy_attribute_resolves():
+    """Test lazily exported names resolve to the defining module's objects"""
+    import engine
+    from engine.tiler import TileGenerator
+    
+    assert engine.TileGenerator is TileGenerator
+    assert 'FAISSIndex' in dir(engine)
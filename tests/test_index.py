@@ -10,7 +10,10 @@ import sys
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from engine.index_faiss import FAISSIndex
+from engine.index_faiss import FAISSIndex, drop_query_ids, recall_at_k
+from engine.index_sharded import ShardedFAISSIndex, load_any_index
+from engine.index_builder import EmbeddingCache, ReservoirSampler, build_index_streaming, choose_nlist
+from engine.scene_index import SceneIndex
 
 
 def test_faiss_index_flat():
@@ -147,3 +150,837 @@ def test_faiss_index_incremental_add():
     
     assert index.ntotal == 100
     assert len(index.tile_metadata) == 100
+
+
+def test_recall_at_k():
+    """Test recall@K between neighbour id sets"""
+    reference = np.array([[0, 1, 2, 3], [4, 5, 6, 7]])
+    candidate = np.array([[3, 2, 1, 0], [4, 5, 8, 9]])
+    
+    assert recall_at_k(reference, reference) == 1.0
+    assert recall_at_k(reference, candidate) == pytest.approx(0.75)
+
+
+def test_faiss_index_pca_reduction():
+    """Test PCA-reduced index keeps neighbours and survives save/load"""
+    rng = np.random.default_rng(0)
+    # Low-rank data so 32 PCA components capture it
+    vectors = (rng.standard_normal((500, 32)) @ rng.standard_normal((32, 128))).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    
+    index = FAISSIndex(embedding_dim=128, index_type='Flat', metric='cosine',
+                       reduce_dim=32, whiten=False)
+    index.add(vectors, [{'id': i} for i in range(500)])
+    
+    exact = FAISSIndex(embedding_dim=128, index_type='Flat', metric='cosine')
+    exact.add(vectors)
+    
+    _, ref = exact.search(vectors[:20], k=10)
+    _, approx = index.search(vectors[:20], k=10)
+    assert recall_at_k(ref, approx) > 0.9
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        index.save(tmpdir, 'pca_index')
+        loaded = FAISSIndex.load(tmpdir, 'pca_index')
+        
+        assert loaded.reduce_dim == 32
+        _, loaded_approx = loaded.search(vectors[:20], k=10)
+        assert np.array_equal(loaded_approx, approx)
+
+
+def test_faiss_index_ivfpq_rerank():
+    """Test compressed IVF-PQ index with exact re-ranking"""
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((1000, 32)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    
+    index = FAISSIndex(embedding_dim=32, index_type='IVFPQ', metric='cosine',
+                       nlist=4, nprobe=4, code_size=8, rerank=True, rerank_k_factor=8)
+    index.add(vectors)
+    
+    distances, indices = index.search(vectors[:10], k=5)
+    
+    # Re-ranked scores are exact inner products, so self-match scores 1.0
+    assert np.array_equal(indices[:, 0], np.arange(10))
+    assert np.allclose(distances[:, 0], 1.0, atol=1e-5)
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        index.save(tmpdir, 'pq_index')
+        loaded = FAISSIndex.load(tmpdir, 'pq_index')
+        
+        assert loaded.index_type == 'IVFPQ'
+        assert loaded.code_size == 8
+        assert loaded.rerank
+        _, loaded_indices = loaded.search(vectors[:10], k=5)
+        assert np.array_equal(loaded_indices, indices)
+
+
+def test_faiss_index_hnsw_ef_search_override():
+    """Test HNSW index with per-query efSearch override"""
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((1000, 32)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    
+    index = FAISSIndex(embedding_dim=32, index_type='HNSW', metric='cosine',
+                       hnsw_m=16, ef_construction=64, ef_search=16)
+    index.add(vectors)
+    
+    exact = FAISSIndex(embedding_dim=32, index_type='Flat', metric='cosine')
+    exact.add(vectors)
+    _, ref = exact.search(vectors[:50], k=10)
+    
+    _, narrow = index.search(vectors[:50], k=10, ef_search=10)
+    _, wide = index.search(vectors[:50], k=10, ef_search=256)
+    assert recall_at_k(ref, wide) > 0.95
+    assert recall_at_k(ref, narrow) < recall_at_k(ref, wide)
+    
+    # Override must not change the stored default
+    assert index.ef_search == 16
+    _, default = index.search(vectors[:50], k=10)
+    assert np.array_equal(default, index.search(vectors[:50], k=10, ef_search=16)[1])
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        index.save(tmpdir, 'hnsw_index')
+        loaded = FAISSIndex.load(tmpdir, 'hnsw_index')
+        assert loaded.index_type == 'HNSW'
+        assert loaded.ef_search == 16
+        assert np.array_equal(loaded.search(vectors[:50], k=10)[1], default)
+
+
+def test_faiss_index_num_threads_scoped():
+    """Test num_threads applies to building only and survives save/load"""
+    import faiss
+    
+    before = faiss.omp_get_max_threads()
+    index = FAISSIndex(embedding_dim=16, index_type='IVF', metric='l2', nlist=4, num_threads=1)
+    index.add(np.random.default_rng(0).standard_normal((200, 16)).astype(np.float32))
+    assert faiss.omp_get_max_threads() == before
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        index.save(tmpdir, 'threads_index')
+        assert FAISSIndex.load(tmpdir, 'threads_index').num_threads == 1
+
+
+def test_faiss_index_mmap_load():
+    """Test memory-mapped index and metadata loading"""
+    index = FAISSIndex(embedding_dim=32, index_type='Flat', metric='cosine')
+    
+    vectors = np.random.randn(40, 32).astype(np.float32)
+    metadata = [{'image_id': f'img_{i % 4}', 'x': i, 'y': 0} for i in range(40)]
+    index.add(vectors, metadata)
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        index.save(tmpdir, 'test_index')
+        loaded = FAISSIndex.load(tmpdir, 'test_index', mmap=True)
+        
+        assert loaded.ntotal == 40
+        assert loaded.tile_metadata[5] == metadata[5]
+        assert loaded.tile_metadata.unique('image_id') == ['img_0', 'img_1', 'img_2', 'img_3']
+        
+        _, indices = loaded.search(vectors[:3], k=3)
+        assert list(indices[:, 0]) == [0, 1, 2]
+        del loaded
+    
+    # Inverted lists are mapped too
+    index = FAISSIndex(embedding_dim=32, index_type='IVF', metric='cosine', nlist=4, nprobe=4)
+    index.add(vectors, metadata)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        index.save(tmpdir, 'ivf_index')
+        loaded = FAISSIndex.load(tmpdir, 'ivf_index', mmap=True)
+        assert np.array_equal(loaded.search(vectors[:3], k=3)[1], index.search(vectors[:3], k=3)[1])
+        del loaded
+
+
+def test_faiss_index_memory_usage():
+    """Test structural memory estimate counts metadata and separates mapped files"""
+    import faiss
+    
+    vectors = np.random.randn(1000, 16).astype(np.float32)
+    metadata = [{'image_id': f'img_{i % 4}', 'x': i} for i in range(1000)]
+    
+    for kwargs in [dict(index_type='Flat'), dict(index_type='IVF', nlist=8)]:
+        index = FAISSIndex(embedding_dim=16, metric='l2', **kwargs)
+        index.add(vectors, metadata)
+        
+        # Vector storage dominates; metadata is int32 codes and x values
+        assert index.memory_usage(include_metadata=False) >= 1000 * 16 * 4
+        assert index.memory_usage() - index.memory_usage(include_metadata=False) >= 1000 * 8
+        
+        with tempfile.TemporaryDirectory() as tmpdir:
+            index.save(tmpdir, 'index')
+            loaded = FAISSIndex.load(tmpdir, 'index', mmap=True)
+            assert loaded.memory_usage(include_mapped=True) == index.memory_usage()
+            if kwargs['index_type'] != 'Flat' or hasattr(faiss, 'IO_FLAG_MMAP_IFC'):
+                assert loaded.memory_usage() < 0.1 * index.memory_usage()
+            del loaded
+
+
+def test_sharded_index_matches_single_index():
+    """Test sharded fan-out search against one monolithic index"""
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((120, 32)).astype(np.float32)
+    metadata = [{'image_id': f'img_{i // 20}', 'x': i, 'y': 0} for i in range(120)]
+    
+    single = FAISSIndex(embedding_dim=32, index_type='Flat', metric='cosine')
+    single.add(vectors, metadata)
+    
+    sharded = ShardedFAISSIndex(max_workers=2)
+    names = sharded.add_scenes(vectors, metadata, scenes_per_shard=2,
+                               index_type='Flat', metric='cosine')
+    assert len(names) == 3
+    assert sharded.ntotal == 120
+    assert sharded.image_ids() == [f'img_{i}' for i in range(6)]
+    
+    ref_distances, ref_indices = single.search(vectors[:10], k=15)
+    distances, indices = sharded.search(vectors[:10], k=15)
+    assert np.array_equal(indices, ref_indices)  # Scenes are contiguous, so ids line up
+    assert np.allclose(distances, ref_distances, atol=1e-5)
+    
+    results = sharded.search_with_metadata(vectors[:2], k=5)
+    assert results[1][0]['metadata'] == metadata[1]
+    assert [r['score'] for r in results[0]] == sorted((r['score'] for r in results[0]), reverse=True)
+
+
+def test_sharded_index_add_shard_after_save():
+    """Test adding a shard to a saved sharded index"""
+    rng = np.random.default_rng(1)
+    vectors = rng.standard_normal((60, 16)).astype(np.float32)
+    
+    sharded = ShardedFAISSIndex()
+    sharded.create_shard('batch_a', vectors[:30], metric='l2')
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sharded.save(tmpdir)
+        
+        reloaded = load_any_index(tmpdir)
+        assert isinstance(reloaded, ShardedFAISSIndex)
+        reloaded.create_shard('batch_b', vectors[30:], metric='l2')
+        reloaded.save(tmpdir)
+        
+        loaded = ShardedFAISSIndex.load(tmpdir)
+        assert list(loaded.shards) == ['batch_a', 'batch_b']
+        
+        _, indices = loaded.search(vectors[[5, 45]], k=1)
+        assert list(indices[:, 0]) == [5, 45]
+    
+    with pytest.raises(ValueError):
+        sharded.create_shard('batch_a', vectors[:5], metric='l2')
+    with pytest.raises(ValueError):
+        sharded.create_shard('cosine_shard', vectors[:5], metric='cosine')
+
+
+@pytest.mark.parametrize('index_type', ['Flat', 'IVF'])
+def test_faiss_index_replace_scene(index_type):
+    """Test scene removal/replacement with stable ids and compaction"""
+    rng = np.random.default_rng(2)
+    vectors = rng.standard_normal((90, 32)).astype(np.float32)
+    metadata = [{'image_id': f'img_{i // 30}', 'x': i, 'y': 0} for i in range(90)]
+    
+    index = FAISSIndex(embedding_dim=32, index_type=index_type, metric='cosine',
+                       nlist=4, nprobe=4, id_map=True)
+    index.add(vectors, metadata)
+    
+    new_vectors = rng.standard_normal((20, 32)).astype(np.float32)
+    new_metadata = [{'image_id': 'img_1', 'x': 1000 + i, 'y': 0} for i in range(20)]
+    assert index.replace_scene('img_1', new_vectors, new_metadata) == 30
+    assert index.ntotal == 80
+    assert len(index.tombstones) == 30
+    
+    # Untouched scenes keep their ids
+    _, indices = index.search(vectors[[0, 75]], k=1)
+    assert list(indices[:, 0]) == [0, 75]
+    
+    results = index.search_with_metadata(new_vectors[:1], k=1)
+    assert results[0][0]['metadata']['x'] == 1000
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        index.save(tmpdir, 'test_index')
+        loaded = FAISSIndex.load(tmpdir, 'test_index')
+        assert len(loaded.tombstones) == 30
+        assert loaded.image_ids() == ['img_0', 'img_1', 'img_2']
+    
+    assert index.compact() == 30
+    assert len(index.tile_metadata) == 80
+    _, indices = index.search(vectors[[75]], k=1)
+    assert indices[0, 0] == 45
+    assert index.tile_metadata[45]['x'] == 75
+    
+    with pytest.raises(ValueError):
+        index.add_scene('img_0', vectors[:2], metadata[:2])
+
+
+def test_search_result_columnar():
+    """Test columnar search results against the legacy dict format"""
+    from engine.candidate import CandidateRetriever
+    
+    rng = np.random.default_rng(3)
+    vectors = rng.standard_normal((60, 32)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    metadata = [{'image_id': f'img_{i % 3}', 'x': i, 'y': 2 * i, 'width': 8, 'height': 8}
+                for i in range(60)]
+    
+    index = FAISSIndex(embedding_dim=32, index_type='Flat', metric='cosine')
+    index.add(vectors, metadata)
+    
+    result = index.search_with_metadata(vectors[:4], k=10)
+    distances, indices = index.search(vectors[:4], k=10)
+    
+    assert result.scores.shape == (4, 10)
+    assert np.array_equal(result.indices, indices)
+    assert np.array_equal(result.columns['x'], indices)
+    assert result.image_ids[1, 0] == 'img_1'
+    assert list(result.boxes[2, 0]) == [2, 4, 10, 12]
+    
+    # Legacy per-query list of dicts
+    assert result[0][0]['metadata'] == metadata[0]
+    assert [hit['score'] for hit in result[0]] == pytest.approx(distances[0].tolist())
+    
+    # Retriever gives the same detections from columns as from dicts
+    retriever = CandidateRetriever(top_k_per_chip=5, top_k_per_image=100, similarity_threshold=0.1)
+    columnar = retriever.retrieve_candidates(result, 'ship', ['a', 'b', 'c', 'd'])
+    legacy = retriever.retrieve_candidates(list(result), 'ship', ['a', 'b', 'c', 'd'])
+    assert len(columnar) == len(legacy) > 0
+    for det, ref in zip(columnar, legacy):
+        assert (det.x_min, det.y_max, det.target_filename) == (ref.x_min, ref.y_max, ref.target_filename)
+        assert det.score == pytest.approx(ref.score)
+        assert det.metadata == ref.metadata
+
+
+@pytest.mark.parametrize('index_type,id_map', [('Flat', False), ('IVF', False), ('HNSW', False), ('Flat', True)])
+def test_faiss_index_image_filtered_search(index_type, id_map):
+    """Test search restricted to a set of image ids"""
+    rng = np.random.default_rng(4)
+    vectors = rng.standard_normal((200, 32)).astype(np.float32)
+    metadata = [{'image_id': f'img_{i // 50}', 'x': i} for i in range(200)]
+    
+    index = FAISSIndex(embedding_dim=32, index_type=index_type, metric='cosine',
+                       nlist=4, nprobe=4, id_map=id_map)
+    index.add(vectors, metadata)
+    
+    # One scene (contiguous id range)
+    _, indices = index.search(vectors[:5], k=10, image_ids=['img_2'])
+    assert np.all((indices >= 100) & (indices < 150))
+    
+    # Several scenes, including the query's own
+    result = index.search_with_metadata(vectors[[60, 180]], k=10, image_ids=['img_1', 'img_3'])
+    assert set(result.image_ids[result.valid]) <= {'img_1', 'img_3'}
+    assert list(result.indices[:, 0]) == [60, 180]
+    
+    # Unknown scene
+    _, indices = index.search(vectors[:2], k=5, image_ids=['missing'])
+    assert np.all(indices == -1)
+
+
+def test_sharded_index_filtered_search():
+    """Test that filtered sharded search skips shards without the scenes"""
+    rng = np.random.default_rng(5)
+    vectors = rng.standard_normal((120, 16)).astype(np.float32)
+    metadata = [{'image_id': f'img_{i // 20}', 'x': i} for i in range(120)]
+    
+    sharded = ShardedFAISSIndex()
+    sharded.add_scenes(vectors, metadata, scenes_per_shard=2, index_type='Flat', metric='cosine')
+    
+    assert sharded._shards_for(['img_3']) == ['shard_0001']
+    
+    result = sharded.search_with_metadata(vectors[[70, 0]], k=5, image_ids=['img_3'])
+    assert set(result.image_ids[result.valid]) == {'img_3'}
+    assert result.indices[0, 0] == 70
+    
+    _, indices = sharded.search(vectors[:1], k=5, image_ids=['missing'])
+    assert np.all(indices == -1)
+    assert len(sharded.search_with_metadata(vectors[:1], k=5, image_ids=['missing'])[0]) == 0
+    
+    # An index without shards returns empty results of the right shape
+    empty = ShardedFAISSIndex()
+    assert empty.search(vectors[:2], k=5)[1].shape == (2, 5)
+    assert empty.search_with_metadata(vectors[:2], k=5).indices.shape == (2, 5)
+    assert empty.range_search(vectors[:2], 0.5).scores.shape == (2, 0)
+
+
+@pytest.mark.parametrize('metric', ['cosine', 'l2'])
+def test_faiss_index_range_search(metric):
+    """Test threshold range search against thresholded exact k-NN"""
+    rng = np.random.default_rng(6)
+    vectors = rng.standard_normal((300, 16)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    metadata = [{'image_id': f'img_{i // 100}', 'x': i} for i in range(300)]
+    
+    index = FAISSIndex(embedding_dim=16, index_type='Flat', metric=metric)
+    index.add(vectors, metadata)
+    
+    threshold = 0.5
+    exact = index.search_with_metadata(vectors[:5], k=300)
+    result = index.range_search(vectors[:5], threshold, max_results=300)
+    
+    for i in range(5):
+        expected = exact.indices[i][exact.scores[i] >= threshold]
+        assert sorted(result.indices[i][result.valid[i]]) == sorted(expected)
+        scores = result.scores[i][result.valid[i]]
+        assert np.all(np.diff(scores) <= 1e-6)  # Best first
+    
+    capped = index.range_search(vectors[:5], threshold, max_results=3)
+    assert capped.scores.shape[1] <= 3
+    assert np.array_equal(capped.indices[:, 0], np.arange(5))
+    
+    scoped = index.range_search(vectors[[150]], threshold, image_ids=['img_1'])
+    assert set(scoped.image_ids[scoped.valid]) == {'img_1'}
+    
+    # k-NN emulation (used when range search is unavailable) pads to the same width
+    emulated = index._threshold_knn(index._prepare_vectors(vectors[:5]), threshold, 300, None, None, None)
+    assert emulated.scores.shape == result.scores.shape
+    assert all(name in emulated.columns and emulated.columns[name].shape == result.scores.shape
+               for name in result.columns)
+
+
+def test_candidate_retriever_range_mode():
+    """Test CandidateRetriever with range search over plain and sharded indexes"""
+    from engine.candidate import CandidateRetriever
+    
+    rng = np.random.default_rng(7)
+    vectors = rng.standard_normal((200, 16)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    metadata = [{'image_id': f'img_{i // 50}', 'x': i, 'y': 0, 'width': 4, 'height': 4}
+                for i in range(200)]
+    
+    index = FAISSIndex(embedding_dim=16, index_type='Flat', metric='cosine')
+    index.add(vectors, metadata)
+    sharded = ShardedFAISSIndex()
+    sharded.add_scenes(vectors, metadata, scenes_per_shard=1, index_type='Flat', metric='cosine')
+    
+    knn = CandidateRetriever(top_k_per_chip=200, similarity_threshold=0.6)
+    ranged = CandidateRetriever(top_k_per_chip=10, similarity_threshold=0.6,
+                                search_mode='range', max_results_per_chip=200)
+    
+    expected = {(d.x_min, d.metadata['chip_id']) for d in knn.retrieve_candidates(
+        knn.search(index, vectors[:3]), 'ship')}
+    for target in (index, sharded):
+        found = ranged.retrieve_candidates(ranged.search(target, vectors[:3]), 'ship')
+        assert {(d.x_min, d.metadata['chip_id']) for d in found} == expected
+    
+    with pytest.raises(ValueError):
+        CandidateRetriever(search_mode='radius')
+
+
+def test_candidate_retriever_chip_fusion():
+    """Test fusing several chips of a class into one list of distinct tiles"""
+    from engine.candidate import CandidateRetriever
+    
+    rng = np.random.default_rng(12)
+    vectors = rng.standard_normal((300, 16)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    metadata = [{'image_id': f'img_{i // 100}', 'x': i, 'y': 0, 'width': 4, 'height': 4}
+                for i in range(300)]
+    index = FAISSIndex(embedding_dim=16, index_type='Flat', metric='cosine')
+    index.add(vectors, metadata)
+    
+    # Chips are noisy views of the same object
+    chips = vectors[[42]] + 0.3 * rng.standard_normal((5, 16)).astype(np.float32)
+    chips /= np.linalg.norm(chips, axis=1, keepdims=True)
+    per_chip = CandidateRetriever(top_k_per_chip=50, similarity_threshold=0.0).search(index, chips)
+    exact = chips @ vectors.T
+    
+    for fusion in ('mean', 'max', 'rrf'):
+        retriever = CandidateRetriever(top_k_per_chip=50, similarity_threshold=0.0, fusion=fusion)
+        fused = retriever.search(index, chips)
+        
+        assert fused.scores.shape == (1, 50)
+        assert fused.indices[0, 0] == 42
+        assert len(set(fused.indices[0])) == 50
+        assert (np.diff(fused.scores[0]) <= 1e-6).all()
+        assert set(fused.indices[0]) <= set(per_chip.indices.ravel())
+        # Metadata and best similarity follow each tile
+        assert np.array_equal(fused.columns['x'][0], fused.indices[0])
+        assert np.allclose(fused.columns['similarity'][0], exact[:, fused.indices[0]].max(axis=0), atol=1e-5)
+        
+        detections = retriever.retrieve_candidates(fused, 'ship', [f'c{i}' for i in range(5)])
+        assert len({d.x_min for d in detections}) == len(detections)
+        assert {d.metadata['chip_id'] for d in detections} <= {f'c{i}' for i in range(5)}
+    
+    fused = CandidateRetriever(top_k_per_chip=50, fusion='max').search(index, chips)
+    assert np.allclose(fused.scores, fused.columns['similarity'])
+    fused = CandidateRetriever(top_k_per_chip=50, fusion='rrf').search(index, chips)
+    assert fused.scores[0, 0] <= 1.0 and fused.columns['chip_support'][0, 0] == 5
+    
+    # Tiles every chip retrieved: the mean is exact
+    fused = CandidateRetriever(top_k_per_chip=50, fusion='mean').search(index, chips)
+    full = fused.columns['chip_support'][0] == 5
+    assert np.allclose(fused.scores[0][full], exact[:, fused.indices[0][full]].mean(axis=0), atol=1e-5)
+    
+    retriever = CandidateRetriever(top_k_per_chip=20, similarity_threshold=0.0, fusion='prototype')
+    fused = retriever.search(index, chips)
+    assert fused.scores.shape == (1, 20) and fused.indices[0, 0] == 42
+    assert {d.metadata['chip_id'] for d in retriever.retrieve_candidates(fused, 'ship')} == {'prototype'}
+    
+    with pytest.raises(ValueError):
+        CandidateRetriever(fusion='median')
+
+
+def test_faiss_index_tune_nprobe():
+    """Test nprobe tuning against a recall target"""
+    rng = np.random.default_rng(8)
+    vectors = rng.standard_normal((2000, 16)).astype(np.float32)
+    
+    index = FAISSIndex(embedding_dim=16, index_type='IVF', metric='l2', nlist=32, nprobe=1)
+    index.add(vectors)
+    
+    exact = FAISSIndex(embedding_dim=16, index_type='Flat', metric='l2')
+    exact.add(vectors)
+    queries = vectors[:100]
+    _, ground_truth = exact.search(queries, k=10)
+    
+    report = index.tune(queries, ground_truth, target_recall=0.9)
+    assert report['param'] == 'nprobe'
+    assert report['met_target']
+    assert report['recall'] >= 0.9
+    assert index.nprobe == report['value']
+    # Smallest value meeting the target
+    assert all(e['recall'] < 0.9 for e in report['sweep'] if e['nprobe'] < report['value'])
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        index.save(tmpdir, 'tuned')
+        loaded = FAISSIndex.load(tmpdir, 'tuned')
+        assert loaded.nprobe == report['value']
+        assert loaded.tuning['target_recall'] == 0.9
+    
+    with pytest.raises(ValueError):
+        exact.tune(queries, ground_truth)
+    
+    # Queries drawn from the index: the self-match is dropped on both sides
+    _, with_self = exact.search(queries, k=11)
+    ground_truth = drop_query_ids(with_self, np.arange(100), 10)
+    assert not (ground_truth == np.arange(100)[:, None]).any()
+    report = index.tune(queries, ground_truth, target_recall=0.9, exclude_ids=np.arange(100))
+    assert not report['held_out']
+    assert report['recall'] >= 0.9
+
+
+def test_choose_nlist():
+    """Test nlist selection from corpus size"""
+    assert choose_nlist(1_000_000) == 4096
+    assert choose_nlist(10_000) == 256
+    assert choose_nlist(1000) == 25  # Capped by ~39 training points per centroid
+    assert choose_nlist(10) == 1
+
+
+def test_reservoir_sampler_uniform():
+    """Test reservoir sample is uniform over the whole stream"""
+    sampler = ReservoirSampler(capacity=500, dim=1, seed=0)
+    stream = np.arange(10000, dtype=np.float32)[:, None]
+    for start in range(0, len(stream), 700):
+        sampler.update(stream[start:start + 700])
+    
+    sample = sampler.result()[:, 0]
+    assert len(sample) == 500
+    assert len(np.unique(sample)) == 500
+    # Early and late parts of the stream are equally represented
+    assert abs(np.mean(sample < 5000) - 0.5) < 0.1
+
+
+def test_build_index_streaming():
+    """Test two-phase build from a scene embedding cache"""
+    rng = np.random.default_rng(9)
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache = EmbeddingCache(tmpdir)
+        all_vectors = []
+        for scene in range(4):
+            vectors = rng.standard_normal((300, 16)).astype(np.float32)
+            metadata = [{'image_id': f'img_{scene}', 'x': np.int64(i)} for i in range(300)]
+            cache.save_scene(f'img_{scene}', vectors, metadata)
+            all_vectors.append(vectors)
+        
+        assert cache.scenes() == ['img_0', 'img_1', 'img_2', 'img_3']
+        assert 'img_2' in cache
+        
+        index = build_index_streaming(cache, chunk_size=128, train_size=1000,
+                                      index_type='IVF', metric='l2', nprobe=64)
+    
+    assert index.nlist == choose_nlist(1200)
+    assert index.ntotal == 1200
+    assert index.image_ids() == ['img_0', 'img_1', 'img_2', 'img_3']
+    
+    _, indices = index.search(all_vectors[2][:5], k=1)
+    assert list(indices[:, 0]) == [600, 601, 602, 603, 604]
+    assert index.tile_metadata[601] == {'image_id': 'img_2', 'x': 1}
+
+
+def test_embedding_cache_provenance_and_scene_subset():
+    """Test the cache refuses another pipeline's embeddings and builds from chosen scenes"""
+    from engine.index_format import IndexCompatibilityError
+    
+    rng = np.random.default_rng(10)
+    provenance = {'embedder': {'checkpoint_sha256': 'abc', 'precision': 'fp32'},
+                  'tiler': {'tile_size': 256, 'stride': 128, 'scales': [1.0]}}
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache = EmbeddingCache(tmpdir, provenance=provenance)
+        for scene in range(3):
+            cache.save_scene(f'img_{scene}', rng.standard_normal((50, 8)).astype(np.float32),
+                             [{'image_id': f'img_{scene}', 'x': i} for i in range(50)])
+        assert cache.scenes() == ['img_0', 'img_1', 'img_2']
+        
+        EmbeddingCache(tmpdir, provenance=provenance)
+        changed = {'embedder': {'checkpoint_sha256': 'abc', 'precision': 'fp32'},
+                   'tiler': {'tile_size': 256, 'stride': 64, 'scales': [1.0]}}
+        with pytest.raises(IndexCompatibilityError, match='tiler.stride'):
+            EmbeddingCache(tmpdir, provenance=changed)
+        
+        index = build_index_streaming(cache, scenes=['img_2', 'img_0'], index_type='Flat', metric='l2')
+        assert index.ntotal == 100
+        assert index.image_ids() == ['img_2', 'img_0']
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        EmbeddingCache(tmpdir).save_scene('img_0', np.zeros((1, 8), dtype=np.float32), [{'x': 0}])
+        with pytest.raises(IndexCompatibilityError):
+            EmbeddingCache(tmpdir, provenance=provenance)
+
+
+def test_faiss_index_manifest_checksums_and_compatibility():
+    """Test versioned manifest, checksum verification and compatibility check"""
+    import json
+    import pickle
+    from engine.index_format import IndexFormatError, IndexCompatibilityError, build_provenance
+    
+    config = {
+        'embedder': {'architecture': 'resnet18', 'embedding_dim': 16, 'input_channels': 4,
+                     'normalize_embeddings': True},
+        'tiler': {'tile_size': 256, 'stride': 128, 'scales': [1.0]},
+        'preprocessing': {'normalization': 'percentile'},
+    }
+    
+    index = FAISSIndex(embedding_dim=16, index_type='Flat', metric='cosine')
+    index.add(np.random.randn(20, 16).astype(np.float32),
+              [{'image_id': 'img_0', 'x': i} for i in range(20)])
+    index.provenance = build_provenance(config)
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        index.save(tmpdir, 'test_index')
+        assert not (Path(tmpdir) / 'test_index_metadata.pkl').exists()
+        
+        manifest = json.loads((Path(tmpdir) / 'test_index_manifest.json').read_text())
+        assert manifest['format_version'] == 2
+        assert 'test_index.index' in manifest['files']
+        assert 'test_index_columns/image_id.npy' in manifest['files']
+        
+        loaded = FAISSIndex.load(tmpdir, 'test_index')
+        loaded.check_compatibility(build_provenance(config))
+        
+        other = dict(config, tiler={'tile_size': 128})
+        with pytest.raises(IndexCompatibilityError, match='tile_size'):
+            loaded.check_compatibility(build_provenance(other))
+        
+        # Same-size modification: only full verification hashes the files
+        column = Path(tmpdir) / 'test_index_columns' / 'x.npy'
+        data = bytearray(column.read_bytes())
+        data[-1] ^= 0xFF
+        column.write_bytes(bytes(data))
+        FAISSIndex.load(tmpdir, 'test_index', mmap=True)
+        with pytest.raises(IndexFormatError, match='Checksum'):
+            FAISSIndex.load(tmpdir, 'test_index', verify='full')
+        
+        # Truncated or extended files fail the default size check
+        with open(column, 'ab') as f:
+            f.write(b'\0')
+        with pytest.raises(IndexFormatError, match='Size'):
+            FAISSIndex.load(tmpdir, 'test_index')
+        FAISSIndex.load(tmpdir, 'test_index', verify=False)
+        with pytest.raises(ValueError):
+            FAISSIndex.load(tmpdir, 'test_index', verify='quick')
+    
+    # Legacy pickle format only with explicit opt-in
+    with tempfile.TemporaryDirectory() as tmpdir:
+        index.save(tmpdir, 'legacy')
+        params = json.loads((Path(tmpdir) / 'legacy_manifest.json').read_text())['params']
+        (Path(tmpdir) / 'legacy_manifest.json').unlink()
+        with open(Path(tmpdir) / 'legacy_metadata.pkl', 'wb') as f:
+            pickle.dump(params, f)
+        
+        with pytest.raises(IndexFormatError):
+            FAISSIndex.load(tmpdir, 'legacy')
+        assert FAISSIndex.load(tmpdir, 'legacy', allow_pickle=True).ntotal == 20
+
+
+def test_scene_index_coarse_to_fine():
+    """Test scene ranking, budgeted tile search and recall against full search"""
+    from engine.candidate import CandidateRetriever
+    
+    rng = np.random.default_rng(0)
+    centres = rng.standard_normal((10, 32)).astype(np.float32)
+    vectors = np.vstack([c + 0.3 * rng.standard_normal((50, 32)) for c in centres]).astype(np.float32)
+    metadata = [{'image_id': f'img_{i // 50}', 'x': i} for i in range(len(vectors))]
+    
+    index = FAISSIndex(embedding_dim=32, index_type='Flat', metric='cosine')
+    index.add(vectors, metadata)
+    
+    scene_index = SceneIndex(prototypes_per_scene=3)
+    scene_index.add_scenes(vectors, metadata)
+    assert len(scene_index) == 10
+    assert len(scene_index.prototypes) == 30
+    
+    queries = vectors[[160, 170]]  # Tiles of img_3
+    assert scene_index.select_scenes(queries, 1) == ['img_3']
+    assert scene_index.select_scenes(queries, 2, image_ids=['img_5', 'img_7'])[0] in ('img_5', 'img_7')
+    
+    # Coarse-to-fine search only returns tiles of the selected scenes
+    retriever = CandidateRetriever(top_k_per_chip=10, similarity_threshold=0.0, scene_budget=2)
+    result = retriever.search(index, queries, scene_index=scene_index)
+    assert set(result.image_ids[result.valid]) <= set(scene_index.select_scenes(queries, 2))
+    
+    report = scene_index.evaluate(index, vectors[::25], 10, [1, 10], batch_size=1)
+    assert [entry['scene_budget'] for entry in report] == [None, 1, 10]
+    assert report[1]['recall'] > 0.9
+    assert report[2]['recall'] == pytest.approx(1.0)
+    
+    # Served batches share one scene set: queries from 10 scenes cannot all fit in 1
+    batched = scene_index.evaluate(index, vectors[::25], 10, [1, 10])
+    assert batched[1]['recall'] < 0.2
+    assert batched[2]['recall'] == pytest.approx(1.0)
+    
+    # Adding scene by scene gives the same prototypes as one batched add
+    single = SceneIndex(prototypes_per_scene=3)
+    for scene in range(10):
+        single.add_scene(f'img_{scene}', vectors[50 * scene:50 * (scene + 1)])
+    assert np.array_equal(single.scene_ids, scene_index.scene_ids)
+    np.testing.assert_allclose(single.prototypes, scene_index.prototypes)
+    
+    # Replacing a scene keeps one set of prototypes per scene
+    scene_index.add_scene('img_3', vectors[:50])
+    assert len(scene_index.prototypes) == 30
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        scene_index.save(tmpdir)
+        loaded = SceneIndex.load(tmpdir)
+        assert loaded.scenes == scene_index.scenes
+        np.testing.assert_allclose(loaded.scene_scores(queries), scene_index.scene_scores(queries))
+
+
+def test_sharded_index_per_scale_routing():
+    """Test per-scale shards and routing queries to their scales"""
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((300, 16)).astype(np.float32)
+    scales = [1.0, 0.75, 1.33]
+    metadata = [{'image_id': f'img_{i % 5}', 'scale': scales[i % 3], 'x': i} for i in range(300)]
+    
+    single = FAISSIndex(embedding_dim=16, index_type='Flat', metric='cosine')
+    single.add(vectors, metadata)
+    
+    sharded = ShardedFAISSIndex()
+    names = sharded.add_scales(vectors, metadata, index_type='Flat', metric='cosine')
+    assert len(names) == 3
+    assert sorted(sharded.shard_scales.values()) == sorted(scales)
+    
+    queries = vectors[:3]
+    
+    # Unrouted search covers every scale
+    ref = single.search_with_metadata(queries, k=10)
+    full = sharded.search_with_metadata(queries, k=10)
+    np.testing.assert_allclose(full.scores, ref.scores, rtol=1e-5)
+    
+    # Routed queries only see tiles of their scales
+    query_scales = [[1.0], [0.75, 1.33], [1.33]]
+    for routed in (sharded.search_with_metadata(queries, k=10, query_scales=query_scales),
+                   sharded.range_search(queries, 0.0, 50, query_scales=query_scales)):
+        for i, allowed in enumerate(query_scales):
+            hits = routed.columns['scale'][i][routed.valid[i]]
+            assert len(hits) > 0
+            assert np.isin(hits, allowed).all()
+    
+    _, indices = sharded.search(queries, k=10, query_scales=query_scales)
+    assert (indices >= 0).all()
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sharded.save(tmpdir)
+        loaded = ShardedFAISSIndex.load(tmpdir)
+        assert loaded.shard_scales == sharded.shard_scales
+
+
+@pytest.mark.parametrize('metric', ['cosine', 'l2'])
+def test_faiss_index_binary_prefilter(metric, monkeypatch):
+    """Test Hamming prefilter with exact re-ranking against exact search"""
+    rng = np.random.default_rng(0)
+    centres = rng.standard_normal((20, 64))
+    vectors = (centres[rng.integers(0, 20, 2000)] + 0.5 * rng.standard_normal((2000, 64))).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = vectors[:20]
+    
+    exact = FAISSIndex(embedding_dim=64, index_type='Flat', metric=metric)
+    exact.add(vectors)
+    ref_distances, ref_indices = exact.search(queries, 10)
+    
+    index = FAISSIndex(embedding_dim=64, index_type='Flat', metric=metric,
+                       binary_prefilter=True, binary_bits=128, binary_k_factor=20)
+    index.add(vectors)
+    assert index.binary_index.ntotal == 2000
+    assert index.binary_index.code_size == 16
+    
+    distances, indices = index.search(queries, 10)
+    assert recall_at_k(ref_indices, indices) > 0.9
+    
+    # Re-ranked distances are exact for the neighbours found
+    found = indices[:, 0] == ref_indices[:, 0]
+    np.testing.assert_allclose(distances[found, 0], ref_distances[found, 0], rtol=1e-4, atol=1e-5)
+    
+    # Re-ranking in small query chunks gives the same result
+    monkeypatch.setattr('engine.index_faiss.RERANK_CHUNK_BYTES', 3 * 4 * 200 * 64)
+    chunked_distances, chunked_indices = index.search(queries, 10)
+    np.testing.assert_array_equal(chunked_indices, indices)
+    np.testing.assert_allclose(chunked_distances, distances)
+    
+    # Range search goes through the prefilter too
+    threshold = 0.5
+    result = index.range_search(queries, threshold, max_results=50)
+    knn = index.search_with_metadata(queries, 10)
+    assert (result.scores[result.valid] >= threshold).all()
+    assert set(knn.indices[knn.scores >= threshold]) <= set(result.indices[result.valid])
+    
+    # ... padded to the largest hit count like the Flat range search, not max_results
+    wide = index.range_search(queries, threshold, max_results=1000)
+    assert wide.scores.shape == exact.range_search(queries, threshold, max_results=1000).scores.shape
+    assert wide.scores.shape[1] < 1000
+    
+    # Fewer vectors than k: padded with -1
+    small = FAISSIndex(embedding_dim=64, metric=metric, binary_prefilter=True)
+    small.add(vectors[:3])
+    _, padded = small.search(queries[:2], 5)
+    assert (padded[:, 3:] == -1).all() and (padded[:, :3] >= 0).all()
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        index.save(tmpdir, 'test_index')
+        loaded = FAISSIndex.load(tmpdir, 'test_index')
+        np.testing.assert_array_equal(loaded.search(queries, 10)[1], indices)
+    
+    with pytest.raises(ValueError):
+        FAISSIndex(embedding_dim=64, index_type='IVF', binary_prefilter=True)
+
+
+def test_candidate_retriever_batch_matches_list_pipeline():
+    """Test array-based thresholding and top-K per image against the list pipeline"""
+    from engine.candidate import CandidateRetriever, DetectionBatch
+    
+    rng = np.random.default_rng(13)
+    vectors = rng.standard_normal((400, 16)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    metadata = [{'image_id': f'img_{i % 7}', 'x': i, 'y': 2 * i, 'width': 8, 'height': 8}
+                for i in range(400)]
+    index = FAISSIndex(embedding_dim=16, index_type='Flat', metric='cosine')
+    index.add(vectors, metadata)
+    
+    retriever = CandidateRetriever(top_k_per_chip=100, top_k_per_image=6, similarity_threshold=0.1)
+    result = retriever.search(index, vectors[:5])
+    chip_names = [f'chip_{c}' for c in 'abcde']
+    
+    batch = retriever.process_batch(result, 'ship', chip_names)
+    assert isinstance(batch, DetectionBatch)
+    assert batch.boxes.shape == (len(batch), 4)
+    assert np.bincount(np.unique(batch.image_ids, return_inverse=True)[1]).max() <= 6
+    
+    detections, grouped = retriever.process(result, 'ship', chip_names)
+    legacy, legacy_grouped = retriever.process(list(result), 'ship', chip_names)
+    assert list(grouped) == list(legacy_grouped)
+    assert [(d.x_min, d.target_filename, d.metadata) for d in detections] == \
+        [(d.x_min, d.target_filename, d.metadata) for d in legacy]
+    assert [d.score for d in detections] == pytest.approx([d.score for d in legacy])
+    
+    strict = CandidateRetriever(similarity_threshold=2.0)
+    assert len(strict.process_batch(result, 'ship')) == 0
+    assert strict.process(result, 'ship') == ([], {})
@@ -0,0 +1,179 @@
+"""
+Unit tests for hot index reload in the API
+"""
+
+import pytest
+import threading
+import numpy as np
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from api.index_manager import IndexManager, IndexRegistry, LoadedIndex
+from engine.index_faiss import FAISSIndex
+
+
+def _make_index(n: int, seed: int) -> FAISSIndex:
+    vectors = np.random.default_rng(seed).standard_normal((n, 8)).astype(np.float32)
+    index = FAISSIndex(embedding_dim=8, index_type='Flat', metric='cosine')
+    index.add(vectors, [{'image_id': f'img_{seed}'} for _ in range(n)])
+    return index
+
+
+def _loader(indexes: dict, gate: threading.Event = None):
+    """Load function serving prebuilt indexes by 'directory' name"""
+    def load(directory):
+        if gate is not None:
+            gate.wait(5)
+        if directory not in indexes:
+            raise FileNotFoundError(directory)
+        return LoadedIndex(indexes[directory])
+    return load
+
+
+def test_load_swaps_in_background():
+    """Test loads run off the caller thread and bump the generation"""
+    gate = threading.Event()
+    manager = IndexManager(_loader({'a': _make_index(20, 0)}, gate), warmup_queries=4)
+
+    try:
+        future = manager.load('a')
+        assert manager.current is None
+        assert manager.status()['loading']
+
+        gate.set()
+        loaded = future.result(timeout=5)
+        assert manager.current is loaded
+        assert loaded.generation == 1
+        assert manager.status() == {
+            'loading': False, 'generation': 1, 'directory': 'a', 'in_flight': 0, 'retiring': 0
+        }
+    finally:
+        manager.shutdown()
+
+
+def test_old_index_released_after_in_flight_search():
+    """Test a retired index stays usable until its last search finishes"""
+    manager = IndexManager(_loader({'a': _make_index(20, 0), 'b': _make_index(30, 1)}))
+
+    try:
+        first = manager.load('a').result(timeout=5)
+
+        with manager.acquire() as held:
+            assert held is first
+            second = manager.load('b').result(timeout=5)
+
+            # New searches see the new index; the held one is retired but alive
+            assert manager.current is second
+            assert first.retired and not first.released.is_set()
+            assert manager.status()['retiring'] == 1
+            _, indices = held.index.search(np.ones((1, 8), dtype=np.float32), 5)
+            assert (indices >= 0).all()
+
+        assert first.released.is_set()
+        assert first.index is None
+        assert manager.status()['retiring'] == 0
+
+        # Swapping with no searches in flight releases immediately
+        manager.load('a').result(timeout=5)
+        assert second.released.is_set()
+    finally:
+        manager.shutdown()
+
+
+def test_failed_load_keeps_current_index():
+    """Test a failing load leaves the served index in place"""
+    manager = IndexManager(_loader({'a': _make_index(20, 0)}))
+
+    try:
+        with pytest.raises(LookupError):
+            with manager.acquire():
+                pass
+
+        loaded = manager.load('a').result(timeout=5)
+        with pytest.raises(FileNotFoundError):
+            manager.load('missing').result(timeout=5)
+
+        assert manager.current is loaded
+        assert not loaded.retired
+    finally:
+        manager.shutdown()
+
+
+def test_registry_lru_eviction_under_budget():
+    """Test least recently searched indexes are unloaded to fit the budget"""
+    indexes = {name: _make_index(100, seed) for seed, name in enumerate('abc')}
+    size = indexes['a'].memory_usage()
+    registry = IndexRegistry(_loader(indexes), memory_budget_bytes=int(2.5 * size))
+
+    try:
+        registry.load('a', 'a').result(timeout=5)
+        registry.load('b', 'b').result(timeout=5)
+        assert registry.memory_usage() == 2 * size
+
+        # Searching 'a' makes 'b' the least recently used
+        with registry.acquire(['a']) as held:
+            assert list(held) == ['a']
+
+        registry.load('c', 'c').result(timeout=5)
+        assert sorted(registry.names()) == ['a', 'c']
+        assert [entry['name'] for entry in registry.describe()] == ['a', 'c']
+        assert all(entry['memory_bytes'] == size for entry in registry.describe())
+
+        with pytest.raises(KeyError):
+            with registry.acquire(['b']):
+                pass
+    finally:
+        registry.shutdown()
+
+
+def test_registry_load_completes_when_eviction_fails(monkeypatch):
+    """Test a failed eviction resolves the load future instead of hanging it"""
+    indexes = {name: _make_index(100, seed) for seed, name in enumerate('ab')}
+    registry = IndexRegistry(_loader(indexes), memory_budget_bytes=indexes['a'].memory_usage())
+
+    try:
+        registry.load('a', 'a').result(timeout=5)
+
+        # Victim unloaded concurrently (e.g. by /unload_index): eviction skips it
+        registry.unload('a')
+        assert not registry._drop('a')
+
+        def evict(keep):
+            raise RuntimeError('eviction failed')
+
+        monkeypatch.setattr(registry, '_evict', evict)
+        with pytest.raises(RuntimeError):
+            registry.load('b', 'b').result(timeout=5)
+    finally:
+        registry.shutdown()
+
+
+def test_registry_search_merges_indexes():
+    """Test searching several named indexes and merging results"""
+    from engine.candidate import CandidateRetriever
+
+    registry = IndexRegistry(_loader({'a': _make_index(20, 0), 'b': _make_index(20, 1)}))
+    retriever = CandidateRetriever(top_k_per_chip=10, similarity_threshold=-1.0)
+    queries = np.random.default_rng(2).standard_normal((3, 8)).astype(np.float32)
+
+    try:
+        registry.load('a', 'a').result(timeout=5)
+        registry.load('b', 'b').result(timeout=5)
+
+        with registry.acquire() as held:
+            assert sorted(held) == ['a', 'b']
+            merged = retriever.merge({name: retriever.search(loaded.index, queries) for name, loaded in held.items()})
+
+        assert merged.scores.shape == (3, 10)
+        assert (np.diff(merged.scores, axis=1) <= 0).all()
+        assert set(merged.columns['index_name'].ravel()) == {'a', 'b'}
+        assert set(merged.image_ids.ravel()) == {'img_0', 'img_1'}
+
+        registry.unload('a')
+        assert registry.names() == ['b']
+        with pytest.raises(KeyError):
+            registry.unload('a')
+    finally:
+        registry.shutdown()
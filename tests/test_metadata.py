@@ -0,0 +1,100 @@
+"""
+Unit tests for columnar tile metadata
+"""
+
+import pytest
+import numpy as np
+import tempfile
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from engine.metadata import TileMetadata
+
+
+def _records(n, image_id='scene_a', start=0):
+    return [
+        {'image_id': image_id, 'x': start + i, 'y': 2 * i, 'width': 512, 'height': 512, 'scale': 1.33}
+        for i in range(n)
+    ]
+
+
+def test_round_trip_records():
+    """Test dict records come back unchanged"""
+    records = _records(3) + _records(2, image_id='scene_b')
+    metadata = TileMetadata.from_records(records)
+    
+    assert len(metadata) == 5
+    assert list(metadata) == records
+    assert metadata[-1] == records[-1]
+    assert metadata.fields == ['image_id', 'x', 'y', 'width', 'height', 'scale']
+
+
+def test_columns_are_compact():
+    """Test strings are dictionary-encoded and ints downcast"""
+    metadata = TileMetadata.from_records(_records(4) + _records(4, image_id='scene_b'))
+    
+    assert metadata.codes('image_id').dtype == np.int32
+    assert list(metadata.categories('image_id')) == ['scene_a', 'scene_b']
+    assert metadata.column('x').dtype == np.int32
+    assert metadata.unique('image_id') == ['scene_a', 'scene_b']
+
+
+def test_incremental_extend():
+    """Test appending batches keeps codes consistent"""
+    metadata = TileMetadata()
+    metadata.extend(_records(2, image_id='scene_b'))
+    assert len(metadata) == 2
+    metadata.extend(_records(2, image_id='scene_a', start=10))
+    metadata.append({'image_id': 'scene_b', 'x': 99, 'y': 0, 'width': 1, 'height': 1, 'scale': 1.0})
+    
+    assert len(metadata) == 5
+    assert list(metadata.column('image_id')) == ['scene_b', 'scene_b', 'scene_a', 'scene_a', 'scene_b']
+    assert metadata[4]['x'] == 99
+
+
+def test_mismatched_fields_rejected():
+    """Test records with different fields raise"""
+    metadata = TileMetadata.from_records([{'id': 1}])
+    metadata.append({'other': 2})
+    
+    with pytest.raises(ValueError):
+        metadata.fields
+
+
+def test_bad_batch_leaves_store_consistent():
+    """Test a rejected batch neither drops records nor misaligns columns"""
+    metadata = TileMetadata.from_records(_records(3))
+    metadata.fields
+    
+    # 'scale' fails after image_id, x, ... have been converted
+    bad = _records(2, image_id='scene_new')
+    bad[1]['scale'] = 'large'
+    metadata.extend(bad)
+    
+    for _ in range(2):
+        with pytest.raises(TypeError):
+            metadata.column('x')
+    
+    assert len(metadata) == 5
+    assert {len(metadata._columns[name]) for name in metadata._columns} == {3}
+    assert list(metadata._categories['image_id']) == ['scene_a']
+
+
+def test_save_load_mmap():
+    """Test columnar save and memory-mapped load"""
+    records = _records(10) + _records(5, image_id='scene_b')
+    metadata = TileMetadata.from_records(records)
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        metadata.save(tmpdir)
+        loaded = TileMetadata.load(tmpdir, mmap=True)
+        
+        assert isinstance(loaded.codes('image_id'), np.memmap)
+        assert list(loaded) == records
+        
+        # Appending to a mapped store copies into memory
+        loaded.extend(_records(1, image_id='scene_c'))
+        assert loaded[15]['image_id'] == 'scene_c'
+        del loaded
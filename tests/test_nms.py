@@ -0,0 +1,241 @@
+"""
+Unit tests for DetectionBatch, NMS and the submission writer
+"""
+
+import pytest
+import numpy as np
+import tempfile
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from engine.candidate import Detection, DetectionBatch, cluster_detections, compute_iou, merge_cluster
+from engine.nms import apply_nms_per_image, box_iou, filter_by_area, hard_nms, merge_detections, soft_nms
+from engine.spatial import BoxGrid
+from engine.writer import read_submission_file, write_detections_summary, write_submission_file
+
+
+def _detections(n, seed=0, images=('scene_a', 'scene_b')):
+    rng = np.random.default_rng(seed)
+    xy = rng.integers(0, 200, (n, 2))
+    size = rng.integers(20, 60, (n, 2))
+    scores = rng.uniform(0.2, 1.0, n)
+    return [
+        Detection(
+            x_min=int(x), y_min=int(y), x_max=int(x + w), y_max=int(y + h),
+            score=float(score), class_name='ship', target_filename=images[i % len(images)],
+            metadata={'chip_id': f'chip_{i % 3}', 'scale': 1.0}
+        )
+        for i, ((x, y), (w, h), score) in enumerate(zip(xy, size, scores))
+    ]
+
+
+def _reference_soft_nms(detections, score_threshold, sigma):
+    """Pairwise gaussian soft NMS over Python objects"""
+    scores = [d.score for d in detections]
+    order = sorted(range(len(detections)), key=lambda i: scores[i], reverse=True)
+    keep = []
+    for pos, i in enumerate(order):
+        if scores[i] < score_threshold:
+            continue
+        keep.append((i, scores[i]))
+        box = (detections[i].x_min, detections[i].y_min, detections[i].x_max, detections[i].y_max)
+        for j in order[pos + 1:]:
+            other = (detections[j].x_min, detections[j].y_min, detections[j].x_max, detections[j].y_max)
+            scores[j] *= np.exp(-(compute_iou(box, other) ** 2) / sigma)
+    return keep
+
+
+def _reference_clusters(detections, iou_threshold):
+    """Pairwise greedy clustering over Python objects"""
+    order = sorted(range(len(detections)), key=lambda i: detections[i].score, reverse=True)
+    used = set()
+    clusters = []
+    for pos, i in enumerate(order):
+        if i in used:
+            continue
+        cluster = [i]
+        used.add(i)
+        box = (detections[i].x_min, detections[i].y_min, detections[i].x_max, detections[i].y_max)
+        for j in order[pos + 1:]:
+            other = (detections[j].x_min, detections[j].y_min, detections[j].x_max, detections[j].y_max)
+            if j not in used and compute_iou(box, other) >= iou_threshold:
+                cluster.append(j)
+                used.add(j)
+        clusters.append(cluster)
+    return clusters
+
+
+def test_detection_batch_round_trip():
+    """Test conversion between Detection objects and arrays"""
+    detections = _detections(10)
+    batch = DetectionBatch.from_detections(detections)
+    
+    assert batch.boxes.dtype == np.int32 and batch.boxes.shape == (10, 4)
+    assert batch.class_names == ['ship'] and (batch.class_ids == 0).all()
+    assert list(batch.chip_ids[:3]) == ['chip_0', 'chip_1', 'chip_2']
+    assert batch.to_detections() == detections
+    
+    other = DetectionBatch.from_detections([
+        Detection(0, 0, 5, 5, 0.9, 'plane', 'scene_c', {'chip_id': 'p'}),
+        Detection(1, 1, 6, 6, 0.8, 'ship', 'scene_c', {'chip_id': 's'}),
+    ])
+    merged = DetectionBatch.concatenate([batch, other])
+    assert merged.class_names == ['ship', 'plane']
+    assert list(merged.class_labels[-2:]) == ['plane', 'ship']
+    assert [len(rows) for rows in merged.groups(by_class=True)] == [5, 5, 1, 1]
+    assert len(DetectionBatch.from_detections([])) == 0
+
+
+def test_box_iou_matches_compute_iou():
+    """Test vectorized IoU against the scalar version"""
+    boxes = DetectionBatch.from_detections(_detections(30, seed=1)).boxes
+    
+    expected = [compute_iou(tuple(boxes[0]), tuple(box)) for box in boxes]
+    assert np.allclose(box_iou(boxes[0], boxes), expected)
+    assert box_iou(boxes[0], boxes[:0]).shape == (0,)
+
+
+def test_nms_lists_and_batches_agree():
+    """Test soft and hard NMS give the same result on lists and batches"""
+    detections = _detections(60, seed=2, images=('scene_a',))
+    batch = DetectionBatch.from_detections(detections)
+    
+    kept = soft_nms(detections, score_threshold=0.3, sigma=0.5)
+    reference = _reference_soft_nms(detections, 0.3, 0.5)
+    assert [d.x_min for d in kept] == [detections[i].x_min for i, _ in reference]
+    assert [d.score for d in kept] == pytest.approx([score for _, score in reference])
+    assert [d.score for d in detections] == [d.score for d in _detections(60, seed=2, images=('scene_a',))]
+    
+    kept_batch = soft_nms(batch, score_threshold=0.3, sigma=0.5)
+    assert isinstance(kept_batch, DetectionBatch)
+    assert kept_batch.to_detections() == kept
+    
+    hard = hard_nms(detections, iou_threshold=0.3, score_threshold=0.3)
+    assert hard_nms(batch, iou_threshold=0.3, score_threshold=0.3).to_detections() == hard
+    for i, det in enumerate(hard):
+        for other in hard[i + 1:]:
+            box = (det.x_min, det.y_min, det.x_max, det.y_max)
+            assert compute_iou(box, (other.x_min, other.y_min, other.x_max, other.y_max)) <= 0.3
+
+
+def test_apply_nms_per_image_batch():
+    """Test per-image NMS on a batch matches the dict of lists"""
+    detections = _detections(80, seed=3)
+    grouped = {}
+    for det in detections:
+        grouped.setdefault(det.target_filename, []).append(det)
+    
+    for method in ('soft', 'hard'):
+        expected = apply_nms_per_image(grouped, method=method, iou_threshold=0.3)
+        kept = apply_nms_per_image(DetectionBatch.from_detections(detections), method=method, iou_threshold=0.3)
+        assert kept.to_detections() == [d for dets in expected.values() for d in dets]
+    
+    with pytest.raises(ValueError):
+        apply_nms_per_image(DetectionBatch.from_detections(detections), method='fast')
+    
+    assert len(filter_by_area(DetectionBatch.from_detections(detections), min_area=2000)) == \
+        len(filter_by_area(detections, min_area=2000))
+
+
+def test_writer_accepts_batches():
+    """Test batches and lists write the same submission file"""
+    detections = _detections(20, seed=4)
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        write_submission_file(detections, f"{tmpdir}/list.txt")
+        write_submission_file(DetectionBatch.from_detections(detections), f"{tmpdir}/batch.txt")
+        assert Path(f"{tmpdir}/list.txt").read_text() == Path(f"{tmpdir}/batch.txt").read_text()
+        
+        lines = Path(f"{tmpdir}/batch.txt").read_text().splitlines()
+        names = [line.split()[5] for line in lines]
+        assert names == sorted(names)
+        assert len(read_submission_file(f"{tmpdir}/batch.txt")) == 20
+        
+        write_detections_summary(DetectionBatch.from_detections(detections), f"{tmpdir}/summary.txt")
+        summary = Path(f"{tmpdir}/summary.txt").read_text()
+        assert "Total detections: 20" in summary
+        assert "ship: 20" in summary
+
+
+def test_list_valued_metadata():
+    """Test ragged metadata packs into object columns and does not block writing"""
+    detections = [
+        Detection(0, 0, 10, 10, 0.9, 'ship', 'scene_a', {'chip_id': 'a', 'tags': [1, 2]}),
+        Detection(5, 5, 15, 15, 0.8, 'ship', 'scene_b', {'chip_id': 'b', 'tags': [1]}),
+    ]
+    
+    batch = DetectionBatch.from_detections(detections)
+    assert batch.columns['tags'].dtype == object
+    assert batch.to_detections() == detections
+    assert DetectionBatch.from_detections(detections, columns=False).columns == {}
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        write_submission_file(detections, f"{tmpdir}/submission.txt")
+        assert len(read_submission_file(f"{tmpdir}/submission.txt")) == 2
+
+
+def test_box_grid_finds_all_overlaps():
+    """Test grid candidate pairs cover every overlapping pair"""
+    rng = np.random.default_rng(5)
+    xy = rng.integers(-500, 2000, (300, 2))
+    size = rng.integers(1, 80, (300, 2))
+    size[:5] = 900  # A few boxes spanning many cells
+    boxes = np.hstack([xy, xy + size])
+    
+    grid = BoxGrid(boxes)
+    first, second = grid.candidate_pairs()
+    assert (first < second).all()
+    assert len(set(zip(first.tolist(), second.tolist()))) == len(first)
+    
+    iou = np.array([[compute_iou(tuple(a), tuple(b)) for b in boxes] for a in boxes])
+    expected = {(i, j) for i, j in zip(*np.nonzero(np.triu(iou, 1) > 0))}
+    assert expected <= set(zip(first.tolist(), second.tolist()))
+    assert len(first) < len(boxes) * (len(boxes) - 1) // 2
+    
+    first, second, pair_iou = grid.overlapping_pairs(0.3)
+    assert set(zip(first.tolist(), second.tolist())) == {(i, j) for i, j in expected if iou[i, j] >= 0.3}
+    assert np.allclose(pair_iou, iou[first, second])
+    assert len(BoxGrid(np.empty((0, 4))).candidate_pairs()[0]) == 0
+
+
+@pytest.mark.parametrize('iou_threshold', [0.0, 0.2, 0.5])
+def test_cluster_detections_matches_pairwise(iou_threshold):
+    """Test grid-based clustering gives the pairwise greedy clusters"""
+    detections = _detections(150, seed=6, images=('scene_a',))
+    detections += [Detection(d.x_min, d.y_min, d.x_max, d.y_max, d.score / 2, 'ship', 'scene_a')
+                   for d in detections[:10]]
+    
+    clusters = cluster_detections(detections, iou_threshold)
+    expected = _reference_clusters(detections, iou_threshold)
+    assert [[id(d) for d in cluster] for cluster in clusters] == \
+        [[id(detections[i]) for i in cluster] for cluster in expected]
+    assert cluster_detections([], iou_threshold) == []
+
+
+def test_merge_detections_weighted():
+    """Test score-weighted merging on lists and batches"""
+    cluster = [
+        Detection(0, 0, 10, 10, 0.75, 'ship', 'scene_a', {'chip_id': 'a'}),
+        Detection(4, 4, 14, 14, 0.25, 'ship', 'scene_a', {'chip_id': 'b'}),
+    ]
+    merged = merge_cluster(cluster)
+    assert (merged.x_min, merged.y_min, merged.x_max, merged.y_max) == (1, 1, 11, 11)
+    assert merged.score == 0.75 and merged.metadata == {'chip_id': 'a'}
+    assert merge_cluster(cluster[:1]) is cluster[0]
+    
+    detections = _detections(120, seed=7)
+    merged = merge_detections(detections, iou_threshold=0.2)
+    assert len(merged) < len(detections)
+    
+    # Batches merge within each image
+    batch = merge_detections(DetectionBatch.from_detections(detections), iou_threshold=0.2)
+    per_image = []
+    for image in ('scene_a', 'scene_b'):
+        per_image += merge_detections([d for d in detections if d.target_filename == image], iou_threshold=0.2)
+    assert batch.to_detections() == [
+        Detection(d.x_min, d.y_min, d.x_max, d.y_max, d.score, d.class_name, d.target_filename,
+                  {'chip_id': d.metadata['chip_id'], 'scale': 1.0})
+        for d in per_image
+    ]
@@ -9,7 +9,7 @@ from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from engine.tiler import TileGenerator, tile_image, reconstruct_from_tiles
+from engine.tiler import TileGenerator, tile_image, reconstruct_from_tiles, stack_tiles, route_scales
 
 
 def test_tile_generator_basic():
@@ -111,3 +111,33 @@ def test_iterator():
         count += 1
     
     assert count > 0
+
+
+def test_stack_tiles_half_precision():
+    """Test stacking tiles into a float16 batch buffer"""
+    image = np.random.rand(4, 512, 512).astype(np.float32)
+    
+    tiles = TileGenerator(tile_size=256, stride=256).tile_image(image)
+    batch = stack_tiles(tiles, dtype=np.float16)
+    
+    assert batch.shape == (len(tiles), 4, 256, 256)
+    assert batch.dtype == np.float16
+    assert np.allclose(batch[0], tiles[0].data, atol=1e-3)
+
+
+def test_route_scales():
+    """Test routing chips to tile scales by size"""
+    scales = [1.0, 0.75, 1.33]
+    
+    # Mid-sized chip resolves at every scale
+    assert route_scales(200, 512, scales) == scales
+    
+    # Small chip skips the zoomed-out 0.75x tiles
+    assert route_scales(100, 512, scales) == [1.0, 1.33]
+    
+    # Large chip only fits whole in 0.75x tiles
+    assert route_scales(600, 512, scales) == [0.75]
+    
+    # Nothing compatible: nearest scale
+    assert route_scales(20, 512, scales) == [1.33]
+    assert route_scales(2000, 512, scales) == [0.75]